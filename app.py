@@ -1,7 +1,11 @@
 # app.py
+import hmac
+import json
 import logging
-from flask import Flask, request, jsonify
+from functools import wraps
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+from config import Config
 from main_handler import MainHandler
 
 # --- 日志配置 ---
@@ -35,6 +39,80 @@ def chat():
         logging.error(f"处理查询 '{query}' 时发生错误: {e}", exc_info=True)
         return jsonify({"error": "处理您的请求时发生内部错误。"}), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    流式问答（Server-Sent Events）：先推送 context 事件（意图、实体与知识图谱内容），
+    再逐段推送 token 事件，生成结束后推送 done 事件（完整回答）；
+    生成失败时推送 error 事件且不再推送 done。客户端断开连接时停止后台生成。
+    """
+    if not handler:
+        return jsonify({"error": "服务未成功初始化，请检查日志。"}), 500
+
+    data = request.json
+    query = data.get('query')
+
+    if not query:
+        return jsonify({"error": "请求中缺少 'query' 参数。"}), 400
+
+    def sse(event, payload):
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    def generate():
+        stream = handler.process_query_stream(query)
+        try:
+            for event, payload in stream:
+                yield sse(event, payload)
+        except GeneratorExit:
+            # 客户端断开连接：关闭处理流程，取消仍在进行的生成
+            logging.info(f"客户端已断开，停止流式查询 '{query}'")
+            stream.close()
+            raise
+        except Exception as e:
+            logging.error(f"流式处理查询 '{query}' 时发生错误: {e}", exc_info=True)
+            yield sse('error', {"error": "处理您的请求时发生内部错误。"})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def admin_required(view):
+    """
+    管理接口鉴权：配置了 Config.ADMIN_API_TOKEN 时校验 X-Admin-Token 请求头，
+    否则只允许本机访问（清空缓存在快照后端下会重新加载整个图快照，不能对外开放）。
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = Config.ADMIN_API_TOKEN
+        if token:
+            allowed = hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token)
+        else:
+            allowed = request.remote_addr in ('127.0.0.1', '::1')
+        if not allowed:
+            return jsonify({"error": "无权访问管理接口。"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/api/cache/invalidate', methods=['POST'])
+@admin_required
+def invalidate_cache():
+    """数据导入完成后由导入脚本调用，清空查询缓存。"""
+    if not handler:
+        return jsonify({"error": "服务未成功初始化，请检查日志。"}), 500
+
+    handler.invalidate_caches()
+    return jsonify({"status": "ok"})
+
+@app.route('/api/cache/stats', methods=['GET'])
+@admin_required
+def cache_stats():
+    if not handler:
+        return jsonify({"error": "服务未成功初始化，请检查日志。"}), 500
+
+    return jsonify(handler.cache_stats())
+
 if __name__ == '__main__':
     # 请不要在生产环境中使用Flask自带的服务器
     app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
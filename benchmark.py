@@ -0,0 +1,334 @@
+# benchmark.py
+import argparse
+import json
+import logging
+import multiprocessing
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 默认的基准测试查询
+SAMPLE_QUERIES = [
+    "风寒了吃什么药", "感冒的病因", "高血压患者饮食需要注意什么", "糖尿病应该做哪些检查",
+    "头痛恶心呕吐是什么病", "肺炎挂哪个科室", "胃炎不能吃什么", "布洛芬可以治疗偏头痛吗",
+    "冠心病有哪些并发症", "经常失眠多梦怎么办", "慢性支气管炎怎么治疗", "小儿腹泻吃什么好",
+    "痛风患者可以吃海鲜吗", "乳腺增生需要做B超吗", "肾结石的症状有哪些", "过敏性鼻炎如何预防"
+]
+
+
+def _load_sentences(file_path, limit):
+    if not file_path:
+        return SAMPLE_QUERIES
+    with open(file_path, 'r', encoding='utf-8') as f:
+        sentences = [line.strip() for line in f if line.strip()]
+    return sentences[:limit] if limit else sentences
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _measure(module, sentences, infer, batch_size, repeats, rss_start, rss_loaded):
+    """预热一轮并收集输出，再按批重复推理，返回延迟与内存统计。"""
+    import psutil
+
+    batches = [sentences[i:i + batch_size] for i in range(0, len(sentences), batch_size)]
+    outputs = [item for batch in batches for item in infer(batch)]  # 预热
+
+    latencies = []
+    for _ in range(repeats):
+        for batch in batches:
+            start = time.perf_counter()
+            infer(batch)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'backend': module.backend,
+        'batches': len(latencies),
+        'mean_ms': statistics.mean(latencies),
+        'p50_ms': _percentile(latencies, 0.5),
+        'p95_ms': _percentile(latencies, 0.95),
+        'rss_loaded_mb': rss_loaded / 2 ** 20,
+        'rss_model_mb': (rss_loaded - rss_start) / 2 ** 20,
+        'rss_end_mb': psutil.Process().memory_info().rss / 2 ** 20,
+        'outputs': outputs,
+    }
+
+
+def _ner_backend_worker(backend, quantize, sentences, batch_size, repeats):
+    """在独立进程中加载一种NER后端并测量延迟与内存，避免不同后端的内存占用互相干扰。"""
+    import psutil
+    from config import Config
+    from modules.medical_ner_module import MedicalNERModule
+
+    Config.NER_BACKEND_CONFIG.update(backend=backend, quantize=quantize)
+    rss_start = psutil.Process().memory_info().rss
+    module = MedicalNERModule()
+    rss_loaded = psutil.Process().memory_info().rss
+    return _measure(module, sentences, module.extract_entities_batch, batch_size, repeats, rss_start, rss_loaded)
+
+
+def _intent_backend_worker(backend, quantize, sentences, batch_size, repeats):
+    """在独立进程中加载一种意图编码后端；关闭查询向量缓存，使每次推理都真正执行编码。"""
+    import psutil
+    from config import Config
+    from modules.medical_intent_module import MedicalIntentModule
+
+    Config.INTENT_BACKEND_CONFIG.update(backend=backend, quantize=quantize)
+    Config.EMBEDDING_CACHE_CONFIG['enabled'] = False
+    rss_start = psutil.Process().memory_info().rss
+    module = MedicalIntentModule()
+    rss_loaded = psutil.Process().memory_info().rss
+    return _measure(module, sentences, module.recognize_intents_batch, batch_size, repeats, rss_start, rss_loaded)
+
+
+def _compare_backends(worker, variants, sentences, batch_size, repeats):
+    """
+    每种后端在独立的子进程中测量，并统计各后端输出与第一个（fp32 torch）后端完全一致的比例。
+    """
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for backend, quantize in variants:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results.append(executor.submit(worker, backend, quantize, sentences, batch_size, repeats).result())
+
+    reference = results[0]['outputs']
+    for result in results:
+        outputs = result.pop('outputs')
+        result['identical_ratio'] = sum(a == b for a, b in zip(outputs, reference)) / len(reference)
+        result['speedup'] = results[0]['mean_ms'] / result['mean_ms']
+        logger.info(
+            f"{result['backend']:>10}: mean={result['mean_ms']:.1f}ms p50={result['p50_ms']:.1f}ms "
+            f"p95={result['p95_ms']:.1f}ms 加速比={result['speedup']:.2f}x rss={result['rss_loaded_mb']:.0f}MB "
+            f"(模型 {result['rss_model_mb']:.0f}MB) 与torch一致={result['identical_ratio']:.2%}"
+        )
+    return results
+
+
+def benchmark_ner_backends(sentences, batch_size=8, repeats=5):
+    """对比 torch、ONNX、ONNX int8 三种NER推理后端的批处理延迟、常驻内存与抽取结果一致性。"""
+    variants = [('torch', False), ('onnx', False), ('onnx', True)]
+    return _compare_backends(_ner_backend_worker, variants, sentences, batch_size, repeats)
+
+
+def benchmark_intent_backends(sentences, batch_size=8, repeats=5):
+    """对比 torch、torch int8、ONNX、ONNX int8 四种意图编码后端的延迟、常驻内存与意图识别结果一致性。"""
+    variants = [('torch', False), ('torch-int8', False), ('onnx', False), ('onnx', True)]
+    return _compare_backends(_intent_backend_worker, variants, sentences, batch_size, repeats)
+
+
+def benchmark_micro_batching(sentences, concurrency_levels=(1, 4, 16), requests_per_level=256):
+    """
+    以不同并发数调用 NERIntentModule.analyze_query，对比开启与关闭请求合并时的吞吐量（查询/秒）。
+    """
+    from modules.batching_module import MicroBatcher
+    from modules.ner_intent_module import NERIntentModule
+
+    module = NERIntentModule()
+    batcher = module._batcher or MicroBatcher(module.analyze_queries)
+    queries = [sentences[i % len(sentences)] for i in range(requests_per_level)]
+    module.intent_model.query_cache = None  # 关闭查询向量缓存，使每次查询都真正执行编码
+
+    results = []
+    for concurrency in concurrency_levels:
+        for batching in (False, True):
+            module._batcher = batcher if batching else None
+            before = batcher.stats()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                start = time.perf_counter()
+                list(executor.map(module.analyze_query, queries))
+                elapsed = time.perf_counter() - start
+            after = batcher.stats()
+            batches = after['batches'] - before['batches']
+            result = {
+                'concurrency': concurrency,
+                'batching': batching,
+                'qps': len(queries) / elapsed,
+                'avg_batch_size': (after['requests'] - before['requests']) / batches if batches else 1.0,
+            }
+            logger.info(
+                f"并发 {concurrency:>3} {'合并' if batching else '逐条'}: "
+                f"{result['qps']:.1f} 查询/秒, 平均批大小 {result['avg_batch_size']:.1f}"
+            )
+            results.append(result)
+    module._batcher = batcher
+    return results
+
+
+def benchmark_bies_decoding(num_sentences=10000, max_length=64, repeats=3, seed=0):
+    """
+    用随机生成的BIES标签（模拟模型输出，含padding）对比逐位置扫描与向量化两种解码实现的耗时，并校验结果一致。
+    """
+    import numpy as np
+    from modules.medical_ner_module import MedicalNerModel
+
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(4, max_length + 1, size=num_sentences)
+    # O 占多数，B/I/E 次之，另有少量PAD，覆盖各种不规范的标签序列
+    labels = rng.choice(5, size=(num_sentences, max_length), p=[0.02, 0.12, 0.16, 0.1, 0.6])
+    labels[np.arange(max_length) >= lengths[:, None]] = 0
+    lengths = lengths.tolist()
+
+    timings = {}
+    outputs = {}
+    for name, decode in (('loop', MedicalNerModel._decode_spans_loop), ('vectorized', MedicalNerModel.decode_spans)):
+        elapsed = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            outputs[name] = decode(labels, lengths)
+            elapsed.append((time.perf_counter() - start) * 1000)
+        timings[name] = min(elapsed)
+
+    result = {
+        'sentences': num_sentences,
+        'loop_ms': timings['loop'],
+        'vectorized_ms': timings['vectorized'],
+        'speedup': timings['loop'] / timings['vectorized'],
+        'identical': outputs['loop'] == outputs['vectorized'],
+    }
+    logger.info(
+        f"BIES解码 {num_sentences} 句: 逐位置扫描 {result['loop_ms']:.1f}ms, "
+        f"向量化 {result['vectorized_ms']:.1f}ms, 加速比 {result['speedup']:.1f}x, 结果一致: {result['identical']}"
+    )
+    return result
+
+
+def benchmark_llm_scheduler(sentences, concurrency_levels=(1, 2, 4, 8), requests_per_level=16, max_new_tokens=64):
+    """
+    以不同并发数生成回答，对比各线程直接调用 model.generate 与经连续批处理调度器合批生成时的
+    总吞吐量（生成token/秒）与单请求延迟。
+    """
+    import torch
+    from modules.llm_module import (
+        DEVICE, _merge_generation_config, _model_generate_kwargs, build_prompt, load_model_and_tokenizer
+    )
+    from modules.scheduler_module import ContinuousBatchScheduler
+
+    model, tokenizer = load_model_and_tokenizer()
+    if model is None:
+        raise RuntimeError("ChatGLM 模型/分词器加载失败")
+    scheduler = ContinuousBatchScheduler(model, tokenizer, max_batch_size=max(concurrency_levels))
+    gen_kwargs = _merge_generation_config({'max_new_tokens': max_new_tokens})
+    prompts = [build_prompt(sentences[i % len(sentences)]) for i in range(requests_per_level)]
+
+    def direct(prompt):
+        inputs = tokenizer(prompt, return_tensors="pt").to(DEVICE)
+        with torch.no_grad():
+            output_ids = model.generate(**inputs, **_model_generate_kwargs(tokenizer, gen_kwargs, inputs.input_ids.shape[1]))
+        return output_ids.shape[1] - inputs.input_ids.shape[1]
+
+    def batched(prompt):
+        inputs = tokenizer(prompt, return_tensors="pt")
+        return len(scheduler.generate(inputs.input_ids[0], gen_kwargs))
+
+    results = []
+    for concurrency in concurrency_levels:
+        for mode, generate in (('direct', direct), ('scheduler', batched)):
+            latencies = []
+
+            def timed(prompt):
+                start = time.perf_counter()
+                tokens = generate(prompt)
+                latencies.append((time.perf_counter() - start) * 1000)
+                return tokens
+
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                start = time.perf_counter()
+                tokens = sum(executor.map(timed, prompts))
+                elapsed = time.perf_counter() - start
+            result = {
+                'concurrency': concurrency,
+                'mode': mode,
+                'tokens': tokens,
+                'tokens_per_sec': tokens / elapsed,
+                'p50_ms': _percentile(latencies, 0.5),
+                'p95_ms': _percentile(latencies, 0.95),
+            }
+            logger.info(
+                f"并发 {concurrency:>3} {mode:>9}: {result['tokens_per_sec']:.1f} token/秒, "
+                f"p50 {result['p50_ms']:.0f}ms, p95 {result['p95_ms']:.0f}ms"
+            )
+            results.append(result)
+    scheduler.close()
+    return results
+
+
+def benchmark_generation_budget(sentences):
+    """
+    先识别每条查询的意图，再分别以统一的默认生成参数（不含停止序列）与按意图的生成配置（含免责声明停止条件）
+    逐条生成回答，对比平均生成token数与延迟分位数。
+    """
+    import torch
+    from modules.llm_module import (
+        DEVICE, GENERATION_CONFIG, _merge_generation_config, _model_generate_kwargs, build_prompt,
+        load_model_and_tokenizer
+    )
+    from modules.ner_intent_module import NERIntentModule
+
+    intents = [analysis['intent'] for analysis in NERIntentModule().analyze_queries(sentences)]
+    model, tokenizer = load_model_and_tokenizer()
+    if model is None:
+        raise RuntimeError("ChatGLM 模型/分词器加载失败")
+    baseline = {**GENERATION_CONFIG, 'stop_sequences': None}
+
+    results = []
+    for mode in ('default', 'profile'):
+        tokens, latencies = [], []
+        for query, intent in zip(sentences, intents):
+            cfg = _merge_generation_config(baseline if mode == 'default' else None, None if mode == 'default' else intent)
+            inputs = tokenizer(build_prompt(query), return_tensors="pt").to(DEVICE)
+            start = time.perf_counter()
+            with torch.no_grad():
+                output_ids = model.generate(**inputs, **_model_generate_kwargs(tokenizer, cfg, inputs.input_ids.shape[1]))
+            latencies.append((time.perf_counter() - start) * 1000)
+            tokens.append(output_ids.shape[1] - inputs.input_ids.shape[1])
+        result = {
+            'mode': mode,
+            'queries': len(sentences),
+            'avg_tokens': statistics.mean(tokens),
+            'p50_ms': _percentile(latencies, 0.5),
+            'p95_ms': _percentile(latencies, 0.95),
+        }
+        logger.info(
+            f"{mode:>7}: 平均生成 {result['avg_tokens']:.1f} token, "
+            f"p50 {result['p50_ms']:.0f}ms, p95 {result['p95_ms']:.0f}ms"
+        )
+        results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="推理性能基准测试")
+    parser.add_argument('target', choices=['ner-backend', 'intent-backend', 'micro-batch', 'bies-decode', 'llm-scheduler',
+                                           'generation-budget'],
+                        help="ner-backend=对比NER模型 torch/ONNX/ONNX int8 推理后端的延迟与内存, "
+                             "intent-backend=对比意图编码模型 torch/torch int8/ONNX/ONNX int8 推理后端, "
+                             "micro-batch=对比不同并发下开启/关闭请求合并时NER与意图识别的吞吐量, "
+                             "bies-decode=对比1万句BIES标签的逐位置扫描与向量化解码耗时（无需模型）, "
+                             "llm-scheduler=对比不同并发下直接生成与连续批处理调度生成的token吞吐量, "
+                             "generation-budget=对比统一生成参数与按意图生成配置的平均生成token数与延迟")
+    parser.add_argument('--file', default=None, help="每行一个查询的文本文件，不指定时使用内置示例查询")
+    parser.add_argument('--limit', type=int, default=None, help="最多使用的查询条数")
+    parser.add_argument('--batch-size', type=int, default=8, help="每次推理的句子数")
+    parser.add_argument('--repeats', type=int, default=5, help="重复测量的轮数")
+    parser.add_argument('--max-new-tokens', type=int, default=64, help="llm-scheduler 每个请求最多生成的token数")
+    args = parser.parse_args()
+
+    queries = _load_sentences(args.file, args.limit)
+    if args.target == 'ner-backend':
+        report = benchmark_ner_backends(queries, batch_size=args.batch_size, repeats=args.repeats)
+    elif args.target == 'intent-backend':
+        report = benchmark_intent_backends(queries, batch_size=args.batch_size, repeats=args.repeats)
+    elif args.target == 'micro-batch':
+        report = benchmark_micro_batching(queries)
+    elif args.target == 'bies-decode':
+        report = benchmark_bies_decoding(repeats=args.repeats)
+    elif args.target == 'llm-scheduler':
+        report = benchmark_llm_scheduler(queries, max_new_tokens=args.max_new_tokens)
+    elif args.target == 'generation-budget':
+        report = benchmark_generation_budget(queries)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
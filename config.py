@@ -8,7 +8,43 @@ class Config:
     NEO4J_USER = os.environ.get('NEO4J_USER', 'neo4j')
     NEO4J_PASSWORD = os.environ.get('NEO4J_PASSWORD', '123456') # 请修改为你的密码
 
-  
+    # --- Neo4j 连接池与超时配置（同步与异步驱动共用） ---
+    NEO4J_POOL_CONFIG = {
+        'max_connection_pool_size': 50,
+        'connection_acquisition_timeout': 5.0,  # 从连接池获取连接的超时（秒）
+        'connection_timeout': 5.0               # 建立新连接的超时（秒）
+    }
+    # 单个查询事务的超时（秒），超时后由数据库终止事务
+    NEO4J_QUERY_TIMEOUT = 3.0
+
+    # --- 知识图谱后端配置 ---
+    # 'neo4j': 每次查询实时访问Neo4j；'snapshot': 启动时加载一次进程内图快照，查询不再访问数据库
+    KG_BACKEND = os.environ.get('KG_BACKEND', 'neo4j')
+    # 快照数据来源：'neo4j' 从数据库加载，'json' 直接从数据文件加载（无需数据库）
+    KG_SNAPSHOT_SOURCE = os.environ.get('KG_SNAPSHOT_SOURCE', 'neo4j')
+    KG_SNAPSHOT_JSON_PATH = os.environ.get('KG_SNAPSHOT_JSON_PATH', './data/data.json')
+
+    # --- 管理接口（/api/cache/invalidate、/api/cache/stats）访问令牌 ---
+    # 设置后请求需在 X-Admin-Token 头中携带该令牌；未设置时管理接口只接受来自本机的请求
+    ADMIN_API_TOKEN = os.environ.get('ADMIN_API_TOKEN')
+
+    # 根据症状推断疾病时返回的候选疾病数
+    SYMPTOM_INFERENCE_TOP_K = 10
+
+    # --- 知识图谱查询缓存配置 ---
+    KG_CACHE_CONFIG = {
+        'enabled': True,
+        'max_size': 2048,  # 最多缓存的 (意图, 实体) 组合数
+        'ttl': 3600        # 缓存过期时间（秒）
+    }
+
+    # --- 关键词词典配置 ---
+    KEYWORD_CONFIG = {
+        # 是否把图谱中的全部节点名称并入症状/疾病关键词自动机，并用于NER实体类型判定
+        'use_graph_names': False,
+        'min_name_length': 2  # 并入关键词自动机的节点名称最小长度，过滤过短易误匹配的名称
+    }
+
     # ChatGLM 模型本地路径
     # 请确保您的glm模型实际存放在 './models/chatglm2-6b-int4'
     CHATGLM_PATH = os.path.join('./models/modelscope/ZhipuAI/', 'chatglm2-6b-int4')
@@ -17,10 +53,78 @@ class Config:
     # 根据您的描述，它现在位于 './models/bert-base-chinese-medical-ner'
     NER_MODEL_NAME = os.path.join('./models', 'bert-base-chinese-medical-ner')
     
+    # --- NER 批量推理配置 ---
+    NER_BATCH_CONFIG = {
+        'batch_size': 32,     # 按长度分桶后每桶（一次前向推理）的最大序列数
+        'max_length': 512,    # 单个窗口的最大token数，超长文本切分为多个窗口
+        'window_overlap': 64  # 相邻窗口重叠的token数
+    }
+
+    # --- NER 推理后端配置 ---
+    NER_BACKEND_CONFIG = {
+        'backend': os.environ.get('NER_BACKEND', 'torch'),  # 'torch' / 'onnx'（ONNX Runtime，仅CPU）
+        'onnx_path': os.path.join('./models', 'onnx', 'bert-base-chinese-medical-ner.onnx'),
+        'quantize': True,          # 是否对ONNX模型做动态int8量化
+        'intra_op_threads': None,  # ONNX Runtime 单算子并行线程数，None 表示按 STAGE_PARALLEL_CONFIG 的本阶段线程数（未开启阶段并行时为物理核心数）
+        'min_agreement': 0.99      # 加载时与torch输出的逐token一致率下限，低于该值回退到torch
+    }
+
     # 意图识别模型本地路径
     # 根据您的描述，它现在位于 './models/text2vec-base-chinese'
     INTENT_MODEL_NAME = os.path.join('./models', 'text2vec-base-chinese')
 
+    # --- 意图识别推理后端配置 ---
+    INTENT_BACKEND_CONFIG = {
+        # 'torch': fp32 SentenceTransformer；'torch-int8': torch 动态int8量化；'onnx': ONNX Runtime（仅CPU）
+        'backend': os.environ.get('INTENT_BACKEND', 'torch'),
+        'onnx_path': os.path.join('./models', 'onnx', 'text2vec-base-chinese.onnx'),
+        'quantize': True,          # onnx 后端是否做动态int8量化
+        'intra_op_threads': None,  # ONNX Runtime 单算子并行线程数，None 表示按 STAGE_PARALLEL_CONFIG 的本阶段线程数（未开启阶段并行时为物理核心数）
+        # 加载时以模板集验证：准确率相对fp32的最大下降幅度，以及模板向量与fp32的最小余弦相似度
+        'max_accuracy_drop': 0.0,
+        'min_cosine': 0.95
+    }
+
+    # --- NER与意图识别的请求合并（微批处理）配置 ---
+    MICRO_BATCH_CONFIG = {
+        'enabled': True,
+        'max_batch_size': 16,  # 每批最多合并的查询数
+        'max_wait_ms': 5       # 收到第一条查询后等待更多查询的最长时间（毫秒）
+    }
+
+    # --- NER与意图识别的阶段并行配置 ---
+    STAGE_PARALLEL_CONFIG = {
+        'enabled': True,
+        'ner_threads': None,    # NER阶段ONNX Runtime会话的intra_op线程数，None 表示使用一半物理核心（torch的线程数为进程级设置，不按阶段划分）
+        'intent_threads': None  # 意图识别阶段ONNX Runtime会话的intra_op线程数，None 表示使用剩余的物理核心
+    }
+
+    # --- 意图识别配置 ---
+    INTENT_CONFIG = {
+        'aggregation': 'mean',  # 模板相似度的聚合方式: 'mean' / 'max' / 'topk_mean'
+        'top_k': 3,             # aggregation 为 'topk_mean' 时取每个意图最相似的前k个模板
+        'threshold': 0.3,       # 最高得分低于该值时返回 unknown_intent
+        # 模板向量的磁盘缓存目录（按模型与模板内容的哈希命名，变化时自动重建），设为None可关闭
+        'embedding_cache_dir': os.path.join('./cache', 'intent_embeddings')
+    }
+
+    # --- 查询向量缓存配置（意图识别与下游组件共用） ---
+    EMBEDDING_CACHE_CONFIG = {
+        'enabled': True,
+        'max_size': 4096,              # 最多缓存的查询数
+        'max_bytes': 64 * 1024 * 1024  # 向量合计占用的内存上限（字节）
+    }
+
+    # --- 问答结果缓存配置 ---
+    ANSWER_CACHE_CONFIG = {
+        'enabled': True,
+        'max_size': 1024,              # 最多缓存的回答数，超出时按LRU淘汰
+        # 改写查询的近似匹配阈值（查询向量余弦相似度），设为None只做 (意图, 实体, 知识图谱内容) 精确匹配
+        'similarity_threshold': 0.95,
+        'persist_path': None,          # 持久化文件路径，如 os.path.join('./cache', 'answer_cache.npz')；None 表示仅缓存在内存中
+        'persist_interval': 60         # 后台写盘间隔（秒），退出时另写一次
+    }
+
     # --- LangChain配置 ---
     LANGCHAIN_CONFIG = {
         'verbose': True,
@@ -29,14 +133,35 @@ class Config:
         'top_p': 0.9
     }
     
+    # 每个回答结尾必须追加的免责声明（写入Prompt，生成出该句后即停止生成）
+    DISCLAIMER = "我只是一个语言模型，具体情况请您咨询医生，提供的方案仅供参考。"
+
     # --- LLM 生成参数 ---
     GENERATION_CONFIG = {
-        'max_length': 2048,
         'max_new_tokens': 512,  # 添加新token数量限制
         'temperature': 0.8,
         'top_p': 0.9,
         'do_sample': True,
-        'repetition_penalty': 1.1
+        'repetition_penalty': 1.1,
+        'stop_sequences': [DISCLAIMER]  # 生成出任一停止序列后即停止，停止序列保留在回答中
+    }
+
+    # --- 按意图的生成配置（覆盖 GENERATION_CONFIG 中的同名参数） ---
+    # 事实性的短问题使用贪心解码与较小的token预算；需要组织建议的问题保留采样与较大的预算
+    GENERATION_PROFILES = {
+        'query_department': {'max_new_tokens': 128, 'do_sample': False},
+        'query_symptom': {'max_new_tokens': 256, 'do_sample': False},
+        'query_drug': {'max_new_tokens': 256, 'do_sample': False},
+        'query_check': {'max_new_tokens': 256, 'do_sample': False},
+        'query_complication': {'max_new_tokens': 256, 'do_sample': False},
+        'query_food_avoid': {'max_new_tokens': 256, 'do_sample': False},
+        'query_food_recommend': {'max_new_tokens': 256, 'do_sample': False},
+        'query_desc': {'max_new_tokens': 384},
+        'query_cause': {'max_new_tokens': 384},
+        'query_prevent': {'max_new_tokens': 384},
+        'unknown_intent': {'max_new_tokens': 384},
+        'query_cure_way': {'max_new_tokens': 512},
+        'find_disease_by_symptom': {'max_new_tokens': 512},
     }
 
     # --- 设备配置 ---
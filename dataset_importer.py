@@ -1,6 +1,13 @@
+import argparse
+import csv
+import hashlib
 import json
 import os
+import time
+import urllib.request
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from neo4j import GraphDatabase
+from modules.graph_schema_module import NODE_LABELS, RELATIONSHIP_SPECS, disease_properties, iter_jsonl
 
 class MedicalGraphImporter:
     """
@@ -16,6 +23,7 @@ class MedicalGraphImporter:
         self._user = user
         self._password = password
         self._driver = None
+        self._refresh_hooks = []
         try:
             self._driver = GraphDatabase.driver(self._uri, auth=(self._user, self._password))
             print("成功连接到Neo4j数据库。")
@@ -28,6 +36,21 @@ class MedicalGraphImporter:
             self._driver.close()
             print("数据库连接已关闭。")
 
+    def add_refresh_hook(self, callback):
+        """
+        注册数据刷新回调（例如 KnowledgeGraphModule.invalidate_cache），每次导入成功后调用。
+        :param callback: 无参数的可调用对象。
+        """
+        self._refresh_hooks.append(callback)
+
+    def _notify_refresh(self):
+        """依次调用已注册的数据刷新回调，单个回调失败不影响导入结果。"""
+        for callback in self._refresh_hooks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"数据刷新回调执行失败: {e}")
+
     def _execute_query(self, query, parameters=None):
         """
         一个私有的辅助函数，用于执行Cypher查询。
@@ -67,69 +90,535 @@ class MedicalGraphImporter:
 
     def import_data(self, json_file_path):
         """
-        主函数，用于读取JSONL文件并导入数据。
+        主函数，用于流式读取JSONL文件并逐条导入数据。
         :param json_file_path: JSONL文件的路径（每行一个JSON对象）。
         """
-        # 检查文件是否存在
+        if not self._check_data_file(json_file_path):
+            return False
+
+        file_size = os.path.getsize(json_file_path)
+        try:
+            for i, (offset, disease_data) in enumerate(iter_jsonl(json_file_path)):
+                disease_name = disease_data.get('name')
+                if not disease_name:
+                    print(f"第 {i+1} 条数据缺少疾病名称，跳过")
+                    continue
+
+                print(f"正在处理: {disease_name} (第 {i+1} 条, {offset / max(file_size, 1):.1%})")
+
+                try:
+                    # 1. 创建疾病节点并设置其属性
+                    disease_props = disease_properties(disease_data)
+                    query = "MERGE (d:Disease {name: $name}) SET d += $props"
+                    self._execute_query(query, parameters={'name': disease_name, 'props': disease_props})
+
+                    # 2. 创建并关联相关节点
+                    for json_key, node_label, rel_type in RELATIONSHIP_SPECS:
+                        self._create_relationships(disease_name, json_key, node_label, rel_type, disease_data)
+                except Exception as e:
+                    print(f"处理疾病 '{disease_name}' 时发生错误: {e}")
+                    continue
+        except OSError as e:
+            print(f"读取文件时发生错误: {e}")
+            return False
+
+        print("数据导入完成！")
+        self._notify_refresh()
+        return True
+
+    def _check_data_file(self, json_file_path):
+        """
+        检查数据文件是否存在。
+        :param json_file_path: JSONL文件的路径。
+        """
         if not os.path.exists(json_file_path):
             print(f"错误: 找不到文件 '{json_file_path}'")
             print(f"当前工作目录: {os.getcwd()}")
             print("请确认文件路径是否正确，或将文件放在正确的位置。")
             return False
-            
+
         print(f"开始从 {json_file_path} 导入JSONL数据...")
-        
+        return True
+
+    @staticmethod
+    def _iter_batches(records, batch_size):
+        """
+        将 (偏移, 数据) 流切分为有界的批次。
+        :param records: iter_jsonl 产出的迭代器。
+        :param batch_size: 每批的疾病条数。
+        :return: 逐批产出 (疾病数据列表, 本批最后一条的结束偏移)。
+        """
+        batch = []
+        end_offset = None
+        for end_offset, disease_data in records:
+            batch.append(disease_data)
+            if len(batch) >= batch_size:
+                yield batch, end_offset
+                batch = []
+        if batch:
+            yield batch, end_offset
+
+    @staticmethod
+    def _load_checkpoint(checkpoint_path, json_file_path):
+        """
+        读取断点文件，返回可续传的字节偏移；数据文件已变化或无断点时返回0。
+        :param checkpoint_path: 断点文件路径。
+        :param json_file_path: JSONL文件的路径。
+        """
+        if not os.path.exists(checkpoint_path):
+            return 0
+        try:
+            with open(checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"断点文件读取失败，将从头导入: {e}")
+            return 0
+
+        stat = os.stat(json_file_path)
+        if checkpoint.get('size') != stat.st_size or checkpoint.get('mtime') != stat.st_mtime:
+            print("数据文件自上次导入后已变化，忽略断点并从头导入。")
+            return 0
+        return checkpoint.get('offset', 0)
+
+    @staticmethod
+    def _save_checkpoint(checkpoint_path, json_file_path, offset):
+        """
+        原子地写入断点文件（先写临时文件再替换）。
+        :param checkpoint_path: 断点文件路径。
+        :param json_file_path: JSONL文件的路径。
+        :param offset: 已成功提交的最后一条数据的结束字节偏移。
+        """
+        stat = os.stat(json_file_path)
+        checkpoint = {'offset': offset, 'size': stat.st_size, 'mtime': stat.st_mtime}
+        tmp_path = f"{checkpoint_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, checkpoint_path)
+
+    def import_data_batched(self, json_file_path, batch_size=500, resume=True, checkpoint_path=None):
+        """
+        批量导入模式：流式读取疾病数据并按批次分组，每批在一个事务内用参数化的UNWIND语句
+        写入疾病节点和每一种关系，避免逐条MERGE带来的大量网络往返。
+        每批提交后记录字节偏移断点，中断后再次运行会从断点继续。
+        :param json_file_path: JSONL文件的路径（每行一个JSON对象）。
+        :param batch_size: 每个事务包含的疾病条数。
+        :param resume: 是否从上次的断点继续导入。
+        :param checkpoint_path: 断点文件路径，默认为 "<数据文件>.checkpoint"。
+        """
+        if self._driver is None:
+            print("数据库未连接，无法执行查询。")
+            return False
+
+        if not self._check_data_file(json_file_path):
+            return False
+
+        checkpoint_path = checkpoint_path or f"{json_file_path}.checkpoint"
+        start_offset = self._load_checkpoint(checkpoint_path, json_file_path) if resume else 0
+        file_size = os.path.getsize(json_file_path)
+        if start_offset:
+            print(f"从断点续传: 字节偏移 {start_offset}/{file_size}")
+        print(f"批大小: {batch_size}")
+
+        start_time = time.perf_counter()
+        total_diseases = 0
+        total_rows = 0
         try:
-            data = []
-            with open(json_file_path, 'r', encoding='utf-8') as f:
-                for line_num, line in enumerate(f, 1):
-                    line = line.strip()
-                    if not line:  # 跳过空行
-                        continue
+            with self._driver.session() as session:
+                records = iter_jsonl(json_file_path, start_offset)
+                for batch, end_offset in self._iter_batches(records, batch_size):
                     try:
-                        json_obj = json.loads(line)
-                        data.append(json_obj)
-                    except json.JSONDecodeError as e:
-                        print(f"第 {line_num} 行JSON格式错误: {e}")
-                        continue
-        except Exception as e:
+                        rows = session.execute_write(self._write_batch, batch)
+                    except Exception as e:
+                        # 停止导入并保留断点，修复问题后重新运行即可从此批继续
+                        print(f"写入第 {total_diseases + 1}-{total_diseases + len(batch)} 条数据时发生错误: {e}")
+                        print(f"导入已中断，断点保存在 {checkpoint_path}")
+                        return False
+                    self._save_checkpoint(checkpoint_path, json_file_path, end_offset)
+                    total_diseases += len(batch)
+                    total_rows += rows
+                    elapsed = time.perf_counter() - start_time
+                    print(f"已处理 {total_diseases} 条疾病 ({end_offset / max(file_size, 1):.1%}), "
+                          f"写入 {total_rows} 行 ({total_rows / max(elapsed, 1e-9):.0f} 行/秒)")
+        except OSError as e:
             print(f"读取文件时发生错误: {e}")
             return False
 
-        total_diseases = len(data)
-        print(f"成功读取 {total_diseases} 条疾病数据")
-        
-        for i, disease_data in enumerate(data):
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        elapsed = time.perf_counter() - start_time
+        print(f"批量导入完成！共写入 {total_rows} 行，耗时 {elapsed:.1f} 秒，"
+              f"平均 {total_rows / max(elapsed, 1e-9):.0f} 行/秒")
+        self._notify_refresh()
+        return True
+
+    @classmethod
+    def _build_batch_rows(cls, batch, with_hash=False):
+        """
+        将一批疾病数据整理为UNWIND参数。
+        :param batch: 疾病JSON数据字典列表
+        :param with_hash: 是否为疾病节点行计算内容哈希（仅增量导入需要）
+        :return: (疾病节点行列表, {(节点标签, 关系类型): 关系行列表})
+        """
+        disease_rows = []
+        relationship_rows = {}
+        for disease_data in batch:
             disease_name = disease_data.get('name')
             if not disease_name:
-                print(f"第 {i+1} 条数据缺少疾病名称，跳过")
                 continue
+            disease_props = disease_properties(disease_data)
+            row = {'name': disease_name, 'props': disease_props}
+            if with_hash:
+                row['hash'] = cls._content_hash(disease_data)
+            disease_rows.append(row)
 
-            print(f"正在处理: {disease_name} ({i+1}/{total_diseases})")
+            for json_key, node_label, rel_type in RELATIONSHIP_SPECS:
+                items = disease_data.get(json_key) or []
+                if not items:
+                    continue
+                rows = relationship_rows.setdefault((node_label, rel_type), [])
+                rows.extend({'disease': disease_name, 'item': item} for item in items)
+        return disease_rows, relationship_rows
 
-            try:
-                # 1. 创建疾病节点并设置其属性
-                disease_props = {k: v for k, v in disease_data.items() if isinstance(v, (str, int, float))}
-                query = "MERGE (d:Disease {name: $name}) SET d += $props"
-                self._execute_query(query, parameters={'name': disease_name, 'props': disease_props})
-
-                # 2. 创建并关联相关节点
-                self._create_relationships(disease_name, 'symptom', 'Symptom', 'HAS_SYMPTOM', disease_data)
-                self._create_relationships(disease_name, 'acompany', 'Disease', 'HAS_COMPLICATION', disease_data)
-                self._create_relationships(disease_name, 'common_drug', 'Drug', 'RECOMMENDS_DRUG', disease_data)
-                self._create_relationships(disease_name, 'recommand_drug', 'Drug', 'RECOMMENDS_DRUG', disease_data)
-                self._create_relationships(disease_name, 'check', 'Check', 'NEEDS_CHECK', disease_data)
-                self._create_relationships(disease_name, 'cure_department', 'Department', 'BELONGS_TO_DEPT', disease_data)
-                self._create_relationships(disease_name, 'do_eat', 'Food', 'RECOMMENDS_EAT', disease_data)
-                self._create_relationships(disease_name, 'recommand_eat', 'Food', 'RECOMMENDS_EAT', disease_data)
-                self._create_relationships(disease_name, 'not_eat', 'Food', 'AVOIDS_EAT', disease_data)
-            except Exception as e:
-                print(f"处理疾病 '{disease_name}' 时发生错误: {e}")
-                continue
-                
-        print("数据导入完成！")
+    @classmethod
+    def _write_batch(cls, tx, batch):
+        """
+        在单个事务内写入一批疾病数据（供 session.execute_write 调用）。
+        :return: 本批写入的行数（疾病节点 + 关系）。
+        """
+        disease_rows, relationship_rows = cls._build_batch_rows(batch)
+        written = cls._write_disease_nodes(tx, disease_rows)
+        return written + cls._merge_relationships(tx, relationship_rows)
+
+    @staticmethod
+    def _merge_relationships(tx, relationship_rows):
+        """按关系类型UNWIND写入关系，目标节点不存在时一并创建。"""
+        written = 0
+        for (node_label, rel_type), rows in relationship_rows.items():
+            query = f"""
+            UNWIND $rows AS row
+            MATCH (d:Disease {{name: row.disease}})
+            MERGE (n:{node_label} {{name: row.item}})
+            MERGE (d)-[:{rel_type}]->(n)
+            """
+            tx.run(query, rows=rows)
+            written += len(rows)
+        return written
+
+    @staticmethod
+    def _content_hash(disease_data):
+        """计算单条疾病数据的内容哈希（键排序后的规范JSON的SHA-256），用于增量导入。"""
+        canonical = json.dumps(disease_data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def import_data_delta(self, json_file_path, batch_size=500):
+        """
+        增量导入模式：每个疾病节点上保存内容哈希（content_hash 属性），
+        与数据文件逐条比对，未变化的疾病直接跳过；变化的疾病重置其属性，
+        只删除已不在数据中的关系，再补充新增的关系。
+        批量/并行导入只追加属性和关系、不清理过期数据，因此不写入 content_hash；
+        首次运行增量模式时所有疾病都按新增处理，完整校准一次属性与关系后才会写入哈希。
+        :param json_file_path: JSONL文件的路径（每行一个JSON对象）。
+        :param batch_size: 每个事务包含的变化疾病条数。
+        """
+        if self._driver is None:
+            print("数据库未连接，无法执行查询。")
+            return False
+
+        if not self._check_data_file(json_file_path):
+            return False
+
+        start_time = time.perf_counter()
+        with self._driver.session() as session:
+            existing_hashes = session.execute_read(self._read_content_hashes)
+        print(f"数据库中已有 {len(existing_hashes)} 条带内容哈希的疾病")
+
+        seen_names = set()
+        stats = {'unchanged': 0, 'changed': 0, 'new': 0}
+
+        def changed_records():
+            for offset, disease_data in iter_jsonl(json_file_path):
+                disease_name = disease_data.get('name')
+                if not disease_name:
+                    continue
+                seen_names.add(disease_name)
+                old_hash = existing_hashes.get(disease_name)
+                if old_hash == self._content_hash(disease_data):
+                    stats['unchanged'] += 1
+                    continue
+                stats['new' if old_hash is None else 'changed'] += 1
+                yield offset, disease_data
+
+        total_rows = 0
+        try:
+            with self._driver.session() as session:
+                for batch, _ in self._iter_batches(changed_records(), batch_size):
+                    try:
+                        total_rows += session.execute_write(self._write_delta_batch, batch)
+                    except Exception as e:
+                        print(f"增量写入失败: {e}")
+                        return False
+                    print(f"已更新 {stats['changed'] + stats['new']} 条疾病, 写入 {total_rows} 行")
+        except OSError as e:
+            print(f"读取文件时发生错误: {e}")
+            return False
+
+        removed = len(set(existing_hashes) - seen_names)
+        elapsed = time.perf_counter() - start_time
+        print(f"增量导入完成！新增 {stats['new']} 条，更新 {stats['changed']} 条，"
+              f"跳过未变化 {stats['unchanged']} 条，耗时 {elapsed:.1f} 秒")
+        if removed:
+            print(f"注意: 数据库中有 {removed} 条疾病已不在数据文件中（未自动删除）")
+        if stats['changed'] or stats['new']:
+            self._notify_refresh()
         return True
 
+    @staticmethod
+    def _read_content_hashes(tx):
+        """读取所有疾病节点的内容哈希：{疾病名称: 哈希}。"""
+        result = tx.run(
+            "MATCH (d:Disease) WHERE d.content_hash IS NOT NULL "
+            "RETURN d.name AS name, d.content_hash AS hash"
+        )
+        return {record['name']: record['hash'] for record in result}
+
+    @classmethod
+    def _write_delta_batch(cls, tx, batch):
+        """
+        在单个事务内更新一批已变化的疾病：整体替换疾病属性，删除过期关系，补充新关系。
+        :return: 本批写入的行数（疾病节点 + 关系）。
+        """
+        disease_rows, relationship_rows = cls._build_batch_rows(batch, with_hash=True)
+        # SET d = ... 会移除数据中已不存在的旧属性
+        tx.run(
+            "UNWIND $rows AS row MERGE (d:Disease {name: row.name}) "
+            "SET d = row.props, d.content_hash = row.hash",
+            rows=disease_rows
+        )
+
+        # 每种关系的最新目标列表（同一关系类型可能来自多个JSON键）
+        current_items = {}
+        for disease_data in batch:
+            disease_name = disease_data.get('name')
+            if not disease_name:
+                continue
+            for json_key, node_label, rel_type in RELATIONSHIP_SPECS:
+                items = current_items.setdefault((node_label, rel_type), {}).setdefault(disease_name, [])
+                items.extend(disease_data.get(json_key) or [])
+
+        for (node_label, rel_type), items_by_disease in current_items.items():
+            query = f"""
+            UNWIND $rows AS row
+            MATCH (d:Disease {{name: row.disease}})-[r:{rel_type}]->(n:{node_label})
+            WHERE NOT n.name IN row.items
+            DELETE r
+            """
+            rows = [{'disease': name, 'items': items} for name, items in items_by_disease.items()]
+            tx.run(query, rows=rows)
+
+        return len(disease_rows) + cls._merge_relationships(tx, relationship_rows)
+
+    def import_data_parallel(self, json_file_path, workers=4, batch_size=500):
+        """
+        并行导入模式：使用线程池，每个工作线程持有独立的写会话。
+        第一阶段先创建全部节点（疾病节点及去重后的症状/药物/食物等节点），
+        第二阶段再按疾病划分关系批次，使共享节点上的MERGE不会相互死锁。
+        并行模式下批次乱序完成，因此不使用断点续传；重复运行是幂等的。
+        死锁等瞬时错误由 session.execute_write 按驱动的重试策略自动重试。
+        :param json_file_path: JSONL文件的路径（每行一个JSON对象）。
+        :param workers: 并发写入的线程数。
+        :param batch_size: 每个事务包含的疾病条数。
+        """
+        return self._run_parallel_import(json_file_path, workers, batch_size) is not None
+
+    def benchmark_parallel_import(self, json_file_path, worker_counts=(1, 2, 4, 8), batch_size=500):
+        """
+        对比不同线程数下的并行导入吞吐量。每轮导入前先清空图数据库，
+        使每个线程数都从空库开始写入（幂等的重复导入只会命中已有节点，吞吐量不可比）。
+        注意：会删除数据库中的全部节点和关系，请只在测试库上运行。
+        :param json_file_path: JSONL文件的路径。
+        :param worker_counts: 需要对比的线程数。
+        :param batch_size: 每个事务包含的疾病条数。
+        :return: {线程数: 行/秒}
+        """
+        results = {}
+        for workers in worker_counts:
+            print(f"===== 基准测试: {workers} 个线程 =====")
+            self.clear_graph()
+            stats = self._run_parallel_import(json_file_path, workers, batch_size)
+            if stats is None:
+                print(f"{workers} 个线程的导入失败，跳过。")
+                continue
+            total_rows, elapsed = stats
+            results[workers] = total_rows / max(elapsed, 1e-9)
+
+        print("===== 并行导入基准测试结果 =====")
+        print(f"{'线程数':>6} | {'行/秒':>10} | {'加速比':>6}")
+        baseline = results.get(min(results)) if results else None
+        for workers, rows_per_sec in results.items():
+            print(f"{workers:>6} | {rows_per_sec:>10.0f} | {rows_per_sec / baseline:>6.2f}x")
+        return results
+
+    def clear_graph(self, batch_size=10000):
+        """
+        分批删除全部节点及其关系（每批一个事务，避免单个大事务耗尽内存）。
+        :param batch_size: 每个事务删除的节点数。
+        """
+        if self._driver is None:
+            print("数据库未连接，无法执行查询。")
+            return
+        deleted = 0
+        with self._driver.session() as session:
+            while True:
+                count = session.execute_write(self._delete_nodes, batch_size)
+                deleted += count
+                if count < batch_size:
+                    break
+        print(f"已清空图数据库，删除 {deleted} 个节点")
+
+    @staticmethod
+    def _delete_nodes(tx, batch_size):
+        result = tx.run(
+            "MATCH (n) WITH n LIMIT $limit DETACH DELETE n RETURN count(*) AS deleted",
+            limit=batch_size
+        )
+        return result.single()['deleted']
+
+    def _run_parallel_import(self, json_file_path, workers, batch_size):
+        """
+        执行两阶段并行导入。
+        :return: 成功时返回 (写入行数, 耗时秒数)，失败时返回None。
+        """
+        if self._driver is None:
+            print("数据库未连接，无法执行查询。")
+            return None
+
+        if not self._check_data_file(json_file_path):
+            return None
+
+        start_time = time.perf_counter()
+        # 目标节点名称按标签去重（只保存名称，内存远小于完整数据）
+        node_names = {node_label: set() for _, node_label, _ in RELATIONSHIP_SPECS}
+        disease_names = set()
+
+        def disease_node_batches():
+            for batch, _ in self._iter_batches(iter_jsonl(json_file_path), batch_size):
+                disease_rows, relationship_rows = self._build_batch_rows(batch)
+                disease_names.update(row['name'] for row in disease_rows)
+                for (node_label, _), rows in relationship_rows.items():
+                    node_names[node_label].update(row['item'] for row in rows)
+                yield self._write_disease_nodes, disease_rows
+
+        def item_node_batches():
+            # 并发症同样是Disease节点，已作为疾病节点创建的无需重复写入
+            node_names['Disease'] -= disease_names
+            chunk_size = batch_size * 10
+            for node_label, names in node_names.items():
+                names = list(names)
+                for chunk_start in range(0, len(names), chunk_size):
+                    yield self._write_nodes, (node_label, names[chunk_start:chunk_start + chunk_size])
+
+        def relationship_batches():
+            # 每个批次包含若干完整疾病的全部关系，按疾病划分互不重叠
+            for batch, _ in self._iter_batches(iter_jsonl(json_file_path), batch_size):
+                _, relationship_rows = self._build_batch_rows(batch)
+                yield self._write_relationships, relationship_rows
+
+        total_rows = 0
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for phase, tasks in [("疾病节点", disease_node_batches),
+                                     ("关联节点", item_node_batches),
+                                     ("关系", relationship_batches)]:
+                    phase_rows = self._run_phase(executor, workers, tasks())
+                    if phase_rows is None:
+                        print(f"{phase}阶段存在写入失败的批次，导入中止。")
+                        return None
+                    total_rows += phase_rows
+                    elapsed = time.perf_counter() - start_time
+                    print(f"{phase}阶段完成: 累计写入 {total_rows} 行 ({total_rows / max(elapsed, 1e-9):.0f} 行/秒)")
+        except OSError as e:
+            print(f"读取文件时发生错误: {e}")
+            return None
+
+        elapsed = time.perf_counter() - start_time
+        print(f"并行导入完成！线程数: {workers}，共写入 {total_rows} 行，耗时 {elapsed:.1f} 秒，"
+              f"平均 {total_rows / max(elapsed, 1e-9):.0f} 行/秒")
+        self._notify_refresh()
+        return total_rows, elapsed
+
+    def _run_phase(self, executor, workers, tasks):
+        """
+        将一个阶段的写入任务提交到线程池，同时在途的批次数有上限，保证内存有界。
+        :param tasks: 产出 (事务函数, 参数) 的迭代器。
+        :return: 本阶段写入的行数；存在失败批次时返回None。
+        """
+        pending = set()
+        total_rows = 0
+        failed = False
+
+        def collect(done):
+            nonlocal total_rows, failed
+            for future in done:
+                try:
+                    total_rows += future.result()
+                except Exception as e:
+                    print(f"批次写入失败: {e}")
+                    failed = True
+
+        for work, payload in tasks:
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(executor.submit(self._write_in_session, work, payload))
+        done, _ = wait(pending)
+        collect(done)
+        return None if failed else total_rows
+
+    def _write_in_session(self, work, payload):
+        """
+        在独立会话中执行写事务。execute_write 会在驱动的重试时间窗口内
+        自动重试死锁等瞬时错误，这里不再叠加一层重试。
+        :param work: 事务函数，签名为 work(tx, payload)。
+        :param payload: 传给事务函数的参数。
+        """
+        with self._driver.session() as session:
+            return session.execute_write(work, payload)
+
+    @staticmethod
+    def _write_disease_nodes(tx, disease_rows):
+        """
+        写入一批疾病节点及其属性。
+        只追加属性、不删除过期的属性与关系，因此不写入 content_hash，以免增量导入误判为未变化。
+        """
+        tx.run(
+            "UNWIND $rows AS row MERGE (d:Disease {name: row.name}) SET d += row.props",
+            rows=disease_rows
+        )
+        return len(disease_rows)
+
+    @staticmethod
+    def _write_nodes(tx, labeled_names):
+        """写入一批同一标签的节点，labeled_names 为 (节点标签, 名称列表)。"""
+        node_label, names = labeled_names
+        tx.run(f"UNWIND $names AS name MERGE (:{node_label} {{name: name}})", names=names)
+        return len(names)
+
+    @staticmethod
+    def _write_relationships(tx, relationship_rows):
+        """在两端节点均已存在的前提下，写入一批关系。"""
+        written = 0
+        for (node_label, rel_type), rows in relationship_rows.items():
+            query = f"""
+            UNWIND $rows AS row
+            MATCH (d:Disease {{name: row.disease}})
+            MATCH (n:{node_label} {{name: row.item}})
+            MERGE (d)-[:{rel_type}]->(n)
+            """
+            tx.run(query, rows=rows)
+            written += len(rows)
+        return written
+
     def _create_relationships(self, disease_name, json_key, node_label, rel_type, data):
         """
         一个通用的私有辅助函数，用于创建节点和关系。
@@ -152,25 +641,213 @@ class MedicalGraphImporter:
             self._execute_query(query, parameters={'disease_name': disease_name, 'item_name': item_name})
 
 
+def notify_cache_invalidation(url, token=None):
+    """
+    通知正在运行的问答服务清空缓存（POST到 /api/cache/invalidate）。
+    :param url: 缓存失效接口地址，例如 http://127.0.0.1:5000/api/cache/invalidate
+    :param token: 服务端配置的管理接口令牌（ADMIN_API_TOKEN）；服务端未配置令牌时只接受本机请求
+    """
+    headers = {'X-Admin-Token': token} if token else {}
+    request = urllib.request.Request(url, data=b'', method='POST', headers=headers)
+    with urllib.request.urlopen(request, timeout=10) as response:
+        print(f"已通知服务清空缓存: {url} ({response.status})")
+
+
+class AdminCsvExporter:
+    """
+    将JSONL数据导出为 `neo4j-admin database import` 所需的CSV文件，用于全新数据库的离线初始导入。
+    每个节点标签一个节点文件，每种关系类型一个关系文件；不依赖数据库连接。
+    """
+
+    def __init__(self, output_dir):
+        """
+        :param output_dir: CSV文件的输出目录。
+        """
+        self.output_dir = output_dir
+
+    def export(self, json_file_path):
+        """
+        导出CSV文件。先扫描一遍数据确定疾病节点的属性列，再流式遍历一遍写出节点与关系，
+        节点与关系均用哈希集合去重；同名疾病重复出现时只写入第一次的节点行，关系仍逐条合并。
+        :param json_file_path: JSONL文件的路径（每行一个JSON对象）。
+        :return: {文件名: 行数}；文件不存在时返回None。
+        """
+        if not os.path.exists(json_file_path):
+            print(f"错误: 找不到文件 '{json_file_path}'")
+            return None
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        # 疾病节点的属性列需要写在表头中，先轻量扫描一遍确定列名及类型
+        disease_columns = self._scan_disease_properties(json_file_path)
+
+        rel_targets = {rel_type: node_label for _, node_label, rel_type in RELATIONSHIP_SPECS}
+        seen_nodes = {label: set() for label in NODE_LABELS}
+        seen_rels = {rel_type: set() for rel_type in rel_targets}
+        pending_diseases = set()
+        counts = {}
+
+        files = {}
+        writers = {}
+        try:
+            for label in NODE_LABELS:
+                header = [f"name:ID({label})"]
+                if label == 'Disease':
+                    header += [f"{key}:{col_type}" if col_type else key for key, col_type in disease_columns]
+                writers[label] = self._open_writer(files, f"{label}.csv", header)
+            for rel_type, node_label in rel_targets.items():
+                writers[rel_type] = self._open_writer(
+                    files, f"{rel_type}.csv", [":START_ID(Disease)", f":END_ID({node_label})"]
+                )
+
+            for _, disease_data in iter_jsonl(json_file_path):
+                disease_name = disease_data.get('name')
+                if not disease_name:
+                    continue
+                if disease_name not in seen_nodes['Disease']:
+                    seen_nodes['Disease'].add(disease_name)
+                    pending_diseases.discard(disease_name)
+                    writers['Disease'].writerow(
+                        [disease_name] + [self._csv_value(disease_data.get(key)) for key, _ in disease_columns]
+                    )
+
+                for json_key, node_label, rel_type in RELATIONSHIP_SPECS:
+                    for item_name in disease_data.get(json_key) or []:
+                        if not item_name:
+                            continue
+                        if node_label == 'Disease':
+                            # 并发症可能稍后作为疾病数据出现，届时会带上完整属性
+                            if item_name not in seen_nodes['Disease']:
+                                pending_diseases.add(item_name)
+                        elif item_name not in seen_nodes[node_label]:
+                            seen_nodes[node_label].add(item_name)
+                            writers[node_label].writerow([item_name])
+
+                        pair = (disease_name, item_name)
+                        if pair not in seen_rels[rel_type]:
+                            seen_rels[rel_type].add(pair)
+                            writers[rel_type].writerow(pair)
+
+            # 仅作为并发症出现、没有自身数据的疾病，只写入名称
+            empty_props = [''] * len(disease_columns)
+            for disease_name in pending_diseases:
+                seen_nodes['Disease'].add(disease_name)
+                writers['Disease'].writerow([disease_name] + empty_props)
+        finally:
+            for f in files.values():
+                f.close()
+
+        for label, names in seen_nodes.items():
+            counts[f"{label}.csv"] = len(names)
+        for rel_type, pairs in seen_rels.items():
+            counts[f"{rel_type}.csv"] = len(pairs)
+        for file_name, rows in counts.items():
+            print(f"{file_name}: {rows} 行")
+        print("CSV导出完成，可使用以下命令导入（需先停止目标数据库）：")
+        print(self.import_command())
+        return counts
+
+    def import_command(self, database='neo4j'):
+        """生成与导出文件对应的 neo4j-admin 导入命令。"""
+        rel_types = dict.fromkeys(rel_type for _, _, rel_type in RELATIONSHIP_SPECS)
+        args = [f"--nodes={label}={os.path.join(self.output_dir, f'{label}.csv')}" for label in NODE_LABELS]
+        args += [f"--relationships={rel_type}={os.path.join(self.output_dir, f'{rel_type}.csv')}"
+                 for rel_type in rel_types]
+        return " ".join(["neo4j-admin database import full", "--overwrite-destination",
+                         "--multiline-fields=true", *args, database])
+
+    @staticmethod
+    def _scan_disease_properties(json_file_path):
+        """
+        扫描疾病数据中的标量属性，返回按首次出现排序的 [(属性名, neo4j-admin类型)]。
+        与 import_data 一致，只导出 str/int/float 类型的属性；name 作为ID列单独处理。
+        """
+        column_types = {}
+        for _, disease_data in iter_jsonl(json_file_path):
+            for key, value in disease_data.items():
+                if key == 'name' or not isinstance(value, (str, int, float)) or isinstance(value, bool):
+                    continue
+                value_type = 'long' if isinstance(value, int) else 'double' if isinstance(value, float) else ''
+                previous = column_types.setdefault(key, value_type)
+                if previous != value_type:
+                    # 整数与浮点混合时按浮点处理，其余混合情况按字符串处理
+                    column_types[key] = 'double' if {previous, value_type} == {'long', 'double'} else ''
+        return list(column_types.items())
+
+    @staticmethod
+    def _csv_value(value):
+        """非标量属性与缺失值导出为空（neo4j-admin 会将其视为未设置）。"""
+        if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+            return value
+        return ''
+
+    def _open_writer(self, files, file_name, header):
+        f = open(os.path.join(self.output_dir, file_name), 'w', encoding='utf-8', newline='')
+        files[file_name] = f
+        writer = csv.writer(f)
+        writer.writerow(header)
+        return writer
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="将医疗JSONL数据导入Neo4j知识图谱")
+    parser.add_argument('--mode', choices=['single', 'batch', 'parallel', 'benchmark', 'delta', 'export'],
+                        default='batch',
+                        help="导入模式: single=逐条MERGE, batch=按批UNWIND写入 (默认), "
+                             "parallel=多线程两阶段导入, benchmark=对比1/2/4/8线程的并行导入吞吐量 (每轮前清空数据库，仅用于测试库), "
+                             "delta=只写入内容发生变化的疾病, "
+                             "export=导出neo4j-admin离线导入所需的CSV (无需连接数据库)")
+    parser.add_argument('--batch-size', type=int, default=500, help="批量模式下每个事务的疾病条数")
+    parser.add_argument('--file', default="./data/data.json", help="JSONL数据文件路径")
+    parser.add_argument('--workers', type=int, default=4, help="并行模式下的写入线程数")
+    parser.add_argument('--no-resume', action='store_true', help="忽略已有断点，从头开始批量导入")
+    parser.add_argument('--notify-url', default=None,
+                        help="导入成功后通知问答服务清空缓存的地址，例如 http://127.0.0.1:5000/api/cache/invalidate")
+    parser.add_argument('--notify-token', default=os.environ.get('ADMIN_API_TOKEN'),
+                        help="问答服务的管理接口令牌，默认读取环境变量 ADMIN_API_TOKEN")
+    parser.add_argument('--output-dir', default="./data/neo4j_import", help="导出模式下CSV文件的输出目录")
+    args = parser.parse_args()
+
+    if args.mode == 'export':
+        if AdminCsvExporter(args.output_dir).export(args.file) is None:
+            print("CSV导出失败，请检查文件路径和格式。")
+            raise SystemExit(1)
+        raise SystemExit
+
     NEO4J_URI = "bolt://localhost:7687" 
     NEO4J_USER = "neo4j"                 
     NEO4J_PASSWORD = "123456"   
-    JSON_FILE_PATH = "./data/data.json"  # 使用绝对路径
+    JSON_FILE_PATH = args.file
 
     # --- 开始执行导入 ---
     importer = MedicalGraphImporter(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD)
     
+    if args.notify_url:
+        importer.add_refresh_hook(lambda: notify_cache_invalidation(args.notify_url, args.notify_token))
+
     if importer._driver:
         # 1. 创建约束 (首次运行时执行，后续可注释掉)
         importer.create_constraints()
         
         # 2. 导入数据
-        success = importer.import_data(JSON_FILE_PATH)
+        if args.mode == 'batch':
+            success = importer.import_data_batched(JSON_FILE_PATH, batch_size=args.batch_size,
+                                                   resume=not args.no_resume)
+        elif args.mode == 'parallel':
+            success = importer.import_data_parallel(JSON_FILE_PATH, workers=args.workers,
+                                                    batch_size=args.batch_size)
+        elif args.mode == 'delta':
+            success = importer.import_data_delta(JSON_FILE_PATH, batch_size=args.batch_size)
+        elif args.mode == 'benchmark':
+            success = bool(importer.benchmark_parallel_import(JSON_FILE_PATH, batch_size=args.batch_size))
+        else:
+            success = importer.import_data(JSON_FILE_PATH)
         if not success:
             print("数据导入失败，请检查文件路径和格式。")
         
         # 3. 关闭连接
         importer.close()
+        if not success:
+            raise SystemExit(1)
     else:
-        print("无法连接到数据库，程序退出。")
\ No newline at end of file
+        print("无法连接到数据库，程序退出。")
+        raise SystemExit(1)
\ No newline at end of file
@@ -1,67 +1,161 @@
 # main_handler.py
 import logging
+from contextlib import closing
+from config import Config
 from modules.ner_intent_module import NERIntentModule
-from modules.kg_module import KnowledgeGraphModule
-from modules.llm_module import LLMModule
+from modules.kg_module import KnowledgeGraphModule, NODE_LABELS
+from modules.keyword_module import AhoCorasick
+from modules.answer_cache_module import AnswerCache
+from modules.llm_module import GENERATION_ERROR_MESSAGE, LLMModule
 
 logger = logging.getLogger(__name__)
 
+# 常见症状关键词
+SYMPTOM_KEYWORDS = [
+    '头疼', '头痛', '头晕', '发烧', '发热', '咳嗽', '乏力', '恶心', '呕吐',
+    '腹痛', '胸痛', '心慌', '气短', '失眠', '疼', '痛', '晕', '热', '咳'
+]
+
+# 常见疾病关键词
+DISEASE_KEYWORDS = [
+    '痛风', '高血压', '糖尿病', '心脏病', '胃病', '肝病', '肾病', '肺炎', 
+    '支气管炎', '感冒', '发烧', '癌症', '肿瘤', '结石', '炎症', '感染', 
+    '过敏', '贫血', '失眠症', '抑郁症', '焦虑症', '关节炎', '冠心病'
+]
+
 class MainHandler:
     def __init__(self):
         logger.info("正在初始化所有模块...")
         self.ner_intent_module = NERIntentModule()
-        self.kg_module = KnowledgeGraphModule()
+        if Config.KG_BACKEND == 'snapshot':
+            from modules.graph_snapshot_module import SnapshotKnowledgeGraphModule
+            self.kg_module = SnapshotKnowledgeGraphModule()
+        else:
+            self.kg_module = KnowledgeGraphModule()
         self.llm_module = LLMModule()
+        self._build_keyword_matchers()
+
+        cache_config = Config.ANSWER_CACHE_CONFIG
+        self.answer_cache = None
+        if cache_config.get('enabled', True):
+            self.answer_cache = AnswerCache(
+                max_size=cache_config.get('max_size', 1024),
+                similarity_threshold=cache_config.get('similarity_threshold'),
+                persist_path=cache_config.get('persist_path'),
+                persist_interval=cache_config.get('persist_interval', 60)
+            )
         logger.info("所有模块初始化完成。")
 
     def process_query(self, query):
         """
         处理用户查询的完整流程。
         """
-        # 1. NER 和 意图识别
+        analysis = self._analyze_query(query)
+        embedding, cached = self._lookup_similar_answer(analysis)
+        if cached is not None:
+            return cached
+
+        result = self._retrieve_context(analysis)
+        result['final_answer'] = self._lookup_exact_answer(result, embedding)
+        if result['final_answer'] is None:
+            # 3. LLM生成最终答案
+            logger.info("步骤 3: LLM生成最终答案...")
+            result['final_answer'] = self.llm_module.generate_answer(query, result['kg_context'], result['intent'])
+            logger.info(f"LLM生成的最终答案: {result['final_answer']}")
+            self._store_answer(result, embedding)
+        return result
+
+    def process_query_stream(self, query):
+        """
+        流式处理用户查询：先产出 ('context', 识别与检索结果)，
+        再逐段产出 ('token', 文本增量)，最后产出 ('done', {"final_answer": 完整回答})。
+        命中回答缓存时整段回答作为一个 token 事件产出。
+        生成失败或超时时抛出 GenerationError，不产出 done 事件，不完整的回答也不写入回答缓存。
+        """
+        analysis = self._analyze_query(query)
+        embedding, result = self._lookup_similar_answer(analysis)
+        if result is None:
+            result = self._retrieve_context(analysis)
+            final_answer = self._lookup_exact_answer(result, embedding)
+        else:
+            final_answer = result.pop('final_answer')
+        yield 'context', result
+
+        if final_answer is not None:
+            yield 'token', final_answer
+            yield 'done', {"final_answer": final_answer}
+            return
+
+        logger.info("步骤 3: LLM流式生成最终答案...")
+        chunks = []
+        # 本生成器被关闭（客户端断开）时一并关闭文本流，停止后台生成
+        with closing(self.llm_module.stream_answer(query, result['kg_context'], result['intent'])) as stream:
+            for text in stream:
+                chunks.append(text)
+                yield 'token', text
+        final_answer = ''.join(chunks).strip()
+        logger.info(f"LLM生成的最终答案: {final_answer}")
+        self._store_answer({**result, "final_answer": final_answer}, embedding)
+        yield 'done', {"final_answer": final_answer}
+
+    def _lookup_similar_answer(self, analysis):
+        """
+        在知识图谱检索之前按查询向量查找改写相近的已缓存回答，返回 (查询向量, 结果或None)。
+        查询向量与意图识别共用向量缓存，不会重复编码；识别出的意图与实体集合须与缓存结果完全一致。
+        """
+        if self.answer_cache is None:
+            return None, None
+        query = analysis['query']
+        try:
+            embedding = self.ner_intent_module.intent_model.encode_query(query)
+        except Exception as e:
+            logger.error(f"编码查询向量失败，跳过回答缓存的近似匹配: {e}")
+            return None, None
+        cached = self.answer_cache.find_similar(embedding, analysis['intent'], analysis['entities'])
+        if cached is not None:
+            logger.info(f"命中回答缓存（近似匹配）: '{query}' ≈ '{cached['query']}'")
+            cached['query'] = query
+        return embedding, cached
+
+    def _lookup_exact_answer(self, result, embedding):
+        """按 (意图, 实体, 知识图谱内容) 精确查找已缓存的回答，未命中时返回 None。"""
+        if self.answer_cache is None:
+            return None
+        final_answer = self.answer_cache.get(result['intent'], result['entities'], result['kg_context'], embedding)
+        if final_answer is not None:
+            logger.info("命中回答缓存（精确匹配），跳过LLM生成。")
+        return final_answer
+
+    def _store_answer(self, result, embedding):
+        # 生成失败的提示不缓存
+        if self.answer_cache is not None and result['final_answer'] and result['final_answer'] != GENERATION_ERROR_MESSAGE:
+            self.answer_cache.put(result, embedding)
+
+    def _analyze_query(self, query):
+        """
+        步骤 1：NER与意图识别；NER未给出所需实体时按意图用关键词词典补充，返回 {query, intent, entities}。
+        """
         logger.info("步骤 1: 进行NER和意图识别...")
         analysis = self.ner_intent_module.analyze_query(query)
         intent = analysis['intent']
         entities = analysis['entities']
         logger.info(f"识别结果 - 意图: {intent}, 实体: {entities}")
 
-        # 改进的处理逻辑
-        if intent == "unknown_intent":
-            logger.warning("意图不明确，将直接使用LLM进行通用回答。")
-            kg_context = "无法确定用户的具体意图，建议提供通用的医疗建议。"
-        elif intent == "find_disease_by_symptom" and not entities:
+        if intent == "find_disease_by_symptom" and not entities:
             # 特殊处理：根据症状查疾病但没有识别到实体
             logger.info("识别到症状查询意图，但未提取到具体症状实体，尝试从文本中提取关键词。")
             symptom_keywords = self._extract_symptom_keywords(query)
             if symptom_keywords:
                 entities = [{'name': kw, 'type': 'Symptom'} for kw in symptom_keywords]
                 logger.info(f"通过关键词提取到症状: {entities}")
-                kg_context = self.kg_module.query_graph(intent, entities)
-            else:
-                kg_context = "未能识别到具体症状，建议详细描述症状或咨询专业医生。"
         elif intent in ["query_food_avoid", "query_food_recommend", "query_department"]:
-            # 特殊处理：需要疾病实体的查询
-            logger.info(f"识别到需要疾病实体的查询意图: {intent}")
-            
-            # 尝试从文本中提取疾病实体
+            # 特殊处理：需要疾病实体的查询，尝试从文本中提取疾病实体
             if not any(e['type'] == 'Disease' for e in entities):
                 disease_keywords = self._extract_disease_keywords(query)
                 if disease_keywords:
                     disease_entities = [{'name': kw, 'type': 'Disease'} for kw in disease_keywords]
                     entities.extend(disease_entities)
                     logger.info(f"通过关键词提取到疾病: {disease_entities}")
-            
-            if any(e['type'] == 'Disease' for e in entities):
-                # 有疾病实体，查询知识图谱
-                kg_context = self.kg_module.query_graph(intent, entities)
-            else:
-                # 没有疾病实体，提供一般性建议
-                if intent == "query_food_avoid":
-                    kg_context = "建议咨询医生了解具体的饮食禁忌，一般建议避免辛辣、油腻、生冷食物。"
-                elif intent == "query_food_recommend":
-                    kg_context = "建议咨询医生了解具体的饮食建议，一般建议多吃新鲜蔬菜水果，保持营养均衡。"
-                elif intent == "query_department":
-                    kg_context = "建议先到内科进行初步检查，医生会根据具体症状推荐合适的专科。"
         elif intent in ["query_drug", "query_symptom", "query_check", "query_cure_way"] and not entities:
             # 其他需要疾病实体的查询
             logger.info(f"识别到查询意图: {intent}，但未提取到疾病实体，尝试提取疾病关键词。")
@@ -69,9 +163,33 @@ class MainHandler:
             if disease_keywords:
                 entities = [{'name': kw, 'type': 'Disease'} for kw in disease_keywords]
                 logger.info(f"通过关键词提取到疾病: {entities}")
-                kg_context = self.kg_module.query_graph(intent, entities)
+
+        return {"query": query, "intent": intent, "entities": entities}
+
+    def _retrieve_context(self, analysis):
+        """
+        步骤 2：按识别出的意图与实体查询知识图谱，返回 {query, intent, entities, kg_context}。
+        """
+        intent = analysis['intent']
+        entities = analysis['entities']
+
+        # 改进的处理逻辑
+        if intent == "unknown_intent":
+            logger.warning("意图不明确，将直接使用LLM进行通用回答。")
+            kg_context = "无法确定用户的具体意图，建议提供通用的医疗建议。"
+        elif intent == "find_disease_by_symptom" and not entities:
+            kg_context = "未能识别到具体症状，建议详细描述症状或咨询专业医生。"
+        elif intent in ["query_food_avoid", "query_food_recommend", "query_department"] \
+                and not any(e['type'] == 'Disease' for e in entities):
+            # 没有疾病实体，提供一般性建议
+            if intent == "query_food_avoid":
+                kg_context = "建议咨询医生了解具体的饮食禁忌，一般建议避免辛辣、油腻、生冷食物。"
+            elif intent == "query_food_recommend":
+                kg_context = "建议咨询医生了解具体的饮食建议，一般建议多吃新鲜蔬菜水果，保持营养均衡。"
             else:
-                kg_context = f"虽然识别到意图为'{intent}'，但未能提取到具体的疾病实体，建议明确指出疾病名称。"
+                kg_context = "建议先到内科进行初步检查，医生会根据具体症状推荐合适的专科。"
+        elif intent in ["query_drug", "query_symptom", "query_check", "query_cure_way"] and not entities:
+            kg_context = f"虽然识别到意图为'{intent}'，但未能提取到具体的疾病实体，建议明确指出疾病名称。"
         elif not entities:
             logger.warning("未识别到实体，将提供一般性建议。")
             kg_context = f"虽然识别到意图为'{intent}'，但未能提取到具体的医疗实体，建议提供更具体的信息。"
@@ -80,48 +198,54 @@ class MainHandler:
             logger.info("步骤 2: 查询知识图谱...")
             kg_context = self.kg_module.query_graph(intent, entities)
             logger.info(f"知识图谱返回内容: {kg_context}")
-        
-        # 3. LLM生成最终答案
-        logger.info("步骤 3: LLM生成最终答案...")
-        final_answer = self.llm_module.generate_answer(query, kg_context)
-        logger.info(f"LLM生成的最终答案: {final_answer}")
 
+        return {**analysis, "kg_context": kg_context}
+    
+    def invalidate_caches(self):
+        """数据刷新（如重新导入知识图谱）后清空各模块的缓存，并按新的节点名称重建关键词词典。"""
+        self.kg_module.invalidate_cache()
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate()
+        if Config.KEYWORD_CONFIG.get('use_graph_names'):
+            self._build_keyword_matchers()
+
+    def cache_stats(self):
+        """汇总各模块的缓存命中统计。"""
         return {
-            "query": query,
-            "intent": intent,
-            "entities": entities,
-            "kg_context": kg_context,
-            "final_answer": final_answer
+            "kg_cache": self.kg_module.cache_stats(),
+            "answer_cache": self.answer_cache.stats() if self.answer_cache is not None else None,
+            "embedding_cache": self.ner_intent_module.intent_model.embedding_cache_stats(),
+            "micro_batching": self.ner_intent_module.batching_stats(),
+            "stage_timing": self.ner_intent_module.stage_timing_stats()
         }
-    
+
+    def _build_keyword_matchers(self):
+        """
+        构建症状/疾病关键词自动机；按配置再并入图谱中的全部节点名称，
+        同时把节点名称词典交给NER模块用于实体类型判定。
+        """
+        symptom_names, disease_names = list(SYMPTOM_KEYWORDS), list(DISEASE_KEYWORDS)
+        keyword_config = Config.KEYWORD_CONFIG
+        if keyword_config.get('use_graph_names'):
+            try:
+                names_by_label = {label: self.kg_module.node_names(label) for label in NODE_LABELS}
+            except Exception as e:
+                logger.error(f"加载图谱节点名称失败，仅使用内置关键词: {e}")
+                names_by_label = {}
+            min_length = keyword_config.get('min_name_length', 2)
+            symptom_names += [name for name in names_by_label.get('Symptom', []) if len(name) >= min_length]
+            disease_names += [name for name in names_by_label.get('Disease', []) if len(name) >= min_length]
+            if names_by_label:
+                self.ner_intent_module.ner_model.load_entity_dictionary(names_by_label)
+
+        self._symptom_matcher = AhoCorasick((name, name) for name in dict.fromkeys(symptom_names)).build()
+        self._disease_matcher = AhoCorasick((name, name) for name in dict.fromkeys(disease_names)).build()
+        logger.info(f"关键词自动机构建完成: 症状 {len(self._symptom_matcher)} 个, 疾病 {len(self._disease_matcher)} 个")
+
     def _extract_symptom_keywords(self, text):
-        """从文本中提取症状关键词"""
-        import re
-        
-        # 常见症状关键词
-        symptom_keywords = [
-            '头疼', '头痛', '头晕', '发烧', '发热', '咳嗽', '乏力', '恶心', '呕吐',
-            '腹痛', '胸痛', '心慌', '气短', '失眠', '疼', '痛', '晕', '热', '咳'
-        ]
-        
-        found_symptoms = []
-        for keyword in symptom_keywords:
-            if keyword in text:
-                found_symptoms.append(keyword)
-        
-        return found_symptoms
+        """从文本中提取症状关键词（一次扫描，取最长且互不重叠的匹配）"""
+        return list(dict.fromkeys(name for _, _, name in self._symptom_matcher.find_longest(text)))
     
     def _extract_disease_keywords(self, text):
-        """从文本中提取疾病关键词"""
-        disease_keywords = [
-            '痛风', '高血压', '糖尿病', '心脏病', '胃病', '肝病', '肾病', '肺炎', 
-            '支气管炎', '感冒', '发烧', '癌症', '肿瘤', '结石', '炎症', '感染', 
-            '过敏', '贫血', '失眠症', '抑郁症', '焦虑症', '关节炎', '冠心病'
-        ]
-        
-        found_diseases = []
-        for keyword in disease_keywords:
-            if keyword in text:
-                found_diseases.append(keyword)
-        
-        return found_diseases
\ No newline at end of file
+        """从文本中提取疾病关键词（一次扫描，取最长且互不重叠的匹配）"""
+        return list(dict.fromkeys(name for _, _, name in self._disease_matcher.find_longest(text)))
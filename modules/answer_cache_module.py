@@ -0,0 +1,215 @@
+# modules/answer_cache_module.py
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerCache:
+    """
+    问答结果缓存：精确键为 (意图, 排序后的实体, 知识图谱内容哈希)，命中即返回已生成的回答；
+    另以查询向量做最近邻查找，改写后的相近提问（余弦相似度不低于阈值）也可直接复用回答。
+    超过容量时按LRU淘汰，可选持久化到磁盘，知识图谱重新导入后需调用 invalidate 清空。
+    持久化由后台线程定期写盘（进程退出或调用 close 时再写一次），不占用请求路径。
+    """
+
+    def __init__(self, max_size=1024, similarity_threshold=0.95, persist_path=None, persist_interval=60):
+        """
+        :param max_size: 最多缓存的回答数。
+        :param similarity_threshold: 近似匹配的最低余弦相似度，None 表示只做精确匹配。
+        :param persist_path: 持久化文件路径（.npz），None 表示仅缓存在内存中。
+        :param persist_interval: 有新变化时后台写盘的间隔（秒）。
+        """
+        self.max_size = max_size
+        self.similarity_threshold = similarity_threshold
+        self.persist_path = persist_path
+        self._entries = OrderedDict()  # 精确键 -> {'query', 'intent', 'entities', 'kg_context', 'final_answer'}
+        self._vectors = []             # [(精确键, 查询向量)]，同一回答可对应多个改写的查询
+        self._matrix = None            # 由 _vectors 堆叠的矩阵，变化后延迟重建
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # 串行化写盘，写盘期间不持有 _lock
+        self._dirty = False
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self._stop = threading.Event()
+        if persist_path:
+            self._load()
+            threading.Thread(
+                target=self._persist_loop, args=(persist_interval,), name='answer-cache-persist', daemon=True
+            ).start()
+            atexit.register(self.close)
+
+    @staticmethod
+    def make_key(intent, entities, kg_context):
+        """精确键：意图、按 (名称, 类型) 排序去重的实体，以及知识图谱内容的哈希。"""
+        entity_key = tuple(sorted(AnswerCache._entity_set(entities)))
+        context_hash = hashlib.sha1(str(kg_context).encode('utf-8')).hexdigest()
+        return json.dumps([intent, entity_key, context_hash], ensure_ascii=False)
+
+    def get(self, intent, entities, kg_context, embedding=None):
+        """按精确键查找回答；命中且提供了查询向量时，把该向量也登记为此回答的近似匹配入口。"""
+        key = self.make_key(intent, entities, kg_context)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            if embedding is not None and self.similarity_threshold is not None:
+                self._add_vector(key, embedding)
+            return entry['final_answer']
+
+    def find_similar(self, embedding, intent, entities):
+        """
+        近似匹配：返回与查询向量最相近且相似度不低于阈值的缓存结果（dict 副本），否则返回 None。
+        为避免把不同意图或不同实体的问题误判为改写，要求缓存结果的意图与新查询识别出的意图相同、
+        且实体集合（名称与类型）完全一致；意图不明确或没有实体的查询不参与近似匹配。
+        :param intent: 新查询识别出的意图
+        :param entities: 新查询识别出的实体列表
+        """
+        if self.similarity_threshold is None or intent == 'unknown_intent' or not entities:
+            return None
+        entity_set = self._entity_set(entities)
+        with self._lock:
+            if self._matrix is None and self._vectors:
+                self._matrix = torch.stack([vector for _, vector in self._vectors])
+            if self._matrix is None:
+                return None
+            scores = self._matrix @ embedding.float().cpu()
+            for index in scores.argsort(descending=True).tolist():
+                if scores[index] < self.similarity_threshold:
+                    break
+                key = self._vectors[index][0]
+                entry = self._entries.get(key)
+                if entry is None or entry['intent'] != intent or self._entity_set(entry['entities']) != entity_set:
+                    continue
+                self._entries.move_to_end(key)
+                self.similar_hits += 1
+                return dict(entry)
+            return None
+
+    @staticmethod
+    def _entity_set(entities):
+        return {(e['name'], e['type']) for e in entities}
+
+    def put(self, result, embedding=None):
+        """缓存一次完整的问答结果（需包含 intent/entities/kg_context/final_answer）。"""
+        key = self.make_key(result['intent'], result['entities'], result['kg_context'])
+        entry = {name: result[name] for name in ('query', 'intent', 'kg_context', 'final_answer')}
+        entry['entities'] = [dict(e) for e in result['entities']]
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            if embedding is not None and self.similarity_threshold is not None:
+                self._add_vector(key, embedding)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._prune_vectors()
+            self._dirty = True
+
+    def invalidate(self):
+        """清空全部缓存（知识图谱数据更新后调用），并同步清空持久化文件。"""
+        with self._lock:
+            self._entries.clear()
+            self._vectors = []
+            self._matrix = None
+            self._dirty = True
+
+    def flush(self):
+        """有未写盘的变化时立即写入持久化文件；在锁内只复制引用，序列化与磁盘I/O在锁外完成。"""
+        if not self.persist_path:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                entries = list(self._entries.items())
+                vectors = list(self._vectors)
+                self._dirty = False
+            self._save(entries, vectors)
+
+    def close(self):
+        """停止后台写盘线程，并写入尚未保存的变化。"""
+        self._stop.set()
+        self.flush()
+
+    def _persist_loop(self, interval):
+        while not self._stop.wait(interval):
+            self.flush()
+
+    def stats(self):
+        """返回缓存容量与精确/近似命中统计。"""
+        with self._lock:
+            total = self.exact_hits + self.similar_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'vectors': len(self._vectors),
+                'similarity_threshold': self.similarity_threshold,
+                'exact_hits': self.exact_hits,
+                'similar_hits': self.similar_hits,
+                'misses': self.misses,
+                'hit_rate': (self.exact_hits + self.similar_hits) / total if total else 0.0,
+            }
+
+    def _add_vector(self, key, embedding):
+        self._vectors.append((key, embedding.detach().float().cpu()))
+        self._matrix = None
+
+    def _prune_vectors(self):
+        # 移除已被淘汰的回答对应的向量；总数超过上限时只保留最近登记的向量
+        kept = [(key, vector) for key, vector in self._vectors if key in self._entries]
+        limit = 4 * self.max_size
+        if len(kept) != len(self._vectors) or len(kept) > limit:
+            self._vectors = kept[-limit:]
+            self._matrix = None
+
+    def _save(self, entries, vectors):
+        """
+        原子地写入持久化文件：回答以JSON字符串保存，查询向量以矩阵保存。
+        :param entries: [(精确键, 回答)]，按LRU顺序
+        :param vectors: [(精确键, 查询向量)]
+        """
+        try:
+            directory = os.path.dirname(self.persist_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            positions = {key: i for i, (key, _) in enumerate(entries)}
+            vectors = [(positions[key], vector) for key, vector in vectors if key in positions]
+            tmp_path = f"{self.persist_path}.tmp.npz"
+            np.savez(
+                tmp_path,
+                entries=np.array(json.dumps([entry for _, entry in entries], ensure_ascii=False)),
+                vector_entries=np.array([i for i, _ in vectors], dtype=np.int64),
+                vectors=torch.stack([v for _, v in vectors]).numpy() if vectors else np.zeros((0, 0), np.float32)
+            )
+            os.replace(tmp_path, self.persist_path)
+        except OSError as e:
+            logger.warning(f"写入回答缓存失败: {e}")
+
+    def _load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with np.load(self.persist_path, allow_pickle=False) as data:
+                entries = json.loads(str(data['entries']))
+                vector_entries = data['vector_entries'].tolist()
+                vectors = torch.from_numpy(data['vectors'].copy())
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"加载回答缓存失败，忽略持久化文件: {e}")
+            return
+        keys = [self.make_key(e['intent'], e['entities'], e['kg_context']) for e in entries]
+        for key, entry in list(zip(keys, entries))[-self.max_size:]:
+            self._entries[key] = entry
+        self._vectors = [(keys[i], vector) for i, vector in zip(vector_entries, vectors) if keys[i] in self._entries]
+        logger.info(f"从 {self.persist_path} 加载回答缓存 {len(self._entries)} 条")
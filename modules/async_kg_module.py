@@ -0,0 +1,207 @@
+# modules/async_kg_module.py
+import asyncio
+import logging
+import time
+from neo4j import AsyncGraphDatabase, unit_of_work
+from config import Config
+from .cache_module import LRUCache
+from .kg_module import (
+    KnowledgeGraphModule, RANK_DISEASES_BY_SYMPTOMS_QUERY,
+    DB_UNAVAILABLE_MESSAGE, QUERY_ERROR_MESSAGE, NODE_LABELS
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncKnowledgeGraphModule:
+    """
+    基于 neo4j 异步驱动的知识图谱模块，查询接口与 KnowledgeGraphModule 相同但均为协程（含 close），
+    便于主流程在等待图谱查询的同时执行其他阶段。
+    所有查询都通过读路由的托管事务执行，并受事务超时和整体等待超时的双重限制。
+    不继承同步模块，以免混用同步与异步接口；Cypher构建与结果格式化直接复用同步模块中与驱动无关的方法。
+    """
+
+    _cache_key = staticmethod(KnowledgeGraphModule._cache_key)
+    _is_batchable = staticmethod(KnowledgeGraphModule._is_batchable)
+    _build_lookups = staticmethod(KnowledgeGraphModule._build_lookups)
+    _parse_lookup_records = staticmethod(KnowledgeGraphModule._parse_lookup_records)
+    _build_cypher_query = KnowledgeGraphModule._build_cypher_query
+    _format_records = KnowledgeGraphModule._format_records
+    _join_entity_results = KnowledgeGraphModule._join_entity_results
+
+    def __init__(self):
+        self._pool_size = Config.NEO4J_POOL_CONFIG.get('max_connection_pool_size', 100)
+        try:
+            self._async_driver = AsyncGraphDatabase.driver(
+                Config.NEO4J_URI,
+                auth=(Config.NEO4J_USER, Config.NEO4J_PASSWORD),
+                **Config.NEO4J_POOL_CONFIG
+            )
+            logger.info("异步Neo4j驱动创建成功。")
+        except Exception as e:
+            logger.error(f"创建异步Neo4j驱动失败: {e}")
+            self._async_driver = None
+
+        # 连接池使用情况统计（仅在事件循环线程内更新，无需加锁）
+        self._metrics = {
+            'in_flight': 0,      # 已发起、尚未返回的查询数（含等待连接的查询）
+            'peak_in_flight': 0,
+            'in_use': 0,         # 已取得连接、正在执行事务的查询数
+            'peak_in_use': 0,
+            'queries': 0,
+            'timeouts': 0,
+            'errors': 0,
+            'total_acquire_wait': 0.0,
+            'max_acquire_wait': 0.0,
+        }
+        cache_config = Config.KG_CACHE_CONFIG
+        self._cache = None
+        if cache_config.get('enabled', True):
+            self._cache = LRUCache(max_size=cache_config.get('max_size', 2048), ttl=cache_config.get('ttl'))
+
+    async def close(self):
+        if self._async_driver is not None:
+            await self._async_driver.close()
+
+    def _is_available(self):
+        return self._async_driver is not None
+
+    def invalidate_cache(self):
+        """清空查询缓存，供数据导入/刷新后调用。"""
+        if self._cache is not None:
+            self._cache.invalidate()
+            logger.info("知识图谱查询缓存已清空。")
+
+    def cache_stats(self):
+        """返回查询缓存的命中统计；未启用缓存时返回None。"""
+        return self._cache.stats() if self._cache is not None else None
+
+    def pool_metrics(self):
+        """
+        返回连接池使用情况：在途查询数、占用连接数、利用率、等待连接耗时、超时与错误次数。
+        利用率为占用连接数 / 连接池大小；在途查询数中还包括排队等待连接的查询。
+        """
+        metrics = dict(self._metrics)
+        queries = metrics['queries']
+        metrics['pool_size'] = self._pool_size
+        metrics['utilization'] = metrics['in_use'] / self._pool_size if self._pool_size else 0.0
+        metrics['avg_acquire_wait'] = metrics['total_acquire_wait'] / queries if queries else 0.0
+        return metrics
+
+    async def query_graph(self, intent, entities):
+        """
+        query_graph 的异步版本。相同的 (意图, 实体) 组合优先从进程内缓存返回。
+        :param intent: 意图 (e.g., 'query_symptom')
+        :param entities: 实体列表 (e.g., [{'type': 'Disease', 'name': '高血压'}])
+        :return: 查询结果的格式化字符串。
+        """
+        if self._cache is None or not entities:
+            return await self._query_graph_uncached(intent, entities)
+
+        key = self._cache_key(intent, entities)
+        result = self._cache.get(key)
+        if result is not None:
+            logger.info(f"知识图谱缓存命中: {key}")
+            return result
+
+        result = await self._query_graph_uncached(intent, entities)
+        if result not in (DB_UNAVAILABLE_MESSAGE, QUERY_ERROR_MESSAGE):
+            self._cache.put(key, result)
+        return result
+
+    async def _query_graph_uncached(self, intent, entities):
+        if not self._is_available():
+            return DB_UNAVAILABLE_MESSAGE
+
+        if not entities:
+            return "未能识别出有效的实体，无法进行知识查询。"
+
+        entity_names = list(dict.fromkeys(e['name'] for e in entities))
+        try:
+            if len(entity_names) > 1 and self._is_batchable(intent):
+                results = await self._run_lookups([intent], entity_names)
+                return self._join_entity_results(intent, entity_names, results)
+            records = await self._run_query(intent, entities[0]['name'], entities)
+        except Exception as e:
+            logger.error(f"知识图谱查询失败: {e}")
+            return QUERY_ERROR_MESSAGE
+
+        if records is None:
+            return f"无法处理意图 '{intent}'。"
+        return self._format_records(intent, records)
+
+    async def rank_diseases_by_symptoms(self, symptom_names, top_k=None):
+        """rank_diseases_by_symptoms 的异步版本，返回按得分降序排列的 [(疾病名称, 得分)]。"""
+        params = {
+            'names': list(dict.fromkeys(symptom_names)),
+            'top_k': top_k or Config.SYMPTOM_INFERENCE_TOP_K
+        }
+        results = await self._read(RANK_DISEASES_BY_SYMPTOMS_QUERY, params)
+        return [(record['result'], record['score']) for record in results]
+
+    async def node_names(self, label):
+        """node_names 的异步版本。"""
+        if label not in NODE_LABELS:
+            raise ValueError(f"未知的节点标签: {label}")
+        if not self._is_available():
+            return []
+        records = await self._read(f"MATCH (n:{label}) RETURN n.name AS name", {})
+        return [record['name'] for record in records if record['name']]
+
+    async def _run_query(self, intent, primary_entity_name, all_entities):
+        cypher_query, params = self._build_cypher_query(intent, primary_entity_name, all_entities)
+        if not cypher_query:
+            return None
+
+        logger.info(f"执行异步Cypher查询: {cypher_query} with params {params}")
+        results = await self._read(cypher_query, params)
+        return [record['result'] for record in results if record['result']]
+
+    async def _run_lookups(self, intents, entity_names):
+        query, params = self._build_lookups(intents, entity_names)
+        logger.info(f"执行异步批量Cypher查询: {len(intents)} 个意图 x {len(entity_names)} 个实体")
+        return self._parse_lookup_records(await self._read(query, params))
+
+    async def _read(self, query, params):
+        """
+        以读路由的托管事务执行只读查询。事务超时由数据库强制执行；
+        另以 asyncio 超时兜底（获取连接超时 + 事务超时），保证调用方不会无限期等待。
+        """
+        metrics = self._metrics
+        requested_at = time.perf_counter()
+        acquired_at = None
+
+        @unit_of_work(timeout=Config.NEO4J_QUERY_TIMEOUT)
+        async def work(tx):
+            nonlocal acquired_at
+            if acquired_at is None:
+                acquired_at = time.perf_counter()
+                metrics['in_use'] += 1
+                metrics['peak_in_use'] = max(metrics['peak_in_use'], metrics['in_use'])
+            result = await tx.run(query, params)
+            return [record async for record in result]
+
+        async def run():
+            async with self._async_driver.session() as session:
+                return await session.execute_read(work)
+
+        deadline = Config.NEO4J_POOL_CONFIG.get('connection_acquisition_timeout', 60.0) + Config.NEO4J_QUERY_TIMEOUT
+        metrics['queries'] += 1
+        metrics['in_flight'] += 1
+        metrics['peak_in_flight'] = max(metrics['peak_in_flight'], metrics['in_flight'])
+        try:
+            return await asyncio.wait_for(run(), timeout=deadline)
+        except asyncio.TimeoutError:
+            metrics['timeouts'] += 1
+            raise
+        except Exception as e:
+            # 数据库端事务超时以 ClientError 形式返回
+            metrics['timeouts' if 'TransactionTimedOut' in str(getattr(e, 'code', '')) else 'errors'] += 1
+            raise
+        finally:
+            metrics['in_flight'] -= 1
+            if acquired_at is not None:
+                metrics['in_use'] -= 1
+                wait = acquired_at - requested_at
+                metrics['total_acquire_wait'] += wait
+                metrics['max_acquire_wait'] = max(metrics['max_acquire_wait'], wait)
@@ -0,0 +1,105 @@
+# modules/batching_module.py
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    请求合并调度器：把多个线程并发提交的单条请求攒成一批统一处理，再把结果分发回各自的调用方。
+    后台线程拿到第一条请求后，最多再等待 max_wait_ms 毫秒或攒满 max_batch_size 条即开始处理。
+    """
+
+    def __init__(self, process_batch, max_batch_size=16, max_wait_ms=5, name='micro-batcher'):
+        """
+        :param process_batch: 批处理函数，接收请求列表，返回等长的结果列表。
+        :param max_batch_size: 每批最多合并的请求数。
+        :param max_wait_ms: 收到第一条请求后等待更多请求的最长时间（毫秒）。
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._max_batch = 0
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item):
+        """提交一条请求，返回 Future；批处理失败时异常会设置到该批所有请求的 Future 上。"""
+        if self._closed:
+            raise RuntimeError("MicroBatcher 已关闭")
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item, timeout=None):
+        """提交一条请求并阻塞等待结果。"""
+        return self.submit(item).result(timeout=timeout)
+
+    def close(self):
+        """停止后台线程；已入队的请求会先处理完。"""
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join()
+
+    def stats(self):
+        """返回已处理的批次数、请求数、平均批大小与最大批大小。"""
+        with self._lock:
+            return {
+                'batches': self._batches,
+                'requests': self._requests,
+                'avg_batch_size': self._requests / self._batches if self._batches else 0.0,
+                'max_batch_size': self._max_batch,
+            }
+
+    def _collect(self):
+        """阻塞等待第一条请求，然后在截止时间内尽量凑满一批；收到关闭信号时返回 None。"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                # 把关闭信号放回队列，先处理完当前批次
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            items = [item for item, _ in batch]
+            try:
+                results = list(self.process_batch(items))
+                # 结果条数不符时整批失败，避免多出的请求永远等不到结果
+                if len(results) != len(batch):
+                    raise RuntimeError(f"批处理返回 {len(results)} 条结果，期望 {len(batch)} 条")
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logger.error(f"批处理失败 ({len(items)} 条请求): {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+            with self._lock:
+                self._batches += 1
+                self._requests += len(batch)
+                self._max_batch = max(self._max_batch, len(batch))
@@ -0,0 +1,88 @@
+# modules/cache_module.py
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    线程安全的进程内缓存：超过容量时按LRU淘汰，条目超过TTL后失效，并统计命中/未命中次数。
+    可选按占用字节数限制容量（需提供 sizeof 函数计算每个值的大小）。
+    """
+
+    def __init__(self, max_size=1024, ttl=None, max_bytes=None, sizeof=None):
+        """
+        :param max_size: 最多缓存的条目数。
+        :param ttl: 条目过期时间（秒），None 表示永不过期。
+        :param max_bytes: 所有值合计占用的最大字节数，None 表示不限制。
+        :param sizeof: 计算单个值占用字节数的函数，与 max_bytes 配合使用。
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._data = OrderedDict()  # key -> (写入时间, value, 字节数)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """读取缓存；未命中或已过期时返回 default。"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                created_at, value, _ = entry
+                if self.ttl is None or time.monotonic() - created_at < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """写入缓存，必要时淘汰最久未使用的条目。"""
+        size = self._sizeof(value) if self._sizeof is not None else 0
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (time.monotonic(), value, size)
+            self.current_bytes += size
+            while self._data and (
+                len(self._data) > self.max_size
+                or (self.max_bytes is not None and self.current_bytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self._data)))
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[2]
+
+    def invalidate(self, key=None):
+        """使指定条目失效；不指定 key 时清空整个缓存。"""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+                self.current_bytes = 0
+            else:
+                self._remove(key)
+
+    def stats(self):
+        """返回缓存的容量与命中统计。"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
@@ -0,0 +1,51 @@
+# modules/graph_schema_module.py
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 知识图谱中的节点标签（与导入脚本 create_constraints 中的唯一性约束一一对应）
+NODE_LABELS = ['Disease', 'Symptom', 'Drug', 'Check', 'Food', 'Department']
+
+# JSON键 -> (目标节点标签, 关系类型)，导入脚本、CSV导出与图快照共用
+RELATIONSHIP_SPECS = [
+    ('symptom', 'Symptom', 'HAS_SYMPTOM'),
+    ('acompany', 'Disease', 'HAS_COMPLICATION'),
+    ('common_drug', 'Drug', 'RECOMMENDS_DRUG'),
+    ('recommand_drug', 'Drug', 'RECOMMENDS_DRUG'),
+    ('check', 'Check', 'NEEDS_CHECK'),
+    ('cure_department', 'Department', 'BELONGS_TO_DEPT'),
+    ('do_eat', 'Food', 'RECOMMENDS_EAT'),
+    ('recommand_eat', 'Food', 'RECOMMENDS_EAT'),
+    ('not_eat', 'Food', 'AVOIDS_EAT'),
+]
+
+
+def disease_properties(disease_data):
+    """疾病节点上保存的属性：只保留 str/int/float 标量，列表等其余类型不写入节点。"""
+    return {k: v for k, v in disease_data.items() if isinstance(v, (str, int, float))}
+
+
+def iter_jsonl(json_file_path, start_offset=0):
+    """
+    惰性解析JSONL文件的生成器，内存占用与文件大小无关。
+    :param json_file_path: JSONL文件的路径（每行一个JSON对象）。
+    :param start_offset: 开始读取的字节偏移（用于断点续传）。
+    :return: 逐条产出 (该行结束处的字节偏移, 疾病数据字典)。
+    """
+    offset = start_offset
+    # 以二进制方式读取，才能准确记录每行结束处的字节偏移
+    with open(json_file_path, 'rb') as f:
+        f.seek(start_offset)
+        for raw_line in f:
+            offset += len(raw_line)
+            line = raw_line.decode('utf-8', errors='replace').strip()
+            if not line:  # 跳过空行
+                continue
+            try:
+                json_obj = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning(f"字节偏移 {offset - len(raw_line)} 处的JSON格式错误: {e}")
+                continue
+            if isinstance(json_obj, dict):
+                yield offset, json_obj
@@ -0,0 +1,246 @@
+# modules/graph_snapshot_module.py
+import logging
+from array import array
+import numpy as np
+from neo4j import GraphDatabase
+from config import Config
+from .graph_schema_module import NODE_LABELS, RELATIONSHIP_SPECS, disease_properties, iter_jsonl
+from .kg_module import KnowledgeGraphModule, INTENT_RELATIONS, INTENT_PROPERTIES
+
+logger = logging.getLogger(__name__)
+
+
+class GraphSnapshot:
+    """
+    只读的进程内图快照。节点名称按标签映射为整数ID，
+    每种关系以CSR数组（indptr/indices）存储疾病到目标节点的邻接表，并保留反向索引。
+    """
+
+    def __init__(self):
+        self.node_ids = {label: {} for label in NODE_LABELS}    # 标签 -> {名称: ID}
+        self.node_names = {label: [] for label in NODE_LABELS}  # 标签 -> [名称]，下标即ID
+        self.disease_props = {}                                 # 疾病ID -> 属性字典
+        self.relation_labels = {rel_type: node_label for _, node_label, rel_type in RELATIONSHIP_SPECS}
+        self.relations = {}          # 关系类型 -> (indptr, indices)，按疾病ID索引
+        self.reverse_relations = {}  # 关系类型 -> (indptr, indices)，按目标节点ID索引
+        self.idf = {}                # 关系类型 -> 目标节点的IDF权重数组，按目标节点ID索引
+        self._edges = {rel_type: (array('i'), array('i')) for rel_type in self.relation_labels}
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        从疾病数据字典的可迭代对象构建快照（与导入脚本使用相同的字段映射与属性过滤，结果与Neo4j后端一致）。
+        :param records: 疾病JSON数据字典的可迭代对象。
+        """
+        snapshot = cls()
+        for disease_data in records:
+            disease_name = disease_data.get('name')
+            if not disease_name:
+                continue
+            snapshot.set_disease_props(disease_name, disease_properties(disease_data))
+            for json_key, _, rel_type in RELATIONSHIP_SPECS:
+                for item_name in disease_data.get(json_key) or []:
+                    snapshot.add_edge(rel_type, disease_name, item_name)
+        return snapshot.finalize()
+
+    @classmethod
+    def from_json(cls, json_file_path):
+        """从JSONL数据文件直接构建快照，无需数据库。"""
+        logger.info(f"正在从 {json_file_path} 构建图快照...")
+        records = (disease_data for _, disease_data in iter_jsonl(json_file_path))
+        return cls.from_records(records)
+
+    @classmethod
+    def from_neo4j(cls, driver):
+        """从Neo4j数据库加载快照（每种关系一次流式查询）。"""
+        logger.info("正在从Neo4j加载图快照...")
+        snapshot = cls()
+        with driver.session() as session:
+            for record in session.run("MATCH (d:Disease) RETURN d.name AS name, properties(d) AS props"):
+                snapshot.set_disease_props(record['name'], dict(record['props']))
+            for rel_type, node_label in snapshot.relation_labels.items():
+                query = f"MATCH (d:Disease)-[:{rel_type}]->(n:{node_label}) RETURN d.name AS source, n.name AS target"
+                for record in session.run(query):
+                    snapshot.add_edge(rel_type, record['source'], record['target'])
+        return snapshot.finalize()
+
+    def intern(self, label, name):
+        """返回节点的整数ID，不存在时分配新ID。"""
+        ids = self.node_ids[label]
+        node_id = ids.get(name)
+        if node_id is None:
+            node_id = ids[name] = len(self.node_names[label])
+            self.node_names[label].append(name)
+        return node_id
+
+    def set_disease_props(self, disease_name, props):
+        self.disease_props[self.intern('Disease', disease_name)] = props
+
+    def add_edge(self, rel_type, disease_name, target_name):
+        if not disease_name or not target_name:
+            return
+        sources, targets = self._edges[rel_type]
+        sources.append(self.intern('Disease', disease_name))
+        targets.append(self.intern(self.relation_labels[rel_type], target_name))
+
+    def finalize(self):
+        """将构建阶段累积的边去重并压缩为CSR数组。"""
+        num_diseases = len(self.node_names['Disease'])
+        for rel_type, (sources, targets) in self._edges.items():
+            num_targets = len(self.node_names[self.relation_labels[rel_type]])
+            src = np.frombuffer(sources, dtype=np.int32) if sources else np.empty(0, dtype=np.int32)
+            dst = np.frombuffer(targets, dtype=np.int32) if targets else np.empty(0, dtype=np.int32)
+            # 以 (源, 目标) 组合键去重并排序
+            keys = np.unique(src.astype(np.int64) * max(num_targets, 1) + dst)
+            src = (keys // max(num_targets, 1)).astype(np.int32)
+            dst = (keys % max(num_targets, 1)).astype(np.int32)
+            self.relations[rel_type] = self._to_csr(src, dst, num_diseases)
+            order = np.lexsort((src, dst))
+            self.reverse_relations[rel_type] = self._to_csr(dst[order], src[order], num_targets)
+            # 与Cypher版本一致的IDF: log(1 + 疾病总数 / 指向该节点的疾病数)
+            degree = np.diff(self.reverse_relations[rel_type][0])
+            self.idf[rel_type] = np.log1p(num_diseases / np.maximum(degree, 1))
+        self._edges = {}
+        logger.info(f"图快照构建完成: {self.stats()}")
+        return self
+
+    @staticmethod
+    def _to_csr(rows, cols, num_rows):
+        indptr = np.zeros(num_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=num_rows), out=indptr[1:])
+        return indptr, cols
+
+    def neighbors(self, rel_type, disease_name):
+        """疾病经指定关系指向的目标节点名称列表。"""
+        disease_id = self.node_ids['Disease'].get(disease_name)
+        if disease_id is None:
+            return []
+        indptr, indices = self.relations[rel_type]
+        names = self.node_names[self.relation_labels[rel_type]]
+        return [names[i] for i in indices[indptr[disease_id]:indptr[disease_id + 1]]]
+
+    def sources(self, rel_type, target_name):
+        """经指定关系指向目标节点的疾病ID数组（反向索引）。"""
+        target_id = self.node_ids[self.relation_labels[rel_type]].get(target_name)
+        if target_id is None:
+            return np.empty(0, dtype=np.int32)
+        indptr, indices = self.reverse_relations[rel_type]
+        return indices[indptr[target_id]:indptr[target_id + 1]]
+
+    def disease_property(self, disease_name, key):
+        disease_id = self.node_ids['Disease'].get(disease_name)
+        if disease_id is None:
+            return None
+        return self.disease_props.get(disease_id, {}).get(key)
+
+    def stats(self):
+        return {
+            'nodes': {label: len(names) for label, names in self.node_names.items()},
+            'relationships': {rel_type: len(indices) for rel_type, (_, indices) in self.relations.items()},
+        }
+
+
+class SnapshotKnowledgeGraphModule(KnowledgeGraphModule):
+    """
+    基于进程内图快照的知识图谱模块，接口与 KnowledgeGraphModule 相同。
+    所有意图均为疾病的一跳关系或属性读取，可直接由快照回答，无需实时访问Neo4j。
+    """
+
+    def __init__(self, snapshot=None):
+        """
+        :param snapshot: 预先构建的 GraphSnapshot；为None时按 Config.KG_SNAPSHOT_SOURCE 加载。
+        """
+        self._driver = None
+        self._snapshot = snapshot
+        if self._snapshot is None:
+            self._snapshot = self._load_snapshot()
+        self._init_cache()
+
+    @staticmethod
+    def _load_snapshot():
+        try:
+            if Config.KG_SNAPSHOT_SOURCE == 'json':
+                return GraphSnapshot.from_json(Config.KG_SNAPSHOT_JSON_PATH)
+
+            driver = GraphDatabase.driver(Config.NEO4J_URI, auth=(Config.NEO4J_USER, Config.NEO4J_PASSWORD))
+            try:
+                return GraphSnapshot.from_neo4j(driver)
+            finally:
+                driver.close()
+        except Exception as e:
+            logger.error(f"加载图快照失败: {e}")
+            return None
+
+    def close(self):
+        self._snapshot = None
+
+    def _is_available(self):
+        return self._snapshot is not None
+
+    def invalidate_cache(self):
+        """数据刷新后重新加载快照并清空查询缓存。"""
+        snapshot = self._load_snapshot()
+        if snapshot is not None:
+            self._snapshot = snapshot
+        super().invalidate_cache()
+
+    def _lookup(self, intent, name):
+        if intent in INTENT_RELATIONS:
+            return self._snapshot.neighbors(INTENT_RELATIONS[intent][0], name)
+        value = self._snapshot.disease_property(name, INTENT_PROPERTIES[intent])
+        return [value] if value else []
+
+    def _run_query(self, intent, primary_entity_name, all_entities):
+        if self._is_batchable(intent):
+            return self._lookup(intent, primary_entity_name)
+
+        if intent == 'find_disease_by_symptom':
+            symptom_names = [e['name'] for e in all_entities if e.get('type') == 'Symptom']
+            if not symptom_names:
+                return None
+            return [name for name, _ in self.rank_diseases_by_symptoms(symptom_names)]
+
+        return None
+
+    def rank_diseases_by_symptoms(self, symptom_names, top_k=None):
+        """
+        与 KnowledgeGraphModule.rank_diseases_by_symptoms 相同的打分方式，
+        在症状->疾病倒排索引（反向CSR）上用向量化的稀疏运算完成。
+        """
+        top_k = top_k or Config.SYMPTOM_INFERENCE_TOP_K
+        symptom_ids = self._snapshot.node_ids['Symptom']
+        ids = np.unique(np.array([symptom_ids[name] for name in symptom_names if name in symptom_ids],
+                                 dtype=np.int64))
+        if ids.size == 0:
+            return []
+
+        indptr, indices = self._snapshot.reverse_relations['HAS_SYMPTOM']
+        starts, lengths = indptr[ids], indptr[ids + 1] - indptr[ids]
+        # 一次性收集所有症状对应的疾病ID，并为每条边附上该症状的IDF权重
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        diseases = indices[offsets]
+        weights = np.repeat(self._snapshot.idf['HAS_SYMPTOM'][ids], lengths)
+        num_diseases = len(self._snapshot.node_names['Disease'])
+        scores = np.bincount(diseases, weights=weights, minlength=num_diseases)
+        matched = np.bincount(diseases, minlength=num_diseases)
+
+        candidates = np.flatnonzero(scores)
+        if candidates.size > top_k:
+            # 先求出第 top_k 高的分数，与之并列的候选全部保留，截断前再按完整的排序键决出名次
+            kth_score = -np.partition(-scores[candidates], top_k - 1)[top_k - 1]
+            candidates = candidates[scores[candidates] >= kth_score]
+        disease_names = self._snapshot.node_names['Disease']
+        # 与Cypher版本的 ORDER BY score DESC, matched DESC, result 一致
+        candidates = sorted(candidates, key=lambda i: (-scores[i], -matched[i], disease_names[i]))[:top_k]
+        return [(disease_names[i], float(scores[i])) for i in candidates]
+
+    def node_names(self, label):
+        if not self._is_available():
+            return []
+        return list(self._snapshot.node_names[label])
+
+    def _run_lookups(self, intents, entity_names):
+        return {
+            (intent, name): self._lookup(intent, name)
+            for intent in intents for name in entity_names
+        }
@@ -0,0 +1,88 @@
+# modules/keyword_module.py
+from collections import deque
+
+
+class AhoCorasick:
+    """
+    多模式串匹配自动机（Aho–Corasick）。构建一次后，对文本做一次线性扫描即可找出所有词典词条，
+    扫描耗时与词典规模无关，适合数万条以上的医学词典。
+    """
+
+    def __init__(self, patterns=None):
+        """
+        :param patterns: 可选的 (模式串, 值) 可迭代对象；同一模式串可对应多个值。
+        """
+        self._goto = [{}]       # 节点 -> {字符: 子节点}
+        self._patterns = [()]   # 节点 -> ((模式串长度, 值), ...)，仅以该节点结尾的模式串
+        self._fail = [0]        # 节点 -> 失配跳转节点（build 时计算）
+        self._output = [()]     # 节点 -> 合并了失配链上全部输出的 _patterns（build 时计算）
+        self._size = 0
+        self._built = False
+        for pattern, value in patterns or ():
+            self.add(pattern, value)
+
+    def add(self, pattern, value=None):
+        """加入一个模式串；value 为空时以模式串本身作为匹配值。"""
+        if not pattern:
+            return
+        node = 0
+        for ch in pattern:
+            child = self._goto[node].get(ch)
+            if child is None:
+                child = len(self._goto)
+                self._goto[node][ch] = child
+                self._goto.append({})
+                self._patterns.append(())
+            node = child
+        self._patterns[node] += ((len(pattern), pattern if value is None else value),)
+        self._size += 1
+        self._built = False
+
+    def build(self):
+        """
+        按BFS顺序计算失配指针，并把失配链上的输出合并到每个节点。
+        每次都从各节点自身的模式串重新计算，build 之后继续 add 再重新 build 结果不变。
+        """
+        self._fail = [0] * len(self._goto)
+        self._output = list(self._patterns)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._output[child] += self._output[self._fail[child]]
+                queue.append(child)
+        self._built = True
+        return self
+
+    def iter_matches(self, text):
+        """逐个产出文本中的全部匹配 (起始位置, 结束位置, 值)，包括相互重叠的匹配。"""
+        if not self._built:
+            self.build()
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for length, value in output[node]:
+                yield i + 1 - length, i + 1, value
+
+    def find_longest(self, text):
+        """
+        返回互不重叠的匹配列表 [(起始位置, 结束位置, 值)]：从左到右取起点最靠前的匹配，
+        同一起点取最长者。
+        """
+        matches = sorted(self.iter_matches(text), key=lambda m: (m[0], m[0] - m[1]))
+        result, last_end = [], 0
+        for start, end, value in matches:
+            if start >= last_end:
+                result.append((start, end, value))
+                last_end = end
+        return result
+
+    def __len__(self):
+        return self._size
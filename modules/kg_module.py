@@ -1,58 +1,264 @@
 # modules/kg_module.py
 import logging
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, unit_of_work
 from config import Config
+from .cache_module import LRUCache
+from .graph_schema_module import NODE_LABELS
 
 logger = logging.getLogger(__name__)
 
+# 不写入缓存的错误提示
+DB_UNAVAILABLE_MESSAGE = "数据库连接失败。"
+QUERY_ERROR_MESSAGE = "知识图谱查询时发生错误。"
+
+# 一跳关系类意图：意图 -> (关系类型, 目标节点标签)
+INTENT_RELATIONS = {
+    'query_symptom': ('HAS_SYMPTOM', 'Symptom'),
+    'query_drug': ('RECOMMENDS_DRUG', 'Drug'),
+    'query_check': ('NEEDS_CHECK', 'Check'),
+    'query_food_avoid': ('AVOIDS_EAT', 'Food'),
+    'query_food_recommend': ('RECOMMENDS_EAT', 'Food'),
+    'query_department': ('BELONGS_TO_DEPT', 'Department'),
+    'query_complication': ('HAS_COMPLICATION', 'Disease'),
+}
+
+# 属性类意图：意图 -> 疾病节点属性名
+INTENT_PROPERTIES = {
+    'query_prevent': 'prevent',
+    'query_cause': 'cause',
+    'query_cure_way': 'cure_way',
+    'query_desc': 'desc',
+}
+
+
+# 批量查询的分支：属性类意图共用一个分支；关系类意图各占一个分支，按具体关系类型与目标标签展开，
+# 以便查询规划器使用类型化的关系扩展，而不是遍历疾病节点的全部关系后再过滤。
+# 关系类型与标签只来自上面的常量字典，实体名称等用户输入一律通过参数传递。
+PROPERTY_LOOKUP_BRANCH = """
+UNWIND $props AS l
+OPTIONAL MATCH (d:Disease {name: l.name})
+RETURN l.intent AS intent, l.name AS name, [d[l.prop]] AS result
+"""
+
+RELATION_LOOKUP_BRANCH = """
+UNWIND $names AS name
+OPTIONAL MATCH (:Disease {{name: name}})-[:{rel}]->(n:{label})
+RETURN ${intent_param} AS intent, name, collect(n.name) AS result
+"""
+
+# 根据症状推断疾病：按IDF加权的症状重合度打分，返回前 top_k 个疾病（不要求包含全部症状）
+# 只使用聚合与模式推导式，不依赖 CALL {} / COUNT {} 子查询，兼容 Neo4j 3.5 至 5.x
+RANK_DISEASES_BY_SYMPTOMS_QUERY = """
+MATCH (all:Disease)
+WITH count(all) AS disease_count
+MATCH (s:Symptom) WHERE s.name IN $names
+WITH s, disease_count, size([(s)<-[:HAS_SYMPTOM]-(:Disease) | 1]) AS df
+WHERE df > 0
+WITH s, log(1.0 + toFloat(disease_count) / df) AS idf
+MATCH (s)<-[:HAS_SYMPTOM]-(d:Disease)
+WITH d, sum(idf) AS score, count(s) AS matched
+RETURN d.name AS result, score, matched
+ORDER BY score DESC, matched DESC, result
+LIMIT $top_k
+"""
+
 class KnowledgeGraphModule:
     def __init__(self):
         try:
             self._driver = GraphDatabase.driver(
                 Config.NEO4J_URI, 
-                auth=(Config.NEO4J_USER, Config.NEO4J_PASSWORD)
+                auth=(Config.NEO4J_USER, Config.NEO4J_PASSWORD),
+                **Config.NEO4J_POOL_CONFIG
             )
             logger.info("成功连接到Neo4j数据库。")
         except Exception as e:
             logger.error(f"连接Neo4j失败: {e}")
             self._driver = None
 
+        self._init_cache()
+
+    def _init_cache(self):
+        cache_config = Config.KG_CACHE_CONFIG
+        self._cache = None
+        if cache_config.get('enabled', True):
+            self._cache = LRUCache(max_size=cache_config.get('max_size', 2048), ttl=cache_config.get('ttl'))
+
     def close(self):
         if self._driver is not None:
             self._driver.close()
 
+    def _is_available(self):
+        """后端是否可用（Neo4j 后端即数据库已连接）。"""
+        return self._driver is not None
+
+    def invalidate_cache(self):
+        """清空查询缓存，供数据导入/刷新后调用。"""
+        if self._cache is not None:
+            self._cache.invalidate()
+            logger.info("知识图谱查询缓存已清空。")
+
+    def cache_stats(self):
+        """返回查询缓存的命中统计；未启用缓存时返回None。"""
+        return self._cache.stats() if self._cache is not None else None
+
+    @staticmethod
+    def _cache_key(intent, entities):
+        """缓存键：(意图, 去除首尾空白并排序后的 (实体类型, 实体名称) 元组)"""
+        normalized = {(e.get('type'), e['name'].strip()) for e in entities}
+        return intent, tuple(sorted(normalized, key=lambda item: (item[0] or '', item[1])))
+
     def query_graph(self, intent, entities):
         """
-        根据意图和实体，查询知识图谱。
+        根据意图和实体，查询知识图谱。相同的 (意图, 实体) 组合优先从进程内缓存返回。
         :param intent: 意图 (e.g., 'query_symptom')
         :param entities: 实体列表 (e.g., [{'type': 'Disease', 'name': '高血压'}])
         :return: 查询结果的格式化字符串。
         """
-        if not self._driver:
-            return "数据库连接失败。"
+        if self._cache is None or not entities:
+            return self._query_graph_uncached(intent, entities)
+
+        key = self._cache_key(intent, entities)
+        result = self._cache.get(key)
+        if result is not None:
+            logger.info(f"知识图谱缓存命中: {key}")
+            return result
+
+        result = self._query_graph_uncached(intent, entities)
+        if result not in (DB_UNAVAILABLE_MESSAGE, QUERY_ERROR_MESSAGE):
+            self._cache.put(key, result)
+        return result
+
+    def _query_graph_uncached(self, intent, entities):
+        """不经过缓存，直接查询知识图谱。"""
+        if not self._is_available():
+            return DB_UNAVAILABLE_MESSAGE
         
         if not entities:
             return "未能识别出有效的实体，无法进行知识查询。"
 
+        # 多个实体时一次批量查询全部实体，避免只使用第一个实体而丢失信息
+        entity_names = list(dict.fromkeys(e['name'] for e in entities))
+        if len(entity_names) > 1 and self._is_batchable(intent):
+            try:
+                results = self._run_lookups([intent], entity_names)
+            except Exception as e:
+                logger.error(f"知识图谱查询失败: {e}")
+                return QUERY_ERROR_MESSAGE
+            return self._join_entity_results(intent, entity_names, results)
+
         # 提取核心实体
-        # 简化处理，默认使用第一个识别出的实体
         primary_entity_name = entities[0]['name']
-        
+
+        try:
+            records = self._run_query(intent, primary_entity_name, entities)
+        except Exception as e:
+            logger.error(f"知识图谱查询失败: {e}")
+            return QUERY_ERROR_MESSAGE
+
+        if records is None:
+            return f"无法处理意图 '{intent}'。"
+        return self._format_records(intent, records)
+
+    def _run_query(self, intent, primary_entity_name, all_entities):
+        """
+        执行单个意图的查询。
+        :return: 结果值列表；意图无法处理时返回None。
+        """
         # 构建Cypher查询
-        cypher_query, params = self._build_cypher_query(intent, primary_entity_name, entities)
+        cypher_query, params = self._build_cypher_query(intent, primary_entity_name, all_entities)
 
         if not cypher_query:
-            return f"无法处理意图 '{intent}'。"
+            return None
 
         logger.info(f"执行Cypher查询: {cypher_query} with params {params}")
-        
-        try:
-            with self._driver.session() as session:
-                results = session.run(cypher_query, params)
-                return self._format_results(intent, results)
-        except Exception as e:
-            logger.error(f"知识图谱查询失败: {e}")
-            return "知识图谱查询时发生错误。"
+
+        results = self._read(cypher_query, params)
+        return [record['result'] for record in results if record['result']]
+
+    def _read(self, query, params):
+        """以读路由的托管事务执行只读查询，事务超时由 Config.NEO4J_QUERY_TIMEOUT 控制。"""
+        @unit_of_work(timeout=Config.NEO4J_QUERY_TIMEOUT)
+        def work(tx):
+            return list(tx.run(query, params))
+
+        with self._driver.session() as session:
+            return session.execute_read(work)
+
+    def rank_diseases_by_symptoms(self, symptom_names, top_k=None):
+        """
+        根据症状推断疾病：每个症状的权重为 log(1 + 疾病总数 / 具有该症状的疾病数)，
+        疾病得分为其匹配症状的权重之和。
+        :param symptom_names: 症状名称列表
+        :param top_k: 返回的疾病数，默认为 Config.SYMPTOM_INFERENCE_TOP_K
+        :return: 按得分降序排列的 [(疾病名称, 得分)]
+        """
+        params = {
+            'names': list(dict.fromkeys(symptom_names)),
+            'top_k': top_k or Config.SYMPTOM_INFERENCE_TOP_K
+        }
+        results = self._read(RANK_DISEASES_BY_SYMPTOMS_QUERY, params)
+        return [(record['result'], record['score']) for record in results]
+
+    def node_names(self, label):
+        """返回指定标签的全部节点名称，用于构建关键词词典。"""
+        if label not in NODE_LABELS:
+            raise ValueError(f"未知的节点标签: {label}")
+        if not self._is_available():
+            return []
+        records = self._read(f"MATCH (n:{label}) RETURN n.name AS name", {})
+        return [record['name'] for record in records if record['name']]
+
+    @staticmethod
+    def _is_batchable(intent):
+        return intent in INTENT_RELATIONS or intent in INTENT_PROPERTIES
+
+    def _join_entity_results(self, intent, entity_names, results):
+        """将多个实体的查询结果按实体顺序拼接为一段文本。"""
+        parts = [
+            f"{name}：{self._format_records(intent, results[(intent, name)])}"
+            for name in entity_names if results.get((intent, name))
+        ]
+        return "\n".join(parts) if parts else "在知识图谱中未找到相关信息。"
+
+    @staticmethod
+    def _build_lookups(intents, entity_names):
+        """
+        构建批量查询：各分支以 UNION ALL 拼接为一条语句，只需一次往返。
+        :return: (Cypher查询语句, 参数)
+        """
+        branches = []
+        params = {'names': list(entity_names)}
+        props = [
+            {'intent': intent, 'name': name, 'prop': INTENT_PROPERTIES[intent]}
+            for intent in intents if intent in INTENT_PROPERTIES
+            for name in entity_names
+        ]
+        if props:
+            branches.append(PROPERTY_LOOKUP_BRANCH)
+            params['props'] = props
+        relation_intents = [intent for intent in intents if intent in INTENT_RELATIONS]
+        for i, intent in enumerate(relation_intents):
+            rel_type, label = INTENT_RELATIONS[intent]
+            intent_param = f"intent_{i}"
+            branches.append(RELATION_LOOKUP_BRANCH.format(rel=rel_type, label=label, intent_param=intent_param))
+            params[intent_param] = intent
+        return "UNION ALL".join(branches), params
+
+    @staticmethod
+    def _parse_lookup_records(records):
+        return {
+            (record['intent'], record['name']): [value for value in record['result'] if value]
+            for record in records
+        }
+
+    def _run_lookups(self, intents, entity_names):
+        """
+        执行批量查询。
+        :return: {(意图, 实体名称): 结果值列表}
+        """
+        query, params = self._build_lookups(intents, entity_names)
+        logger.info(f"执行批量Cypher查询: {len(intents)} 个意图 x {len(entity_names)} 个实体")
+        return self._parse_lookup_records(self._read(query, params))
 
     def _build_cypher_query(self, intent, primary_entity_name, all_entities):
         """根据意图构建Cypher查询语句和参数"""
@@ -86,25 +292,18 @@ class KnowledgeGraphModule:
             # 并发症（并发的疾病）
             query = "MATCH (d:Disease {name: $name})-[:HAS_COMPLICATION]->(c:Disease) RETURN c.name as result"
         elif intent == 'find_disease_by_symptom':
-            # 根据症状查疾病
+            # 根据症状查疾病：按症状重合度排序，部分症状不匹配时仍能给出候选疾病
             symptom_names = [e['name'] for e in all_entities if e.get('type') == 'Symptom']
             if not symptom_names:
                 return None, None
 
-            match_clauses = []
-            for i, name in enumerate(symptom_names):
-                key = f"symptom_{i}"
-                match_clauses.append(f"(d:Disease)-[:HAS_SYMPTOM]->(:Symptom {{name: ${key}}})")
-                params[key] = name
-
-            query = f"MATCH {', '.join(match_clauses)} RETURN DISTINCT d.name as result"
+            query = RANK_DISEASES_BY_SYMPTOMS_QUERY
+            params = {'names': list(dict.fromkeys(symptom_names)), 'top_k': Config.SYMPTOM_INFERENCE_TOP_K}
 
         return query, params
 
-    def _format_results(self, intent, results):
-        """格式化查询结果为自然语言字符串"""
-        records = [record['result'] for record in results if record['result']]
-        
+    def _format_records(self, intent, records):
+        """将查询结果值列表格式化为自然语言字符串"""
         if not records:
             return "在知识图谱中未找到相关信息。"
 
@@ -125,6 +324,7 @@ class KnowledgeGraphModule:
         elif intent == 'query_check':
             return f"建议检查：{' 、'.join(set(records))}"
         elif intent == 'find_disease_by_symptom':
-            return f"可能的疾病：{' 、'.join(set(records))}"
+            # 保持按得分排序的顺序
+            return f"可能的疾病：{' 、'.join(dict.fromkeys(records))}"
         
         return "、".join(set(records))
\ No newline at end of file
@@ -2,11 +2,18 @@
 
 import logging
 import os
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import lru_cache
+from queue import Empty
+from threading import Event, Thread
 import torch
-from transformers import AutoTokenizer, AutoModel
+from transformers import AutoTokenizer, AutoModel, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
 # 新增导入
 from langchain.llms.base import LLM
 from pydantic import PrivateAttr
+from config import Config
+from modules.cache_module import LRUCache
+from modules.scheduler_module import ContinuousBatchScheduler, contains_stop_sequence
 
 # --- 日志配置 ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -15,12 +22,36 @@ logger = logging.getLogger(__name__)
 # --- 模型路徑配置 (直接在這裡定義，方便測試) ---
 CHATGLM_PATH = '/opt/tkxt/models/modelscope/ZhipuAI/chatglm2-6b-int4'
 
-# --- LLM 生成參數 ---
-GENERATION_CONFIG = {
-    'max_length': 2048,
-    'temperature': 0.8,
-    'top_p': 0.9,
-    'do_sample': True,  
+# --- LLM 生成參數（默認值與按意圖的覆蓋統一在 config.py 中配置） ---
+GENERATION_CONFIG = Config.GENERATION_CONFIG
+GENERATION_PROFILES = Config.GENERATION_PROFILES
+
+# 生成失敗時返回給用戶的提示
+GENERATION_ERROR_MESSAGE = "抱歉，生成答案時遇到了技術問題。"
+
+class GenerationError(RuntimeError):
+    """流式生成失敗或超時；已產出的部分回答不完整，調用方不應緩存。"""
+
+# 流式生成時等待下一段文本的最長秒數
+STREAM_TIMEOUT = 120
+
+# 非流式生成經調度器等待整段回答的最長秒數
+GENERATION_TIMEOUT = 600
+
+# --- 連續批處理調度配置 ---
+# 開啟後並發請求在同一個解碼批次中逐步生成，新請求在每個解碼步之前加入，已結束的序列隨即移出
+SCHEDULER_CONFIG = {
+    'enabled': True,
+    'max_batch_size': 8,  # 同時解碼的最大序列數
+}
+
+# --- Prompt前綴KV緩存配置（僅在連續批處理調度器中生效） ---
+# 固定指令部分的KV狀態只計算一次；開啟 cache_context 時，相同知識庫信息的前綴也按LRU緩存
+PREFIX_CACHE_CONFIG = {
+    'enabled': True,
+    'cache_context': True,
+    'max_entries': 32,                 # 最多緩存的前綴數
+    'max_bytes': 1024 * 1024 * 1024    # 前綴KV狀態合計佔用的內存上限（字節）
 }
 
 # --- 設備配置 ---
@@ -50,58 +81,219 @@ def load_model_and_tokenizer():
         logger.error(f"加載模型失敗: {e}", exc_info=True)
         return None, None
 
-def generate_answer(model, tokenizer, query, context="", gen_kwargs=None):
-    """
-    使用加載好的模型和分詞器生成回答。
-    """
-    prompt = f"""你是一名专业医学助手。请严格遵循以下规则作答：
+# 固定的系統指令部分，所有請求相同；其KV狀態在首次預填充後緩存，後續請求直接複用
+PROMPT_INSTRUCTIONS = f"""你是一名专业医学助手。请严格遵循以下规则作答：
 - 若[知识库信息]中包含与问题直接相关的内容，必须严格依据其内容回答，不要编造或引入未提供的事实。
 - 若知识库信息不足或不相关，请明确说明“我未在知识库中找到足够的信息”，必要时仅给出谨慎的通用性建议。
 - 回答应准确、简洁、可执行，可按要点分条说明。
-- 回答结尾必须追加：我只是一个语言模型，具体情况请您咨询医生，提供的方案仅供参考。
+- 回答结尾必须追加：{Config.DISCLAIMER}
 
 [知识库信息]
-{context}
+"""
+
+def build_context_prefix(context=""):
+    """
+    構建Prompt中用戶提問之前的部分（固定指令 + 知識庫信息），相同知識庫信息的請求共享該前綴。
+    """
+    return f"""{PROMPT_INSTRUCTIONS}{context}
 
 [用戶提问]
-{query}
+"""
+
+def build_prompt(query, context=""):
+    """
+    構建發送給模型的完整Prompt。
+    """
+    return f"""{build_context_prefix(context)}{query}
 
 [你的回答]
 """
+
+@lru_cache(maxsize=256)
+def _encode_prefix(tokenizer, text):
+    return tuple(tokenizer(text).input_ids)
+
+def _prefix_lengths(tokenizer, input_ids, context=""):
+    """
+    計算完整Prompt中可複用KV緩存的前綴長度（token數）：固定指令部分，以及按配置再加上知識庫信息部分。
+    取前綴單獨分詞結果與完整Prompt分詞結果的公共前綴，避免邊界處分詞不一致。
+    """
+    texts = [PROMPT_INSTRUCTIONS]
+    if PREFIX_CACHE_CONFIG.get('cache_context') and context:
+        texts.append(build_context_prefix(context))
+    ids = input_ids.tolist()
+    lengths = []
+    for text in texts:
+        prefix_ids = _encode_prefix(tokenizer, text)
+        n = 0
+        while n < min(len(prefix_ids), len(ids)) and prefix_ids[n] == ids[n]:
+            n += 1
+        lengths.append(n)
+    return lengths
+
+def _merge_generation_config(gen_kwargs=None, intent=None):
+    # 依次合并默认参数、意图对应的生成配置与调用时的生成参数
+    final_cfg = {**GENERATION_CONFIG, **GENERATION_PROFILES.get(intent, {})}
+    if gen_kwargs:
+        final_cfg.update(gen_kwargs)
+    # 若设置了采样相关参数而未显式指定 do_sample，则默认开启采样
+    if ('temperature' in final_cfg or 'top_p' in final_cfg) and 'do_sample' not in final_cfg:
+        final_cfg['do_sample'] = True
+    # 贪心解码时去掉采样参数，避免 transformers 的无效参数告警
+    if not final_cfg.get('do_sample'):
+        final_cfg.pop('temperature', None)
+        final_cfg.pop('top_p', None)
+    return final_cfg
+
+class StopSequenceCriteria(StoppingCriteria):
+    """
+    生成的文本中出現任一停止序列（如免責聲明）後即停止生成，停止序列本身保留在回答中。
+    """
+
+    def __init__(self, tokenizer, stop_sequences, prompt_length):
+        self.tokenizer = tokenizer
+        self.stop_sequences = list(stop_sequences)
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = [
+            contains_stop_sequence(self.tokenizer, row[self.prompt_length:].tolist(), self.stop_sequences)
+            for row in input_ids
+        ]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+class CancelCriteria(StoppingCriteria):
+    """
+    取消事件被設置後（如流式請求的客戶端已斷開）在下一個解碼步停止生成。
+    """
+
+    def __init__(self, cancel_event):
+        self.cancel_event = cancel_event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.cancel_event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+def _model_generate_kwargs(tokenizer, final_cfg, prompt_length, cancel_event=None):
+    # 把 stop_sequences 與取消事件轉換為 model.generate 可用的停止條件
+    kwargs = dict(final_cfg)
+    stop_sequences = kwargs.pop('stop_sequences', None)
+    criteria = []
+    if stop_sequences:
+        criteria.append(StopSequenceCriteria(tokenizer, stop_sequences, prompt_length))
+    if cancel_event is not None:
+        criteria.append(CancelCriteria(cancel_event))
+    if criteria:
+        kwargs['stopping_criteria'] = StoppingCriteriaList(criteria)
+    return kwargs
+
+def generate_answer(model, tokenizer, query, context="", gen_kwargs=None, scheduler=None, intent=None):
+    """
+    使用加載好的模型和分詞器生成回答。
+    :param scheduler: 可選的 ContinuousBatchScheduler，提供時由調度器與其他並發請求合批生成。
+    :param intent: 查詢意圖，用於選擇 GENERATION_PROFILES 中的生成配置（token預算、是否採樣等）。
+    生成失敗或經調度器等待超過 GENERATION_TIMEOUT 秒時返回 GENERATION_ERROR_MESSAGE。
+    """
+    prompt = build_prompt(query, context)
     logger.info(f"構建的最終Prompt:\n{prompt}")
 
     try:
         inputs = tokenizer(prompt, return_tensors="pt").to(DEVICE)
-        # 合并默认与调用时的生成参数
-        final_cfg = {**GENERATION_CONFIG}
-        if gen_kwargs:
-            final_cfg.update(gen_kwargs)
-        # 若设置了采样相关参数而未显式指定 do_sample，则默认开启采样
-        if ('temperature' in final_cfg or 'top_p' in final_cfg) and 'do_sample' not in final_cfg:
-            final_cfg['do_sample'] = True
-
-        response_ids = model.generate(**inputs, **final_cfg)
-        input_length = inputs.input_ids.shape[1]
-        response_text = tokenizer.decode(response_ids[0][input_length:], skip_special_tokens=True)
+        final_cfg = _merge_generation_config(gen_kwargs, intent)
+
+        if scheduler is not None:
+            prefix_lengths = _prefix_lengths(tokenizer, inputs.input_ids[0], context)
+            future = scheduler.submit(inputs.input_ids[0], final_cfg, prefix_lengths=prefix_lengths)
+            try:
+                output_ids = future.result(timeout=GENERATION_TIMEOUT)
+            except FutureTimeoutError as e:
+                # 放棄該請求，調度器在下一個解碼步後將其移出批次
+                future.cancel()
+                raise GenerationError(f"生成超過 {GENERATION_TIMEOUT} 秒未完成") from e
+        else:
+            response_ids = model.generate(**inputs, **_model_generate_kwargs(tokenizer, final_cfg, inputs.input_ids.shape[1]))
+            output_ids = response_ids[0][inputs.input_ids.shape[1]:]
+        response_text = tokenizer.decode(output_ids, skip_special_tokens=True)
         
         return response_text.strip()
 
     except Exception as e:
         logger.error(f"生成答案時發生錯誤: {e}", exc_info=True)
-        return "抱歉，生成答案時遇到了技術問題。"
+        return GENERATION_ERROR_MESSAGE
+
+def stream_answer(model, tokenizer, query, context="", gen_kwargs=None, timeout=STREAM_TIMEOUT, scheduler=None, intent=None):
+    """
+    流式生成回答：在後台線程中執行 model.generate（或提交給調度器），通過 TextIteratorStreamer 逐段產出已解碼的文本增量。
+    生成器被提前關閉（客戶端斷開連接）或超時時停止後台生成，不再佔用模型。
+    :param timeout: 等待下一段文本的最長秒數，超時視為生成失敗
+    :raises GenerationError: 生成失敗或超時（此前已產出的文本不完整）
+    """
+    prompt = build_prompt(query, context)
+    logger.info(f"構建的最終Prompt (流式):\n{prompt}")
+
+    future = None
+    try:
+        inputs = tokenizer(prompt, return_tensors="pt").to(DEVICE)
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=timeout)
+        final_cfg = _merge_generation_config(gen_kwargs, intent)
+        if scheduler is not None:
+            prefix_lengths = _prefix_lengths(tokenizer, inputs.input_ids[0], context)
+            future = scheduler.submit(inputs.input_ids[0], final_cfg, streamer=streamer, prefix_lengths=prefix_lengths)
+    except Exception as e:
+        logger.error(f"生成答案時發生錯誤: {e}", exc_info=True)
+        raise GenerationError(GENERATION_ERROR_MESSAGE) from e
+
+    errors = []
+    cancel_event = Event()
+
+    def run():
+        try:
+            generate_kwargs = _model_generate_kwargs(tokenizer, final_cfg, inputs.input_ids.shape[1], cancel_event)
+            model.generate(**inputs, **generate_kwargs, streamer=streamer)
+        except Exception as e:
+            logger.error(f"流式生成答案時發生錯誤: {e}", exc_info=True)
+            errors.append(e)
+            streamer.end()
+
+    thread = None
+    if future is None:
+        thread = Thread(target=run, name="llm-stream", daemon=True)
+        thread.start()
+    try:
+        for text in streamer:
+            if text:
+                yield text
+    except Empty as e:
+        logger.error(f"流式生成超過 {timeout} 秒未產出新內容")
+        raise GenerationError(GENERATION_ERROR_MESSAGE) from e
+    finally:
+        # 超時或生成器被關閉時取消調度器中的序列，或令 model.generate 在下一個解碼步停止；正常結束時均為空操作
+        if future is not None:
+            future.cancel()
+        cancel_event.set()
+
+    # 文本流結束後後台生成已完成，取出其中的異常
+    if thread is not None:
+        thread.join()
+    elif future.exception() is not None:
+        errors.append(future.exception())
+    if errors:
+        raise GenerationError(GENERATION_ERROR_MESSAGE) from errors[0]
 
 class ChatGLMForLangChain(LLM):
     _model = PrivateAttr(default=None)
     _tokenizer = PrivateAttr(default=None)
     _device = PrivateAttr(default="cpu")
     _gen_config = PrivateAttr(default_factory=dict)
+    _scheduler = PrivateAttr(default=None)
 
-    def __init__(self, model, tokenizer, device: str = "cpu", gen_config: dict = None):
+    def __init__(self, model, tokenizer, device: str = "cpu", gen_config: dict = None, scheduler=None):
         super().__init__()
         self._model = model
         self._tokenizer = tokenizer
         self._device = device
         self._gen_config = gen_config or {}
+        # 与主流程共用同一个调度器，避免在调度器工作线程之外并发使用模型
+        self._scheduler = scheduler
 
         if getattr(self._tokenizer, "pad_token", None) is None:
             self._tokenizer.pad_token = self._tokenizer.eos_token
@@ -114,18 +306,20 @@ class ChatGLMForLangChain(LLM):
         """
         直接复用你已经验证可用的生成路径：generate_answer(model, tokenizer, ...)，
         只是把 prompt 当成 query 放入，避免再次走远程的 chat/generate 特殊逻辑。
+        启用调度器时经由调度器生成，与主流程的并发请求合批。
         """
         try:
             # 将 LangChain 传入参数合并为生成配置
             local_cfg = {
                 "temperature": kwargs.get("temperature", self._gen_config.get("temperature", 0.8)),
                 "top_p": kwargs.get("top_p", self._gen_config.get("top_p", 0.9)),
-                "max_length": kwargs.get("max_length", self._gen_config.get("max_length", 2048)),
+                "max_new_tokens": kwargs.get("max_new_tokens", self._gen_config.get("max_new_tokens", 512)),
                 # 默认开启采样，避免告警
                 "do_sample": kwargs.get("do_sample", self._gen_config.get("do_sample", True)),
             }
 
-            text = generate_answer(self._model, self._tokenizer, query=prompt, context="", gen_kwargs=local_cfg)
+            text = generate_answer(self._model, self._tokenizer, query=prompt, context="", gen_kwargs=local_cfg,
+                                   scheduler=self._scheduler)
             return text or "抱歉，我无法生成回答。"
         except Exception as e:
             logging.error(f"LangChain包装层生成失败: {e}", exc_info=True)
@@ -140,20 +334,46 @@ class LLMModule:
             raise RuntimeError("ChatGLM 模型/分词器加载失败")
         self.device = DEVICE
         self.gen_config = GENERATION_CONFIG.copy()
+        self.scheduler = None
+        if SCHEDULER_CONFIG.get('enabled'):
+            prefix_cache = None
+            if PREFIX_CACHE_CONFIG.get('enabled'):
+                prefix_cache = LRUCache(
+                    max_size=PREFIX_CACHE_CONFIG.get('max_entries', 32),
+                    max_bytes=PREFIX_CACHE_CONFIG.get('max_bytes'),
+                    sizeof=ContinuousBatchScheduler.past_nbytes
+                )
+            self.scheduler = ContinuousBatchScheduler(
+                self.model,
+                self.tokenizer,
+                max_batch_size=SCHEDULER_CONFIG.get('max_batch_size', 8),
+                prefix_cache=prefix_cache
+            )
 
         # 暴露一个 LangChain LLM 实例，方便需要链式使用的场景
         self.llm = ChatGLMForLangChain(
             model=self.model,
             tokenizer=self.tokenizer,
             device=self.device,
-            gen_config=self.gen_config
+            gen_config=self.gen_config,
+            scheduler=self.scheduler
         )
 
-    def generate_answer(self, query: str, kg_results: str) -> str:
+    def generate_answer(self, query: str, kg_results: str, intent: str = None) -> str:
         """
-        供主流程调用：复用你函数版的生成，确保与独立测试一致。
+        供主流程调用：复用你函数版的生成，确保与独立测试一致；按意图选择生成配置。
         """
-        return generate_answer(self.model, self.tokenizer, query=query, context=kg_results)
+        return generate_answer(
+            self.model, self.tokenizer, query=query, context=kg_results, scheduler=self.scheduler, intent=intent
+        )
+
+    def stream_answer(self, query: str, kg_results: str, intent: str = None):
+        """
+        流式版本的 generate_answer：逐段產出模型生成的文本增量，首段在預填充完成後即可返回。
+        """
+        return stream_answer(
+            self.model, self.tokenizer, query=query, context=kg_results, scheduler=self.scheduler, intent=intent
+        )
 
     def get_model_info(self):
         return {
@@ -161,4 +381,5 @@ class LLMModule:
             "model_path": CHATGLM_PATH,
             "device": self.device,
             "llm_type": "chatglm-local",
+            "scheduler": self.scheduler.stats() if self.scheduler else None,
         }
\ No newline at end of file
@@ -1,12 +1,28 @@
 # modules/medical_intent_module.py
+import glob
+import hashlib
+import json
 import logging
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+import os
+import re
+import unicodedata
+import warnings
 import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
 from config import Config
+from .cache_module import LRUCache
+from .onnx_module import create_session, prepare_onnx_model, stage_thread_counts
 
 logger = logging.getLogger(__name__)
 
+
+def normalize_query(text):
+    """查询文本归一化（全角转半角、去除首尾及连续空白、英文小写），作为向量缓存的键。"""
+    text = unicodedata.normalize('NFKC', text)
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
 class MedicalIntentModule:
     def __init__(self):
         self.model_name = Config.INTENT_MODEL_NAME
@@ -126,10 +142,298 @@ class MedicalIntentModule:
             ]
         }
         
-        # 对模板进行编码，预先计算好向量
-        self.template_embeddings = {}
-        for intent, templates in self.intent_templates.items():
-            self.template_embeddings[intent] = self.model.encode(templates, convert_to_tensor=True)
+        # 对全部模板一次性编码并归一化，按意图顺序堆叠成一个连续矩阵 (模板数, 维度)，
+        # 点积即余弦相似度；再记录每个意图在矩阵中的行区间，用于分段聚合
+        intent_config = Config.INTENT_CONFIG
+        self.aggregation = intent_config.get('aggregation', 'mean')
+        self.top_k = intent_config.get('top_k', 3)
+        self.threshold = intent_config.get('threshold', 0.3)
+        self.embedding_cache_dir = intent_config.get('embedding_cache_dir')
+
+        # 查询向量缓存：以归一化后的查询文本为键，供意图识别及语义缓存、检索等下游组件共用
+        cache_config = Config.EMBEDDING_CACHE_CONFIG
+        self.query_cache = None
+        if cache_config.get('enabled', True):
+            self.query_cache = LRUCache(
+                max_size=cache_config.get('max_size', 4096),
+                max_bytes=cache_config.get('max_bytes'),
+                sizeof=lambda tensor: tensor.element_size() * tensor.nelement()
+            )
+
+        # 推理后端：默认fp32的SentenceTransformer，可按配置切换到 torch 动态int8 或 ONNX Runtime
+        self.backend = 'torch'
+        self._quantized_model = None
+        self._onnx_session = None
+
+        self.intent_names = list(self.intent_templates.keys())
+        all_templates = [t for intent in self.intent_names for t in self.intent_templates[intent]]
+        self.template_matrix = self._load_or_encode_templates(all_templates)
+        self._build_segment_index()
+
+        backend = Config.INTENT_BACKEND_CONFIG.get('backend', 'torch')
+        if backend != 'torch':
+            self._init_backend(backend, all_templates)
+        logger.info(f"意图识别推理后端: {self.backend}")
+
+    def _init_backend(self, backend, templates):
+        """
+        初始化加速后端并用它重新编码模板；只有在模板集上的识别结果与fp32一致时才启用，否则保持fp32。
+        """
+        cfg = Config.INTENT_BACKEND_CONFIG
+        if self.device == "cuda" and torch.cuda.is_available():
+            logger.warning("量化/ONNX后端仅用于CPU推理，当前使用GPU，保持torch后端")
+            return
+
+        try:
+            if backend == 'torch-int8':
+                self._quantized_model = torch.quantization.quantize_dynamic(
+                    self.model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+                name = 'torch-int8'
+            elif backend == 'onnx':
+                self._onnx_session = self._create_onnx_session(cfg)
+                name = 'onnx-int8' if cfg.get('quantize') else 'onnx'
+            else:
+                raise ValueError(f"未知的意图识别推理后端: {backend}")
+            matrix = self._load_or_encode_templates(templates, backend=name)
+        except Exception as e:
+            logger.error(f"意图识别后端 {backend} 初始化失败，使用torch后端: {e}")
+            self._quantized_model = self._onnx_session = None
+            return
+
+        if not self._validate_backend(name, matrix):
+            self._quantized_model = self._onnx_session = None
+            return
+        self.backend = name
+        self.template_matrix = matrix
+
+    def _create_onnx_session(self, cfg):
+        """导出SentenceTransformer底层的Transformer编码器（池化在导出模型之外完成）。"""
+        pooling = self.model[1]
+        if not getattr(pooling, 'pooling_mode_mean_tokens', False):
+            raise ValueError("ONNX后端仅支持均值池化的句向量模型")
+
+        sample = self.model.tokenizer(["感冒的病因"], return_tensors="pt")
+        dummy_inputs = {name: sample[name] for name in ('input_ids', 'attention_mask', 'token_type_ids')}
+        dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in [*dummy_inputs, 'last_hidden_state']}
+        onnx_path = prepare_onnx_model(
+            self.model[0].auto_model.cpu(), dummy_inputs, cfg['onnx_path'], ['last_hidden_state'],
+            dynamic_axes, quantize=cfg.get('quantize', False)
+        )
+        # 与NER阶段并行执行时只使用分配给意图识别阶段的线程数
+        return create_session(onnx_path, cfg.get('intra_op_threads') or stage_thread_counts().get('intent'))
+
+    def _validate_backend(self, backend, matrix):
+        """
+        以模板集作为验证集：每个模板作为查询分别用fp32与加速后端的向量识别意图，
+        要求准确率下降不超过 max_accuracy_drop，且模板向量与fp32的余弦相似度不低于 min_cosine。
+        """
+        cfg = Config.INTENT_BACKEND_CONFIG
+        labels = torch.repeat_interleave(
+            torch.arange(len(self.intent_names)), self._segment_counts.long().cpu()
+        )
+        with torch.no_grad():
+            reference = self.score_intents(self.template_matrix).argmax(dim=-1).cpu()
+            predicted = self.score_intents(matrix, template_matrix=matrix).argmax(dim=-1).cpu()
+            cosine = (matrix.float() * self.template_matrix.float()).sum(dim=-1)
+
+        reference_accuracy = (reference == labels).float().mean().item()
+        accuracy = (predicted == labels).float().mean().item()
+        agreement = (predicted == reference).float().mean().item()
+        min_cosine = cosine.min().item()
+        logger.info(
+            f"意图识别后端 {backend} 验证: 模板集准确率 {accuracy:.4f} (fp32 {reference_accuracy:.4f}), "
+            f"与fp32预测一致率 {agreement:.4f}, 最小余弦相似度 {min_cosine:.4f}"
+        )
+        if accuracy < reference_accuracy - cfg.get('max_accuracy_drop', 0.0) or min_cosine < cfg.get('min_cosine', 0.0):
+            logger.warning(f"意图识别后端 {backend} 未通过精度验证，使用torch后端")
+            return False
+        return True
+
+    def _encode(self, texts, backend=None):
+        """用指定后端（默认当前后端）编码文本，返回归一化后的句向量张量。"""
+        backend = backend or self.backend
+        if backend.startswith('onnx'):
+            return self._encode_onnx(texts)
+        model = self._quantized_model if backend == 'torch-int8' else self.model
+        return model.encode(texts, convert_to_tensor=True, normalize_embeddings=True)
+
+    def _encode_onnx(self, texts, batch_size=32):
+        """ONNX Runtime 编码：取最后一层隐状态，按注意力掩码做均值池化后归一化，与SentenceTransformer一致。"""
+        input_names = [node.name for node in self._onnx_session.get_inputs()]
+        pooled = []
+        for start in range(0, len(texts), batch_size):
+            features = self.model.tokenizer(
+                texts[start:start + batch_size], padding=True, truncation=True,
+                max_length=self.model.max_seq_length, return_tensors="np"
+            )
+            hidden = self._onnx_session.run(
+                ['last_hidden_state'], {name: features[name].astype(np.int64) for name in input_names}
+            )[0]
+            mask = features['attention_mask'][..., None].astype(hidden.dtype)
+            pooled.append((hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None))
+        embeddings = torch.from_numpy(np.concatenate(pooled))
+        return torch.nn.functional.normalize(embeddings, dim=-1).to(self.device)
+
+    def _model_fingerprint(self):
+        """模型版本指纹：模型路径及其配置/权重文件的大小与修改时间。"""
+        fingerprint = {'model': os.path.abspath(self.model_name)}
+        if os.path.isdir(self.model_name):
+            for file_name in sorted(os.listdir(self.model_name)):
+                if file_name.endswith(('.json', '.bin', '.safetensors', '.txt')):
+                    stat = os.stat(os.path.join(self.model_name, file_name))
+                    fingerprint[file_name] = [stat.st_size, stat.st_mtime_ns]
+        return fingerprint
+
+    def _template_cache_path(self, templates, backend):
+        """缓存文件路径，文件名由推理后端、模型指纹与模板文本共同决定。"""
+        key_source = json.dumps(
+            {'model': self._model_fingerprint(), 'backend': backend,
+             'intents': self.intent_names, 'templates': templates},
+            ensure_ascii=False, sort_keys=True
+        )
+        key = hashlib.sha256(key_source.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.embedding_cache_dir, f"intent_templates_{backend}_{key}.npy")
+
+    def _load_or_encode_templates(self, templates, backend='torch'):
+        """
+        优先以内存映射方式零拷贝加载磁盘上的模板向量矩阵；
+        模板或模型发生变化时缓存键随之变化，自动重新编码并替换旧缓存。
+        每个推理后端各自缓存一份，互不覆盖。
+        """
+        cache_path = self._template_cache_path(templates, backend) if self.embedding_cache_dir else None
+        if cache_path and os.path.exists(cache_path):
+            try:
+                matrix = np.load(cache_path, mmap_mode='r')
+                if matrix.shape[0] == len(templates):
+                    logger.info(f"从缓存加载意图模板向量: {cache_path}")
+                    with warnings.catch_warnings():
+                        # 内存映射数组为只读，torch 会提示不可写，此处只读使用即可
+                        warnings.simplefilter('ignore', UserWarning)
+                        return torch.from_numpy(matrix).to(self.device)
+                logger.warning(f"缓存文件与模板数量不一致，重新编码: {cache_path}")
+            except (OSError, ValueError) as e:
+                logger.warning(f"加载意图模板向量缓存失败，重新编码: {e}")
+
+        matrix = self._encode(templates, backend).contiguous()
+        if cache_path:
+            self._save_template_cache(cache_path, matrix, backend)
+        return matrix
+
+    def _save_template_cache(self, cache_path, matrix, backend):
+        """原子地写入缓存文件，并清理同目录下同一后端过期的模板缓存。"""
+        try:
+            os.makedirs(self.embedding_cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.tmp.npy"
+            np.save(tmp_path, matrix.float().cpu().numpy())
+            os.replace(tmp_path, cache_path)
+            for stale_path in glob.glob(os.path.join(self.embedding_cache_dir, f"intent_templates_{backend}_*.npy")):
+                if stale_path != cache_path:
+                    os.remove(stale_path)
+            logger.info(f"意图模板向量已缓存至: {cache_path}")
+        except OSError as e:
+            logger.warning(f"写入意图模板向量缓存失败: {e}")
+
+    def _build_segment_index(self):
+        """
+        构建 (意图数, 最大模板数) 的填充索引与掩码，使分段聚合可以一次完成。
+        """
+        counts = [len(self.intent_templates[intent]) for intent in self.intent_names]
+        max_count = max(counts)
+        index = torch.zeros(len(counts), max_count, dtype=torch.long)
+        mask = torch.zeros(len(counts), max_count, dtype=torch.bool)
+        offset = 0
+        for i, count in enumerate(counts):
+            index[i, :count] = torch.arange(offset, offset + count)
+            mask[i, :count] = True
+            offset += count
+        device = self.template_matrix.device
+        self._segment_index = index.to(device)
+        self._segment_mask = mask.to(device)
+        self._segment_counts = torch.tensor(counts, dtype=self.template_matrix.dtype, device=device)
+
+    def score_intents(self, query_embeddings, template_matrix=None):
+        """
+        计算一批查询向量对每个意图的得分：一次矩阵乘法得到与全部模板的相似度，再按意图分段聚合。
+        :param query_embeddings: (批大小, 维度) 的归一化查询向量
+        :param template_matrix: 模板向量矩阵，默认使用 self.template_matrix
+        :return: (批大小, 意图数) 的得分矩阵，列顺序与 self.intent_names 一致
+        """
+        if template_matrix is None:
+            template_matrix = self.template_matrix
+        similarities = query_embeddings @ template_matrix.T             # (B, T)
+        segmented = similarities[:, self._segment_index]                 # (B, I, L)
+        mask = self._segment_mask.unsqueeze(0)
+
+        if self.aggregation == 'max':
+            return segmented.masked_fill(~mask, float('-inf')).max(dim=-1).values
+        if self.aggregation == 'topk_mean':
+            k = min(self.top_k, segmented.shape[-1])
+            top_values = segmented.masked_fill(~mask, float('-inf')).topk(k, dim=-1).values
+            valid = torch.clamp(self._segment_counts, max=k)
+            return top_values.masked_fill(torch.isinf(top_values), 0.0).sum(dim=-1) / valid
+        # 默认: 与全部模板相似度的平均值
+        return segmented.masked_fill(~mask, 0.0).sum(dim=-1) / self._segment_counts
+
+    def encode_queries(self, texts):
+        """
+        获取一批查询的归一化向量，已缓存的直接复用，未命中的合并为一次编码。
+        :param texts: 文本列表
+        :return: (批大小, 维度) 的向量张量
+        """
+        keys = [normalize_query(text) for text in texts]
+        if self.query_cache is None:
+            return self._encode(keys)
+
+        embeddings = [self.query_cache.get(key) for key in keys]
+        missing = list(dict.fromkeys(key for key, emb in zip(keys, embeddings) if emb is None))
+        if missing:
+            encoded = self._encode(missing)
+            fresh = dict(zip(missing, encoded))
+            for key, emb in fresh.items():
+                self.query_cache.put(key, emb)
+            embeddings = [emb if emb is not None else fresh[key] for key, emb in zip(keys, embeddings)]
+        return torch.stack(embeddings)
+
+    def encode_query(self, text):
+        """获取单个查询的归一化向量（带缓存），供其他组件复用以避免重复编码。"""
+        return self.encode_queries([text])[0]
+
+    def embedding_cache_stats(self):
+        """返回查询向量缓存的命中与内存占用统计；未启用缓存时返回None。"""
+        return self.query_cache.stats() if self.query_cache is not None else None
+
+    def recognize_intents_batch(self, texts):
+        """
+        批量识别意图：所有查询一次编码、一次打分。
+        :param texts: 文本列表
+        :return: 与输入等长的意图列表
+        """
+        intents = ["unknown_intent"] * len(texts)
+        valid = [i for i, text in enumerate(texts) if text.strip()]
+        if not valid:
+            return intents
+
+        query_embeddings = self.encode_queries([texts[i] for i in valid])
+        for i, intent in zip(valid, self.intents_from_embeddings(query_embeddings)):
+            intents[i] = intent
+        return intents
+
+    def intents_from_embeddings(self, query_embeddings):
+        """
+        由已编码的查询向量判定意图，供已持有查询向量的组件（如回答缓存）复用，无需重新编码。
+        :param query_embeddings: (批大小, 维度) 的归一化向量张量
+        :return: 意图列表，最高得分低于阈值时为 unknown_intent
+        """
+        with torch.no_grad():
+            best_scores, best_indices = self.score_intents(query_embeddings).max(dim=-1)
+
+        intents = []
+        for score, index in zip(best_scores.tolist(), best_indices.tolist()):
+            logger.debug(f"最高相似度: {score:.3f}, 匹配意图: {self.intent_names[index]}")
+            # 降低阈值，提高召回率
+            intents.append(self.intent_names[index] if score >= self.threshold else "unknown_intent")
+        return intents
 
     def recognize_intent(self, text: str):
         """
@@ -140,32 +444,9 @@ class MedicalIntentModule:
             return "unknown_intent"
             
         try:
-            query_embedding = self.model.encode(text, convert_to_tensor=True)
-            
-            best_match_intent = "unknown_intent"
-            max_similarity = -1.0
-            
-            for intent, template_embs in self.template_embeddings.items():
-                # 计算余弦相似度
-                similarities = cosine_similarity(
-                    query_embedding.cpu().numpy().reshape(1, -1),
-                    template_embs.cpu().numpy()
-                )
-                avg_similarity = np.mean(similarities)
-                
-                logger.info(f"意图 '{intent}' 的相似度: {avg_similarity:.3f}")
-                
-                if avg_similarity > max_similarity:
-                    max_similarity = avg_similarity
-                    best_match_intent = intent
-            
-            # 降低阈值，提高召回率
-            logger.info(f"最高相似度: {max_similarity:.3f}, 匹配意图: {best_match_intent}")
-            
-            if max_similarity < 0.3:  # 从0.5降低到0.3
-                return "unknown_intent"
-
-            return best_match_intent
+            intent = self.recognize_intents_batch([text])[0]
+            logger.info(f"匹配意图: {intent}")
+            return intent
         except Exception as e:
             logger.error(f"意图识别失败: {e}")
-            return "unknown_error"
\ No newline at end of file
+            return "unknown_error"
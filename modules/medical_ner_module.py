@@ -1,34 +1,116 @@
 import logging
+import numpy as np
 import torch
 from transformers import AutoModelForTokenClassification, BertTokenizerFast
 from config import Config
+from .keyword_module import AhoCorasick
+from .onnx_module import create_session, prepare_onnx_model, stage_thread_counts
 
 logger = logging.getLogger(__name__)
 
+# 实体类型关键词，按判定优先级排列：实体中包含某类关键词即归为该类
+# （各类原有的后缀规则均已被对应的关键词覆盖）
+ENTITY_TYPE_KEYWORDS = [
+    # 疾病相关关键词（最常见的）
+    ('Disease', [
+        '病', '症', '炎', '癌', '瘤', '血压', '糖尿', '痛风', '感冒', '发烧',
+        '肺炎', '胃炎', '肝炎', '肾炎', '心脏病', '脑梗', '中风', '骨折',
+        '钙化', '结石', '囊肿', '增生', '硬化', '萎缩', '狭窄', '梗阻'
+    ]),
+    # 症状相关关键词
+    ('Symptom', [
+        '疼', '痛', '酸', '胀', '麻', '痒', '热', '冷', '晕', '乏力',
+        '恶心', '呕吐', '腹泻', '便秘', '咳嗽', '气短', '心慌', '失眠',
+        '头晕', '头痛', '胸闷', '腹胀', '食欲不振', '体重下降'
+    ]),
+    # 药物相关关键词
+    ('Drug', [
+        '针', '片', '胶囊', '颗粒', '丸', '散', '膏', '液', '素', '林', '霉素',
+        '阿司匹林', '布洛芬', '青霉素', '胰岛素', '玻尿酸', '肉毒素',
+        '药', '剂', '制剂', '注射', '滴眼', '滴鼻', '口服', '外用'
+    ]),
+    # 检查相关关键词
+    ('Check', [
+        'CT', 'MRI', 'X光', 'B超', '彩超', '心电图', '脑电图', '肌电图',
+        '血常规', '尿常规', '肝功', '肾功', '血糖', '血脂', '血压',
+        '检查', '检验', '化验', '筛查', '监测', '测定', '分析'
+    ]),
+    # 科室相关关键词
+    ('Department', [
+        '科', '内科', '外科', '儿科', '妇科', '骨科', '眼科', '耳鼻喉',
+        '皮肤科', '神经科', '心内科', '消化科', '呼吸科', '肿瘤科',
+        '急诊', '门诊', '病房', '诊室'
+    ]),
+    # 食物相关关键词
+    ('Food', [
+        '食物', '食品', '饮食', '营养', '蛋白', '维生素', '钙', '铁', '锌',
+        '水果', '蔬菜', '肉类', '海鲜', '豆类', '坚果', '奶制品', '主食',
+        '米', '面', '肉', '鱼', '虾', '蟹', '奶', '蛋'
+    ]),
+]
+
+# 启用ONNX后端时用于与torch输出比对的验证句子
+BACKEND_CHECK_SENTENCES = [
+    "风寒了吃什么药", "感冒的病因", "高血压患者饮食需要注意什么",
+    "糖尿病应该做哪些检查", "头痛恶心呕吐是什么病", "肺炎挂哪个科室",
+    "胃炎不能吃什么", "布洛芬可以治疗偏头痛吗"
+]
+
 class MedicalNerModel:
     """来自iioSnail/bert-base-chinese-medical-ner项目的工具类"""
     
     @staticmethod
-    def format_outputs(sentences, outputs):
+    def decode_spans(outputs, lengths):
         """
-        将模型输出转换为实体列表
-        outputs: tensor格式的输出，其中 1=B, 2=I, 3=E, 4=O
+        按BIES标签解码实体跨度（对整个批次做向量化运算）
+        outputs: (序列数, 长度) 的标签矩阵（tensor/ndarray），其中 1=B, 2=I, 3=E, 4=O
+        lengths: 每行参与解码的有效长度
+        返回每行的 [(start, end)] 跨度列表（左闭右开）
+
+        每个B都开启一个实体，向后吞并连续的I，紧随其后的E（若在有效长度内）一并纳入。
         """
+        labels = outputs.numpy() if isinstance(outputs, torch.Tensor) else np.asarray(outputs)
+        num_rows = len(lengths)
+        if num_rows == 0:
+            return []
+        width = labels.shape[1] if labels.ndim == 2 else 0
+
+        # 超出有效长度的位置置0，并在每行末尾追加一列0作为哨兵，使连续I的扫描不会跨行
+        padded = np.zeros((num_rows, width + 1), dtype=np.int8)
+        valid = np.arange(width) < np.minimum(np.asarray(lengths), width)[:, None]
+        padded[:, :width] = np.where(valid, labels[:num_rows], 0)
+        flat = padded.ravel()
+
+        begins = np.flatnonzero(flat == 1)
+        non_inside = np.flatnonzero(flat != 2)
+        # 每个B之后第一个非I的位置；是E则包含该位置
+        stops = non_inside[np.searchsorted(non_inside, begins + 1)]
+        ends = stops + (flat[stops] == 3)
+
+        rows = begins // (width + 1)
+        row_offsets = rows * (width + 1)
+        spans = list(zip((begins - row_offsets).tolist(), (ends - row_offsets).tolist()))
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=num_rows))]).tolist()
+        return [spans[start:end] for start, end in zip(bounds, bounds[1:])]
+
+    @staticmethod
+    def _decode_spans_loop(outputs, lengths):
+        """逐个位置扫描的参考实现，与 decode_spans 结果完全一致，用于校验与基准测试。"""
         results = []
         
-        for sentence_idx, sentence in enumerate(sentences):
-            entities = []
-            output = outputs[sentence_idx].tolist()
+        for row_idx, length in enumerate(lengths):
+            spans = []
+            output = outputs[row_idx].tolist()
             
             i = 0
-            while i < len(output) and i < len(sentence):
+            while i < len(output) and i < length:
                 if output[i] == 1:  # B标签，开始新实体
                     start = i
                     end = i + 1
                     
                     # 查找对应的I和E标签
                     j = i + 1
-                    while j < len(output) and j < len(sentence):
+                    while j < len(output) and j < length:
                         if output[j] == 2:  # I标签，继续实体
                             end = j + 1
                             j += 1
@@ -38,19 +120,44 @@ class MedicalNerModel:
                         else:  # 其他标签，结束当前实体
                             break
                     
-                    # 提取实体文本
-                    word = sentence[start:end]
-                    if word.strip():  # 确保实体不为空
-                        entities.append({
-                            'start': start,
-                            'end': end,
-                            'word': word
-                        })
-                    
+                    spans.append((start, end))
                     i = end
                 else:
                     i += 1
             
+            results.append(spans)
+        
+        return results
+
+    @staticmethod
+    def format_outputs(sentences, outputs, offset_mappings=None):
+        """
+        将模型输出转换为实体列表
+        outputs: tensor格式的输出，其中 1=B, 2=I, 3=E, 4=O
+        offset_mappings: 每个token在原句中的字符区间；为None时按一个token对应一个字符处理
+        """
+        if offset_mappings is None:
+            spans_list = MedicalNerModel.decode_spans(outputs, [len(sentence) for sentence in sentences])
+        else:
+            spans_list = MedicalNerModel.decode_spans(outputs, [len(offsets) for offsets in offset_mappings])
+
+        results = []
+        for sentence_idx, (sentence, spans) in enumerate(zip(sentences, spans_list)):
+            entities = []
+            for start, end in spans:
+                if offset_mappings is not None:
+                    # token跨度映射回字符跨度
+                    offsets = offset_mappings[sentence_idx]
+                    start, end = offsets[start][0], offsets[end - 1][1]
+                
+                # 提取实体文本
+                word = sentence[start:end]
+                if word.strip():  # 确保实体不为空
+                    entities.append({
+                        'start': start,
+                        'end': end,
+                        'word': word
+                    })
             results.append(entities)
         
         return results
@@ -72,12 +179,24 @@ class MedicalNERModule:
                 self.model = self.model.to(self.device)
             
             self.model.eval()
+
+            # 推理后端：默认torch，可按配置切换到 ONNX Runtime（仅CPU）
+            self.backend = 'torch'
+            self._onnx_session = None
+            if Config.NER_BACKEND_CONFIG.get('backend') == 'onnx':
+                self._init_onnx_backend()
             
             # 获取标签映射（BIES格式）
             self.id2label = {0: 'PAD', 1: 'B', 2: 'I', 3: 'E', 4: 'O'}
             self.label2id = {'PAD': 0, 'B': 1, 'I': 2, 'E': 3, 'O': 4}
+
+            # 实体类型关键词自动机；图谱节点名称词典由 load_entity_dictionary 按需加载
+            self._type_matcher = AhoCorasick(
+                (keyword, entity_type) for entity_type, keywords in ENTITY_TYPE_KEYWORDS for keyword in keywords
+            ).build()
+            self._entity_dictionary = {}   # 图谱节点名称 -> 节点标签
             
-            logger.info("✅ 医疗专用NER模型加载成功")
+            logger.info(f"✅ 医疗专用NER模型加载成功 (推理后端: {self.backend})")
             logger.info(f"标注格式: BIES (1=B, 2=I, 3=E, 4=O)")
             
             # 测试模型
@@ -88,6 +207,79 @@ class MedicalNERModule:
             logger.error(f"医疗NER模型加载失败: {e}")
             raise
 
+    def _init_onnx_backend(self):
+        """
+        导出（可选int8量化）并加载ONNX模型，再在验证句子上与torch输出逐token比对，
+        一致率低于 min_agreement 时保留torch后端。
+        """
+        cfg = Config.NER_BACKEND_CONFIG
+        if self.device == "cuda" and torch.cuda.is_available():
+            logger.warning("ONNX后端仅用于CPU推理，当前使用GPU，保持torch后端")
+            return
+
+        try:
+            sample = self._tokenize(BACKEND_CHECK_SENTENCES[:1])
+            dummy_inputs = {name: sample[name] for name in ('input_ids', 'attention_mask', 'token_type_ids')}
+            dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in [*dummy_inputs, 'logits']}
+            onnx_path = prepare_onnx_model(
+                self.model, dummy_inputs, cfg['onnx_path'], ['logits'], dynamic_axes,
+                quantize=cfg.get('quantize', False)
+            )
+            # 与意图识别阶段并行执行时只使用分配给NER阶段的线程数
+            threads = cfg.get('intra_op_threads') or stage_thread_counts().get('ner')
+            self._onnx_session = create_session(onnx_path, threads)
+
+            inputs = self._tokenize(BACKEND_CHECK_SENTENCES)
+            mask = inputs['attention_mask'].bool()
+            agreement = (self._predict_torch(inputs) == self._predict_onnx(inputs))[mask].float().mean().item()
+        except Exception as e:
+            logger.error(f"ONNX后端初始化失败，使用torch后端: {e}")
+            self._onnx_session = None
+            return
+
+        logger.info(f"ONNX与torch输出的逐token一致率: {agreement:.4f}")
+        if agreement < cfg.get('min_agreement', 1.0):
+            logger.warning(f"ONNX输出一致率低于 {cfg.get('min_agreement')}，使用torch后端")
+            self._onnx_session = None
+            return
+        self.backend = 'onnx-int8' if cfg.get('quantize') else 'onnx'
+
+    def _tokenize(self, sentences):
+        # 按照官方示例，不添加特殊token
+        return self.tokenizer(
+            sentences, 
+            return_tensors="pt", 
+            padding=True, 
+            add_special_tokens=False,
+            truncation=True,
+            max_length=512
+        )
+
+    def _predict(self, inputs):
+        """返回每个token的预测标签（CPU张量），padding位置为0。"""
+        if self._onnx_session is not None:
+            return self._predict_onnx(inputs)
+        return self._predict_torch(inputs)
+
+    def _predict_torch(self, inputs):
+        # 移动到设备
+        if self.device == "cuda":
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        
+        # 模型推理
+        with torch.no_grad():
+            outputs = self.model(**inputs)
+            # 获取预测结果
+            predictions = outputs.logits.argmax(-1) * inputs['attention_mask']
+        
+        # 移回CPU进行后处理
+        return predictions.cpu()
+
+    def _predict_onnx(self, inputs):
+        feeds = {node.name: inputs[node.name].numpy() for node in self._onnx_session.get_inputs()}
+        logits = self._onnx_session.run(['logits'], feeds)[0]
+        return torch.from_numpy(logits.argmax(-1)) * inputs['attention_mask']
+
     def _test_model(self):
         """测试模型功能"""
         try:
@@ -100,73 +292,67 @@ class MedicalNERModule:
 
     def extract_entities(self, text: str):
         """提取单个文本的医疗实体"""
-        logger.info(f"正在对文本进行医疗NER: '{text}'")
-        
-        if not text.strip():
-            return []
+        return self.extract_entities_many([text])[0]
+
+    def extract_entities_many(self, texts):
+        """
+        提取多个文本的医疗实体：所有非空文本合并为一次模型推理，再逐条分类、去重。
+        :return: 与输入等长的实体列表
+        """
+        for text in texts:
+            logger.info(f"正在对文本进行医疗NER: '{text}'")
+
+        results = [[] for _ in texts]
+        valid = [i for i, text in enumerate(texts) if text.strip()]
+        if not valid:
+            return results
         
         try:
             # 调用批处理方法
-            batch_results = self.extract_entities_batch([text])
-            entities = batch_results[0] if batch_results else []
+            batch_results = self.extract_entities_batch([texts[i] for i in valid])
             
-            # 转换为Neo4j实体格式并分类
-            neo4j_entities = []
-            for entity in entities:
-                word = entity['word'].strip()
-                if word and len(word) >= 2:  # 过滤太短的实体
-                    # 使用简单规则判断医疗实体类型
-                    entity_type = self._classify_medical_entity(word)
-                    
-                    if entity_type:
-                        neo4j_entities.append({
-                            'name': word,
-                            'type': entity_type,
-                            'start': entity['start'],
-                            'end': entity['end']
-                        })
-            
-            # 去重
-            unique_entities = self._deduplicate_entities(neo4j_entities)
-            
-            logger.info(f"最终提取到的实体: {unique_entities}")
-            return unique_entities
+            for i, entities in zip(valid, batch_results):
+                # 转换为Neo4j实体格式并分类
+                neo4j_entities = []
+                for entity in entities:
+                    word = entity['word'].strip()
+                    if word and len(word) >= 2:  # 过滤太短的实体
+                        # 使用简单规则判断医疗实体类型
+                        entity_type = self._classify_medical_entity(word)
+                        
+                        if entity_type:
+                            neo4j_entities.append({
+                                'name': word,
+                                'type': entity_type,
+                                'start': entity['start'],
+                                'end': entity['end']
+                            })
+                
+                # 去重
+                results[i] = self._deduplicate_entities(neo4j_entities)
+                logger.info(f"最终提取到的实体: {results[i]}")
+            return results
             
         except Exception as e:
             logger.error(f"医疗实体提取失败: {e}")
-            return []
+            return [[] for _ in texts]
 
     def extract_entities_batch(self, sentences):
-        """批量提取医疗实体"""
+        """
+        批量提取医疗实体：按token数排序分桶、每桶单独padding，超长文本切分为重叠窗口后合并，
+        实体位置通过tokenizer的offset mapping映射回原文字符区间。
+        """
         try:
             if not sentences:
                 return []
             
-            # 使用tokenizer处理输入（按照官方示例，不添加特殊token）
-            inputs = self.tokenizer(
-                sentences, 
-                return_tensors="pt", 
-                padding=True, 
-                add_special_tokens=False,
-                truncation=True,
-                max_length=512
-            )
-            
-            # 移动到设备
-            if self.device == "cuda":
-                inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            
-            # 模型推理
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-                # 获取预测结果
-                predictions = outputs.logits.argmax(-1) * inputs['attention_mask']
-            
-            # 移回CPU进行后处理
-            predictions = predictions.cpu()
+            # 按照官方示例，不添加特殊token；不截断，超长部分由滑动窗口处理
+            encodings = self.tokenizer(sentences, add_special_tokens=False, return_offsets_mapping=True)
+            token_ids = encodings['input_ids']
+            predictions = self._predict_token_labels(token_ids)
             
             # 使用格式化函数转换输出
-            entities_list = MedicalNerModel.format_outputs(sentences, predictions)
+            entities_list = MedicalNerModel.format_outputs(sentences, predictions, encodings['offset_mapping'])
             
             return entities_list
             
@@ -174,60 +360,75 @@ class MedicalNERModule:
             logger.error(f"批量实体提取失败: {e}")
             return [[] for _ in sentences]
 
+    def _predict_token_labels(self, token_ids):
+        """
+        对任意长度的token序列预测标签。
+        :param token_ids: 每个句子的token id列表
+        :return: (句子数, 最长token数) 的标签矩阵，超出各句长度的位置为0
+        """
+        cfg = Config.NER_BATCH_CONFIG
+        window = min(cfg.get('max_length', 512), self.model.config.max_position_embeddings)
+        overlap = min(cfg.get('window_overlap', 64), window // 2)
+        stride = window - overlap
+
+        # 切分窗口: (句子下标, 窗口起点, 窗口内token)
+        chunks = []
+        for idx, ids in enumerate(token_ids):
+            starts = [0]
+            while starts[-1] + window < len(ids):
+                starts.append(starts[-1] + stride)
+            chunks.extend((idx, start, ids[start:start + window]) for start in starts if ids)
+
+        # 按长度排序后每 batch_size 个窗口为一桶，桶内padding到该桶最长
+        chunk_labels = [None] * len(chunks)
+        order = sorted(range(len(chunks)), key=lambda i: len(chunks[i][2]))
+        batch_size = cfg.get('batch_size', 32)
+        pad_id = self.tokenizer.pad_token_id or 0
+        for bucket_start in range(0, len(order), batch_size):
+            bucket = order[bucket_start:bucket_start + batch_size]
+            max_len = len(chunks[bucket[-1]][2])
+            input_ids = np.full((len(bucket), max_len), pad_id, dtype=np.int64)
+            attention_mask = np.zeros((len(bucket), max_len), dtype=np.int64)
+            for row, i in enumerate(bucket):
+                ids = chunks[i][2]
+                input_ids[row, :len(ids)] = ids
+                attention_mask[row, :len(ids)] = 1
+            inputs = {
+                'input_ids': torch.from_numpy(input_ids),
+                'attention_mask': torch.from_numpy(attention_mask),
+                'token_type_ids': torch.zeros_like(torch.from_numpy(input_ids)),
+            }
+            predictions = self._predict(inputs).numpy()
+            for row, i in enumerate(bucket):
+                chunk_labels[i] = predictions[row, :len(chunks[i][2])]
+
+        # 合并窗口：重叠区域前一半取前一个窗口的预测，后一半取后一个窗口的预测
+        labels = np.zeros((len(token_ids), max((len(ids) for ids in token_ids), default=0)), dtype=np.int64)
+        for i, (idx, start, ids) in enumerate(chunks):
+            is_first = start == 0
+            is_last = start + len(ids) >= len(token_ids[idx])
+            own_start = start if is_first else start + overlap // 2
+            own_end = start + len(ids) if is_last else start + window - (overlap - overlap // 2)
+            labels[idx, own_start:own_end] = chunk_labels[i][own_start - start:own_end - start]
+        return labels
+
     def _classify_medical_entity(self, word):
         """简单规则分类医疗实体到Neo4j类型"""
         # Neo4j实体类型: Check, Department, Disease, Drug, Food, Symptom
         
-        # 疾病相关关键词（最常见的）
-        if any(keyword in word for keyword in [
-            '病', '症', '炎', '癌', '瘤', '血压', '糖尿', '痛风', '感冒', '发烧',
-            '肺炎', '胃炎', '肝炎', '肾炎', '心脏病', '脑梗', '中风', '骨折',
-            '钙化', '结石', '囊肿', '增生', '硬化', '萎缩', '狭窄', '梗阻'
-        ]) or word.endswith(('病', '症', '炎', '癌')):
-            return 'Disease'
-        
-        # 症状相关关键词
-        elif any(keyword in word for keyword in [
-            '疼', '痛', '酸', '胀', '麻', '痒', '热', '冷', '晕', '乏力',
-            '恶心', '呕吐', '腹泻', '便秘', '咳嗽', '气短', '心慌', '失眠',
-            '头晕', '头痛', '胸闷', '腹胀', '食欲不振', '体重下降'
-        ]) or any(word.endswith(suffix) for suffix in ['疼', '痛', '胀', '酸', '麻']):
-            return 'Symptom'
-        
-        # 药物相关关键词  
-        elif any(keyword in word for keyword in [
-            '针', '片', '胶囊', '颗粒', '丸', '散', '膏', '液', '素', '林', '霉素',
-            '阿司匹林', '布洛芬', '青霉素', '胰岛素', '玻尿酸', '肉毒素',
-            '药', '剂', '制剂', '注射', '滴眼', '滴鼻', '口服', '外用'
-        ]) or word.endswith(('片', '胶囊', '颗粒', '丸', '散', '膏', '液', '针')):
-            return 'Drug'
-        
-        # 检查相关关键词
-        elif any(keyword in word for keyword in [
-            'CT', 'MRI', 'X光', 'B超', '彩超', '心电图', '脑电图', '肌电图',
-            '血常规', '尿常规', '肝功', '肾功', '血糖', '血脂', '血压',
-            '检查', '检验', '化验', '筛查', '监测', '测定', '分析'
-        ]) or word.endswith(('检查', '检验', '化验')):
-            return 'Check'
-        
-        # 科室相关关键词
-        elif any(keyword in word for keyword in [
-            '科', '内科', '外科', '儿科', '妇科', '骨科', '眼科', '耳鼻喉',
-            '皮肤科', '神经科', '心内科', '消化科', '呼吸科', '肿瘤科',
-            '急诊', '门诊', '病房', '诊室'
-        ]) or word.endswith('科'):
-            return 'Department'
-        
-        # 食物相关关键词
-        elif any(keyword in word for keyword in [
-            '食物', '食品', '饮食', '营养', '蛋白', '维生素', '钙', '铁', '锌',
-            '水果', '蔬菜', '肉类', '海鲜', '豆类', '坚果', '奶制品', '主食',
-            '米', '面', '肉', '鱼', '虾', '蟹', '奶', '蛋'
-        ]):
-            return 'Food'
+        # 图谱节点名称词典优先：实体恰好是某个节点名称时直接采用该节点的类型
+        label = self._entity_dictionary.get(word)
+        if label is not None:
+            return label
+
+        # 一次扫描找出实体中出现的全部类型关键词，按类型优先级取第一个
+        matched_types = {entity_type for _, _, entity_type in self._type_matcher.iter_matches(word)}
+        for entity_type, _ in ENTITY_TYPE_KEYWORDS:
+            if entity_type in matched_types:
+                return entity_type
         
         # 默认分类：根据长度和常见模式
-        elif len(word) >= 3:
+        if len(word) >= 3:
             # 较长的医疗实体通常是疾病名
             return 'Disease'
         elif len(word) == 2:
@@ -237,6 +438,20 @@ class MedicalNERModule:
         # 无法分类的不保留
         return None
 
+    def load_entity_dictionary(self, names_by_label):
+        """
+        用图谱中的全部节点名称构建实体类型词典，供 _classify_medical_entity 优先使用。
+        :param names_by_label: {节点标签: [节点名称]}，同名节点以先出现的标签为准
+        """
+        # 只需整词精确匹配，直接用字典查找
+        dictionary = {}
+        for label, names in names_by_label.items():
+            for name in names:
+                if name:
+                    dictionary.setdefault(name, label)
+        self._entity_dictionary = dictionary
+        logger.info(f"实体类型词典已加载: {len(dictionary)} 个节点名称")
+
     def _deduplicate_entities(self, entities):
         """去重实体"""
         seen = {}
@@ -262,6 +477,7 @@ class MedicalNERModule:
         return {
             'model_name': self.model_name,
             'device': self.device,
+            'backend': self.backend,
             'labels': list(self.id2label.values()),
             'num_labels': len(self.id2label),
             'model_type': 'Medical_BERT_NER',
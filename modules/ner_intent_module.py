@@ -1,8 +1,14 @@
 # modules/ner_intent_module.py
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
 # 确保导入的是我们新编写的、有实际功能的模块
 from .medical_ner_module import MedicalNERModule
 from .medical_intent_module import MedicalIntentModule
+from .batching_module import MicroBatcher
+from .onnx_module import stage_thread_counts
 
 logger = logging.getLogger(__name__)
 
@@ -18,18 +24,92 @@ class NERIntentModule:
             logger.error(f"NER与意图识别模块初始化失败: {e}")
             raise
 
+        # NER与意图识别两个阶段相互独立，各用一个专用线程并行执行。
+        # 线程数的划分只作用于各阶段的ONNX Runtime会话（intra_op_num_threads 按会话生效）；
+        # torch.set_num_threads 是进程级设置，会连带降低LLM生成与请求线程的并行度，因此这里不修改
+        stage_threads = stage_thread_counts()
+        self._ner_executor = self._intent_executor = None
+        if stage_threads:
+            self._ner_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ner-stage')
+            self._intent_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='intent-stage')
+            logger.info(f"NER与意图识别并行执行，ONNX Runtime线程数划分: "
+                        f"NER={stage_threads['ner']}, 意图={stage_threads['intent']}")
+
+        self._timing_lock = threading.Lock()
+        self._timing = {'calls': 0, 'ner_ms': 0.0, 'intent_ms': 0.0, 'total_ms': 0.0, 'max_total_ms': 0.0}
+
+        # 并发请求合并：同一时间窗口内的查询合并为一次NER推理和一次意图编码
+        batch_config = Config.MICRO_BATCH_CONFIG
+        self._batcher = None
+        if batch_config.get('enabled', True):
+            self._batcher = MicroBatcher(
+                self.analyze_queries,
+                max_batch_size=batch_config.get('max_batch_size', 16),
+                max_wait_ms=batch_config.get('max_wait_ms', 5),
+                name='ner-intent-batcher'
+            )
+
     def analyze_query(self, query: str):
         try:
-            entities = self.ner_model.extract_entities(query)
-            intent = self.intent_model.recognize_intent(query)
-            
-            return {
-                "intent": intent,
-                "entities": entities
-            }
+            if self._batcher is not None:
+                return self._batcher(query)
+            return self.analyze_queries([query])[0]
         except Exception as e:
             logger.error(f"查询分析失败: {e}")
             return {
                 "intent": "unknown_error",
                 "entities": []
-            }
\ No newline at end of file
+            }
+
+    def analyze_queries(self, queries):
+        """
+        批量分析查询：所有查询做一次padding后的NER推理和一次意图编码，两个阶段并行执行。
+        :return: 与输入等长的 {"intent", "entities", "timing"} 列表，timing 为本批各阶段耗时（毫秒）
+        """
+        start = time.perf_counter()
+        if self._ner_executor is not None:
+            ner_future = self._ner_executor.submit(self._timed, self.ner_model.extract_entities_many, queries)
+            intent_future = self._intent_executor.submit(self._timed, self.intent_model.recognize_intents_batch, queries)
+            entities_list, ner_ms = ner_future.result()
+            intents, intent_ms = intent_future.result()
+        else:
+            entities_list, ner_ms = self._timed(self.ner_model.extract_entities_many, queries)
+            intents, intent_ms = self._timed(self.intent_model.recognize_intents_batch, queries)
+        timing = {'ner_ms': ner_ms, 'intent_ms': intent_ms, 'total_ms': (time.perf_counter() - start) * 1000}
+        self._record_timing(timing)
+        logger.info(f"查询分析耗时: NER {ner_ms:.1f}ms, 意图识别 {intent_ms:.1f}ms, 合计 {timing['total_ms']:.1f}ms")
+
+        return [
+            {"intent": intent, "entities": entities, "timing": timing}
+            for intent, entities in zip(intents, entities_list)
+        ]
+
+    @staticmethod
+    def _timed(func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        return result, (time.perf_counter() - start) * 1000
+
+    def _record_timing(self, timing):
+        with self._timing_lock:
+            self._timing['calls'] += 1
+            for key in ('ner_ms', 'intent_ms', 'total_ms'):
+                self._timing[key] += timing[key]
+            self._timing['max_total_ms'] = max(self._timing['max_total_ms'], timing['total_ms'])
+
+    def stage_timing_stats(self):
+        """返回各阶段的平均耗时（毫秒）；并行执行时 total 应接近两阶段中较慢者而非二者之和。"""
+        with self._timing_lock:
+            calls = self._timing['calls']
+            return {
+                'calls': calls,
+                'parallel': self._ner_executor is not None,
+                'avg_ner_ms': self._timing['ner_ms'] / calls if calls else 0.0,
+                'avg_intent_ms': self._timing['intent_ms'] / calls if calls else 0.0,
+                'avg_total_ms': self._timing['total_ms'] / calls if calls else 0.0,
+                'max_total_ms': self._timing['max_total_ms'],
+            }
+
+    def batching_stats(self):
+        """返回请求合并的批次统计；未启用时返回None。"""
+        return self._batcher.stats() if self._batcher is not None else None
@@ -0,0 +1,99 @@
+# modules/onnx_module.py
+import logging
+import os
+import torch
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def export_to_onnx(model, dummy_inputs, onnx_path, output_names, dynamic_axes, opset_version=14):
+    """
+    将PyTorch模型导出为ONNX。
+    :param model: 处于 eval 模式的 torch.nn.Module
+    :param dummy_inputs: {输入名: 示例张量}，顺序需与模型 forward 的参数顺序一致
+    :param onnx_path: 导出文件路径
+    :param output_names: 输出名列表
+    :param dynamic_axes: 动态维度声明，例如 {'input_ids': {0: 'batch', 1: 'sequence'}}
+    """
+    os.makedirs(os.path.dirname(onnx_path) or '.', exist_ok=True)
+    logger.info(f"正在导出ONNX模型: {onnx_path}")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(dummy_inputs.values()),
+            onnx_path,
+            input_names=list(dummy_inputs.keys()),
+            output_names=output_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=opset_version,
+            do_constant_folding=True,
+            dynamo=False,  # 使用基于TorchScript的导出器以支持 dynamic_axes
+        )
+
+
+def quantize_onnx(onnx_path, quantized_path):
+    """对ONNX模型做动态int8量化（权重量化，激活在推理时动态量化）。"""
+    try:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+    except ImportError:
+        raise ImportError("检测到 'onnxruntime' 库未安装。请先执行: pip install onnxruntime")
+
+    logger.info(f"正在对ONNX模型做动态int8量化: {quantized_path}")
+    quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QInt8)
+
+
+def prepare_onnx_model(model, dummy_inputs, onnx_path, output_names, dynamic_axes, quantize=False):
+    """
+    返回可用于推理的ONNX文件路径：文件不存在时导出，需要量化时生成 *.int8.onnx。
+    """
+    if not os.path.exists(onnx_path):
+        export_to_onnx(model, dummy_inputs, onnx_path, output_names, dynamic_axes)
+    if not quantize:
+        return onnx_path
+
+    quantized_path = f"{os.path.splitext(onnx_path)[0]}.int8.onnx"
+    if not os.path.exists(quantized_path):
+        quantize_onnx(onnx_path, quantized_path)
+    return quantized_path
+
+
+def create_session(onnx_path, intra_op_threads=None):
+    """
+    创建CPU推理会话。intra_op_threads 为单个算子内部的并行线程数，默认使用物理核心数。
+    """
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        raise ImportError("检测到 'onnxruntime' 库未安装。请先执行: pip install onnxruntime")
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = intra_op_threads or physical_cores()
+    options.inter_op_num_threads = 1
+    logger.info(f"创建ONNX Runtime会话: {onnx_path} (intra_op_threads={options.intra_op_num_threads})")
+    return ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+
+
+def stage_thread_counts():
+    """
+    NER与意图识别并行执行时两阶段各自的推理线程数 {'ner': n, 'intent': m}，合计不超过物理核心数；
+    未开启阶段并行时返回空字典（各阶段独占全部核心）。
+    """
+    stage_config = Config.STAGE_PARALLEL_CONFIG
+    if not stage_config.get('enabled', True):
+        return {}
+    cores = physical_cores()
+    ner_threads = stage_config.get('ner_threads') or max(1, cores // 2)
+    intent_threads = stage_config.get('intent_threads') or max(1, cores - ner_threads)
+    return {'ner': ner_threads, 'intent': intent_threads}
+
+
+def physical_cores():
+    """物理核心数（无法获取时退化为逻辑核心数），用于划分推理线程。"""
+    try:
+        import psutil
+        return psutil.cpu_count(logical=False) or os.cpu_count() or 1
+    except ImportError:
+        return os.cpu_count() or 1
@@ -0,0 +1,458 @@
+# modules/scheduler_module.py
+import logging
+import queue
+import threading
+from concurrent.futures import Future, InvalidStateError
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# 调度器支持的逐序列生成参数，其余参数会被忽略
+SUPPORTED_GENERATION_KEYS = {
+    'max_length', 'max_new_tokens', 'do_sample', 'temperature', 'top_p', 'top_k',
+    'repetition_penalty', 'eos_token_id', 'pad_token_id', 'stop_sequences'
+}
+
+
+def contains_stop_sequence(tokenizer, token_ids, stop_sequences):
+    """
+    已生成token的末尾窗口解码后是否出现任一停止序列；窗口取最长停止序列的字符数再加少量余量。
+    比较时忽略空白（部分分词器解码中文时会在字间插入空格）。
+    """
+    window = max(len(stop) for stop in stop_sequences) + 4
+    text = ''.join(tokenizer.decode(token_ids[-window:], skip_special_tokens=True).split())
+    return any(''.join(stop.split()) in text for stop in stop_sequences)
+
+
+class _Sequence:
+    """调度器中的一条生成请求及其逐序列的采样参数与生成状态。"""
+
+    def __init__(self, prompt_ids, config, eos_token_ids, streamer, future, prefix_lengths=(), tokenizer=None):
+        self.prompt_ids = prompt_ids
+        # 可复用KV缓存的前缀边界（token数），按升序排列且小于prompt长度
+        self.prefix_lengths = sorted({n for n in prefix_lengths if 0 < n < len(prompt_ids)})
+        self.max_new_tokens = config['max_new_tokens']
+        self.do_sample = config['do_sample']
+        self.temperature = config['temperature']
+        self.top_p = config['top_p']
+        self.top_k = config['top_k']
+        self.repetition_penalty = config['repetition_penalty']
+        self.stop_sequences = config['stop_sequences']
+        self.tokenizer = tokenizer
+        self.stopped = False
+        self.eos_token_ids = eos_token_ids
+        self.streamer = streamer
+        self.future = future
+        self.generated = []
+
+    def append(self, token):
+        self.generated.append(token)
+        if self.stop_sequences and not self.stopped:
+            self.stopped = contains_stop_sequence(self.tokenizer, self.generated, self.stop_sequences)
+        if self.streamer is not None:
+            self.streamer.put(torch.tensor([token]))
+
+    @property
+    def finished(self):
+        # 调用方取消 Future 后序列视为已结束，在下一个解码步后移出批次
+        return self.future.cancelled() or self.stopped or len(self.generated) >= self.max_new_tokens or (
+            bool(self.generated) and self.generated[-1] in self.eos_token_ids
+        )
+
+
+class ContinuousBatchScheduler:
+    """
+    连续批处理（continuous batching）生成调度器：后台线程维护一个正在解码的批次，
+    每个解码步之前把新到达的请求预填充后并入批次，每步之后把已结束的序列移出批次，
+    多个并发请求因此共享同一次前向计算，而不必排队等待前一个请求整段生成完毕。
+
+    各序列的KV缓存按左侧补齐到相同长度后沿batch维拼接，注意力掩码与位置编号按序列分别维护；
+    温度、top_p 等采样参数逐序列生效。提供 prefix_cache 时，预填充会复用相同prompt前缀的KV状态，
+    只计算前缀之后的部分。
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=8, kv_layout=None, prefix_cache=None, name='llm-scheduler'):
+        """
+        :param model: 已加载的因果语言模型（需支持 past_key_values / attention_mask / position_ids）。
+        :param max_batch_size: 同时解码的最大序列数，超出的请求在队列中等待。
+        :param kv_layout: KV缓存张量的 (batch维, 序列维)；None 时按模型类型推断
+                          （ChatGLM 为 (1, 0)，其余 transformers 模型为 (0, 2)）。
+        :param prefix_cache: 可选的 LRUCache，以前缀token id元组为键缓存预填充得到的KV状态。
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        if kv_layout is None:
+            model_type = getattr(getattr(model, 'config', None), 'model_type', '')
+            kv_layout = (1, 0) if model_type == 'chatglm' else (0, 2)
+        self.batch_dim, self.seq_dim = kv_layout
+        self.device = next(model.parameters()).device
+
+        generation_config = getattr(model, 'generation_config', None)
+        eos = getattr(generation_config, 'eos_token_id', None)
+        if eos is None:
+            eos = tokenizer.eos_token_id
+        self.default_eos_token_ids = set(eos if isinstance(eos, (list, tuple)) else [eos]) - {None}
+        self.default_top_k = getattr(generation_config, 'top_k', None) or 0
+        self.prefix_cache = prefix_cache
+
+        self._queue = queue.Queue()
+        self._submit_lock = threading.Lock()
+        self._closed = False
+        self._active = []
+        self._past = None   # 每层的 (key, value)，沿 batch_dim 对应 self._active
+        self._mask = None   # [batch, kv长度] 的注意力掩码，左侧补齐部分为0
+
+        self._lock = threading.Lock()
+        self._steps = 0
+        self._step_sequences = 0
+        self._sequences = 0
+        self._generated_tokens = 0
+        self._max_batch = 0
+        self._prefill_tokens = 0
+        self._reused_tokens = 0
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, input_ids, gen_kwargs=None, streamer=None, prefix_lengths=()):
+        """
+        提交一条生成请求，返回 Future，结果为新生成的token id列表（含结束符）。
+        :param input_ids: 单条prompt的token id（一维列表或张量，不含padding）。
+        :param gen_kwargs: 生成参数，取值方式与 model.generate 相同；另支持 stop_sequences（生成出任一停止序列后结束）。
+        :param streamer: 可选的 transformers 流式输出器（如 TextIteratorStreamer），
+                         与 model.generate 一样先收到prompt，再逐个收到新token，结束时调用 end()。
+        :param prefix_lengths: prompt中可复用KV缓存的前缀长度（token数），如固定的系统指令部分；
+                               未提供 prefix_cache 时忽略。
+        调用方可对返回的 Future 调用 cancel() 放弃请求（如客户端断开连接），
+        尚未开始的请求不再预填充，已在批次中的序列在下一个解码步后移出并释放其KV缓存。
+        """
+        if torch.is_tensor(input_ids):
+            input_ids = input_ids.reshape(-1).tolist()
+        prompt_ids = list(input_ids)
+        config = self._resolve_config(gen_kwargs or {}, len(prompt_ids))
+        eos = config['eos_token_id']
+        eos_token_ids = self.default_eos_token_ids if eos is None else set(eos if isinstance(eos, (list, tuple)) else [eos])
+
+        future = Future()
+        if self.prefix_cache is None:
+            prefix_lengths = ()
+        sequence = _Sequence(prompt_ids, config, eos_token_ids, streamer, future, prefix_lengths, self.tokenizer)
+        # 与工作线程退出时的清理互斥，保证入队的请求要么被处理，要么被置为失败
+        with self._submit_lock:
+            if self._closed:
+                raise RuntimeError("ContinuousBatchScheduler 已关闭")
+            self._queue.put(sequence)
+        return future
+
+    def generate(self, input_ids, gen_kwargs=None, streamer=None, timeout=None, prefix_lengths=()):
+        """提交一条生成请求并阻塞等待，返回新生成的token id列表。"""
+        return self.submit(input_ids, gen_kwargs, streamer, prefix_lengths).result(timeout=timeout)
+
+    def close(self):
+        """停止后台线程；已提交的请求会先生成完。"""
+        with self._submit_lock:
+            self._closed = True
+            self._queue.put(None)
+        self._worker.join()
+
+    def stats(self):
+        """
+        返回解码步数、完成的序列数、生成的token数、每个解码步的平均与最大批大小，
+        以及预填充实际计算与从前缀缓存复用的token数。
+        """
+        with self._lock:
+            return {
+                'steps': self._steps,
+                'sequences': self._sequences,
+                'generated_tokens': self._generated_tokens,
+                'avg_batch_size': self._step_sequences / self._steps if self._steps else 0.0,
+                'max_batch_size': self._max_batch,
+                'prefill_tokens': self._prefill_tokens,
+                'reused_prefix_tokens': self._reused_tokens,
+                'prefix_cache': self.prefix_cache.stats() if self.prefix_cache is not None else None,
+            }
+
+    def _resolve_config(self, gen_kwargs, prompt_length):
+        ignored = set(gen_kwargs) - SUPPORTED_GENERATION_KEYS
+        if ignored:
+            logger.warning(f"连续批处理调度器忽略不支持的生成参数: {sorted(ignored)}")
+        max_new_tokens = gen_kwargs.get('max_new_tokens')
+        if max_new_tokens is None:
+            max_new_tokens = gen_kwargs.get('max_length', 2048) - prompt_length
+        top_k = gen_kwargs.get('top_k')
+        return {
+            'max_new_tokens': max(1, max_new_tokens),
+            'do_sample': gen_kwargs.get('do_sample', False),
+            'temperature': gen_kwargs.get('temperature') or 1.0,
+            'top_p': gen_kwargs.get('top_p') or 1.0,
+            'top_k': self.default_top_k if top_k is None else top_k,
+            'repetition_penalty': gen_kwargs.get('repetition_penalty') or 1.0,
+            'eos_token_id': gen_kwargs.get('eos_token_id'),
+            'stop_sequences': tuple(gen_kwargs.get('stop_sequences') or ()),
+        }
+
+    def _run(self):
+        try:
+            self._loop()
+        finally:
+            # 工作线程退出（正常关闭或未预期的错误）后拒绝新请求，并让仍未完成的请求失败，避免调用方永久阻塞
+            with self._submit_lock:
+                self._closed = True
+                pending = self._active
+                while True:
+                    try:
+                        sequence = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if sequence is not None:
+                        pending.append(sequence)
+            self._active, self._past, self._mask = [], None, None
+            if pending:
+                logger.error(f"连续批处理调度器已停止，{len(pending)} 条未完成的请求失败")
+                self._fail(pending, RuntimeError("ContinuousBatchScheduler 已停止"))
+
+    def _loop(self):
+        stopping = False
+        with torch.inference_mode():
+            while True:
+                admitting = None
+                try:
+                    # 批次为空时阻塞等待新请求；否则只取出已到达的请求，不耽误下一个解码步
+                    while not stopping and len(self._active) < self.max_batch_size:
+                        try:
+                            sequence = self._queue.get(block=not self._active)
+                        except queue.Empty:
+                            break
+                        if sequence is None:
+                            stopping = True
+                            break
+                        if sequence.future.cancelled():
+                            self._finish(sequence)
+                            continue
+                        admitting = sequence
+                        self._admit(sequence)
+                        admitting = None
+
+                    if self._active:
+                        self._step()
+                    elif stopping:
+                        return
+                except Exception as e:
+                    # 合并KV缓存时显存不足、流式输出器出错等：当前批次全部失败，清空批次后继续处理后续请求
+                    failed = self._active + ([admitting] if admitting is not None and admitting not in self._active else [])
+                    logger.error(f"调度器处理批次时出错，{len(failed)} 条请求失败: {e}", exc_info=True)
+                    self._active, self._past, self._mask = [], None, None
+                    self._fail(failed, e)
+
+    def _admit(self, sequence):
+        """
+        预填充一条新请求，采样其第一个token，并把它的KV缓存并入当前批次。
+        命中前缀缓存时从最长的已缓存前缀继续预填充；途经的各前缀边界的KV状态写入缓存供后续请求复用。
+        """
+        try:
+            ids = sequence.prompt_ids
+            length = len(ids)
+            past, start = None, 0
+            for boundary in reversed(sequence.prefix_lengths):
+                cached = self.prefix_cache.get(tuple(ids[:boundary]))
+                if cached is not None:
+                    past, start = cached, boundary
+                    break
+            reused = start
+
+            for end in [n for n in sequence.prefix_lengths if n > start] + [length]:
+                outputs = self.model(
+                    input_ids=torch.tensor([ids[start:end]], device=self.device),
+                    attention_mask=torch.ones(1, end, dtype=torch.long, device=self.device),
+                    position_ids=torch.arange(start, end, device=self.device).unsqueeze(0),
+                    past_key_values=past,
+                    use_cache=True,
+                    return_dict=True
+                )
+                past = self._to_legacy(outputs.past_key_values)
+                if end < length:
+                    self.prefix_cache.put(tuple(ids[:end]), past)
+                start = end
+
+            with self._lock:
+                self._prefill_tokens += length - reused
+                self._reused_tokens += reused
+            if sequence.streamer is not None:
+                sequence.streamer.put(torch.tensor([ids]))
+            sequence.append(self._sample(outputs.logits[:, -1, :], [sequence])[0])
+        except Exception as e:
+            logger.error(f"预填充失败: {e}", exc_info=True)
+            self._fail([sequence], e)
+            return
+
+        if sequence.finished:
+            self._finish(sequence)
+            return
+        mask = torch.ones(1, length, dtype=torch.long, device=self.device)
+        if self._past is None:
+            self._past, self._mask = past, mask
+        else:
+            self._past, self._mask = self._concat(self._past, self._mask, past, mask)
+        self._active.append(sequence)
+
+    def _step(self):
+        """对当前批次执行一个解码步：每条序列输入其最新token，采样下一个token，并移出已结束的序列。"""
+        batch = self._active
+        try:
+            input_ids = torch.tensor([[seq.generated[-1]] for seq in batch], device=self.device)
+            # 新token的位置编号 = 该序列已有的真实token数（不计左侧补齐）
+            position_ids = self._mask.sum(dim=1, keepdim=True)
+            self._mask = torch.cat([self._mask, self._mask.new_ones(len(batch), 1)], dim=1)
+            outputs = self.model(
+                input_ids=input_ids,
+                attention_mask=self._mask,
+                position_ids=position_ids,
+                past_key_values=self._past,
+                use_cache=True,
+                return_dict=True
+            )
+            self._past = self._to_legacy(outputs.past_key_values)
+            tokens = self._sample(outputs.logits[:, -1, :], batch)
+        except Exception as e:
+            logger.error(f"解码步失败，批次内 {len(batch)} 条请求全部失败: {e}", exc_info=True)
+            self._active, self._past, self._mask = [], None, None
+            self._fail(batch, e)
+            return
+
+        for seq, token in zip(batch, tokens):
+            seq.append(token)
+        with self._lock:
+            self._steps += 1
+            self._step_sequences += len(batch)
+            self._max_batch = max(self._max_batch, len(batch))
+
+        keep = [i for i, seq in enumerate(batch) if not seq.finished]
+        if len(keep) == len(batch):
+            return
+        for seq in batch:
+            if seq.finished:
+                self._finish(seq)
+        self._active = [batch[i] for i in keep]
+        if not keep:
+            self._past, self._mask = None, None
+            return
+        index = torch.tensor(keep, device=self.device)
+        mask = self._mask.index_select(0, index)
+        # 丢弃所有剩余序列都为补齐的左侧列，缩短后续解码步的注意力长度
+        offset = int((mask.sum(dim=0) == 0).long().cumprod(dim=0).sum())
+        self._mask = mask[:, offset:]
+        self._past = tuple(
+            tuple(self._narrow(t.index_select(self.batch_dim, index), offset) for t in layer)
+            for layer in self._past
+        )
+
+    def _sample(self, logits, sequences):
+        """按每条序列各自的重复惩罚、温度、top_k/top_p 与是否采样，从最后一个位置的logits选出下一个token。"""
+        logits = logits.float()
+        for row, seq in enumerate(sequences):
+            if seq.repetition_penalty != 1.0:
+                seen = torch.tensor(seq.prompt_ids + seq.generated, device=logits.device)
+                score = logits[row].gather(0, seen)
+                score = torch.where(score < 0, score * seq.repetition_penalty, score / seq.repetition_penalty)
+                logits[row].scatter_(0, seen, score)
+
+        tokens = logits.argmax(dim=-1)
+        rows = [row for row, seq in enumerate(sequences) if seq.do_sample]
+        if rows:
+            index = torch.tensor(rows, device=logits.device)
+            selected = [sequences[row] for row in rows]
+            temperature = torch.tensor([[seq.temperature] for seq in selected], device=logits.device)
+            scores = logits.index_select(0, index) / temperature
+            vocab_size = scores.shape[-1]
+            top_k = torch.tensor(
+                [[seq.top_k if 0 < seq.top_k < vocab_size else vocab_size] for seq in selected], device=logits.device
+            )
+            top_p = torch.tensor([[seq.top_p] for seq in selected], device=logits.device)
+
+            sorted_scores, sorted_index = scores.sort(dim=-1, descending=True)
+            probs = sorted_scores.softmax(dim=-1)
+            ranks = torch.arange(vocab_size, device=logits.device).unsqueeze(0)
+            # top_p：保留累计概率达到 top_p 所需的最少token（至少保留一个）
+            removed = (ranks >= top_k) | (probs.cumsum(dim=-1) - probs > top_p)
+            probs = probs.masked_fill(removed, 0.0)
+            choice = torch.multinomial(probs, num_samples=1)
+            tokens[index] = sorted_index.gather(1, choice).squeeze(1)
+        return tokens.tolist()
+
+    def _concat(self, past, mask, new_past, new_mask):
+        """把两组KV缓存左侧补齐到相同长度后沿batch维拼接。"""
+        length, new_length = mask.shape[1], new_mask.shape[1]
+        target = max(length, new_length)
+        past = self._left_pad(past, target - length)
+        new_past = self._left_pad(new_past, target - new_length)
+        mask = torch.nn.functional.pad(mask, (target - length, 0))
+        new_mask = torch.nn.functional.pad(new_mask, (target - new_length, 0))
+        merged = tuple(
+            tuple(torch.cat([a, b], dim=self.batch_dim) for a, b in zip(layer, new_layer))
+            for layer, new_layer in zip(past, new_past)
+        )
+        return merged, torch.cat([mask, new_mask], dim=0)
+
+    def _left_pad(self, past, pad):
+        if not pad:
+            return past
+        padded = []
+        for layer in past:
+            tensors = []
+            for t in layer:
+                shape = list(t.shape)
+                shape[self.seq_dim] = pad
+                tensors.append(torch.cat([t.new_zeros(shape), t], dim=self.seq_dim))
+            padded.append(tuple(tensors))
+        return tuple(padded)
+
+    def _narrow(self, tensor, offset):
+        if not offset:
+            return tensor
+        return tensor.narrow(self.seq_dim, offset, tensor.shape[self.seq_dim] - offset)
+
+    @staticmethod
+    def past_nbytes(past_key_values):
+        """KV缓存占用的字节数，供前缀缓存按内存上限淘汰。"""
+        return sum(t.numel() * t.element_size() for layer in past_key_values for t in layer)
+
+    @staticmethod
+    def _to_legacy(past_key_values):
+        # 新版 transformers 可能返回 Cache 对象，统一转换为每层 (key, value) 的元组
+        if hasattr(past_key_values, 'to_legacy_cache'):
+            return past_key_values.to_legacy_cache()
+        return past_key_values
+
+    def _finish(self, sequence):
+        # 先设置结果再结束文本流，流的消费方读完后即可取到结果或异常；已取消的请求只结束文本流
+        cancelled = not self._resolve(sequence.future, result=sequence.generated)
+        if sequence.streamer is not None:
+            sequence.streamer.end()
+        if cancelled:
+            return
+        with self._lock:
+            self._sequences += 1
+            self._generated_tokens += len(sequence.generated)
+
+    @staticmethod
+    def _fail(sequences, error):
+        for seq in sequences:
+            ContinuousBatchScheduler._resolve(seq.future, error=error)
+            if seq.streamer is not None:
+                try:
+                    seq.streamer.end()
+                except Exception as e:
+                    logger.warning(f"结束流式输出失败: {e}")
+
+    @staticmethod
+    def _resolve(future, result=None, error=None):
+        """设置 Future 的结果或异常；Future 已被调用方取消时返回 False。"""
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+            return True
+        except InvalidStateError:
+            return False